@@ -1,8 +1,7 @@
-import asyncio
-
-from app.models import Feedback, Result, Session, db
+from app.models import Feedback, Result, db
+from app.services import client_service
 from app.services.result_service import get_cached_response, make_results
-from app.services.session_service import create_new_session
+from app.services.session_service import create_new_session, has_session
 from app.services.system_service import get_least_served_system
 from flask import Response, current_app, json, jsonify, request
 
@@ -245,7 +244,7 @@ def ranking():
 
     # fetch result from db if it exists
     session_id = request.args.get("sid", None)
-    session_exists = db.session.query(Session).filter_by(id=session_id).first()
+    session_exists = has_session(session_id)
 
     # without a session ID we can not guarantee consistency and avoid showing different users the same results
     if session_exists:
@@ -256,6 +255,8 @@ def ranking():
                 json.dumps(response, sort_keys=False, ensure_ascii=False, indent=2),
                 mimetype="application/json",
             )
+        # the session may have been deleted by the sync since it was cached
+        session_exists = has_session(session_id, cached=False)
 
     if container_name is None:
         current_app.logger.debug("No container name provided")
@@ -265,7 +266,7 @@ def ranking():
         current_app.logger.debug(f"Session {session_id} does not exist, create new")
         session_id = create_new_session(container_name, sid=session_id, type="ranker")
 
-    response = asyncio.run(make_results(container_name, query, rpp, page, session_id))
+    response = client_service.run(make_results(container_name, query, rpp, page, session_id))
     return Response(
         json.dumps(response, sort_keys=False, ensure_ascii=False, indent=2),
         mimetype="application/json",
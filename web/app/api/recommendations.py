@@ -1,9 +1,9 @@
-import asyncio
 from typing import Tuple
 
-from app.models import Feedback, Result, Session, db
+from app.models import Feedback, Result, db
+from app.services import client_service
 from app.services.result_service import get_cached_response, make_results
-from app.services.session_service import create_new_session
+from app.services.session_service import create_new_session, has_session
 from app.services.system_service import get_least_served_system
 from flask import Response, current_app, json, jsonify, request
 
@@ -255,7 +255,7 @@ def recommendation():
 
     # fetch result from db if it exists
     session_id = request.args.get("sid", None)
-    session_exists = db.session.query(Session).filter_by(id=session_id).first()
+    session_exists = has_session(session_id)
 
     if session_exists:
         current_app.logger.debug(f"Session {session_id} exists, try to get cached")
@@ -265,6 +265,8 @@ def recommendation():
                 json.dumps(response, sort_keys=False, ensure_ascii=False, indent=2),
                 mimetype="application/json",
             )
+        # the session may have been deleted by the sync since it was cached
+        session_exists = has_session(session_id, cached=False)
 
     if container_name is None:
         current_app.logger.debug("No container name provided")
@@ -276,7 +278,7 @@ def recommendation():
             container_name, sid=session_id, type="recommendation"
         )
 
-    response = asyncio.run(
+    response = client_service.run(
         make_results(
             container_name,
             itemid,
@@ -3,7 +3,7 @@ from . import api
 from app.models import db, System
 from flask import jsonify, session
 from flask import current_app
-from config import parse_systems_config
+from app.services.registry_service import apply_systems_config, publish_systems_config
 import os
 import json
 
@@ -66,15 +66,8 @@ def update_system():
             current_app.logger.info(f"System added: {systemName}")
         
 
-    # Update SYSTEMS_CONFIG related lists
-    (
-        current_app.config["RANKING_CONTAINER_NAMES"],
-        current_app.config["RANKING_PRECOMPUTED_CONTAINER_NAMES"],
-        current_app.config["RANKING_BASELINE_CONTAINER"],
-        current_app.config["RECOMMENDER_CONTAINER_NAMES"],
-        current_app.config["RECOMMENDER_PRECOMPUTED_CONTAINER_NAMES"],
-        current_app.config["RECOMMENDER_BASELINE_CONTAINER"],
-        _,
-    ) = parse_systems_config(current_app.config["SYSTEMS_CONFIG"])
+    # Update SYSTEMS_CONFIG related lists and share the config with the other workers
+    apply_systems_config(current_app.config["SYSTEMS_CONFIG"])
+    publish_systems_config()
 
     return jsonify({"msg": f"Systems updated"}), 200
\ No newline at end of file
@@ -3,9 +3,16 @@ import os
 import sys
 
 from app.api import api as api_blueprint
-from app.commands import index_systems, init_db_command, seed_db_command
+from app.commands import (
+    index_systems,
+    init_db_command,
+    retry_uploads_command,
+    seed_db_command,
+    sync_worker_command,
+)
 from app.extensions import bootstrap, db, migrate, scheduler
 from app.main import main as main_blueprint
+from app.services.registry_service import hash_systems_config, sync_registry_if_due
 from config import config
 from flask import Flask
 from flasgger import Swagger
@@ -29,16 +36,20 @@ def create_app(config_name=None):
         else:
             app.config.from_object(config[config_name])
 
-    if app.config["DEBUG"] and app.config["SENDFEEDBACK"] and not app.config["TESTING"]:
+    if app.config["DEBUG"] and app.config["SENDFEEDBACK"] and not app.config["SYNC_WORKER"] and not app.config["TESTING"]:
         print("Initializing and starting scheduler in app factory process")
         scheduler.init_app(app)
         scheduler.start()
         print("Scheduler started in app factory process")
 
+    # detects a redeploy with a new SYSTEMS_CONFIG, see sync_registry
+    app.config["SYSTEMS_CONFIG_HASH"] = hash_systems_config(app.config.get("SYSTEMS_CONFIG") or {})
+
     configure_logger(app)
     register_extensions(app)
     register_blueprints(app)
     register_commands(app)
+    register_hooks(app)
 
     swagger_config = {
         "headers": [],
@@ -115,3 +126,14 @@ def register_commands(app):
     app.cli.add_command(init_db_command)
     app.cli.add_command(seed_db_command)
     app.cli.add_command(index_systems)
+    app.cli.add_command(sync_worker_command)
+    app.cli.add_command(retry_uploads_command)
+
+
+def register_hooks(app):
+    """Register request hooks."""
+
+    @app.before_request
+    def sync_systems_config():
+        # another worker might have changed the SYSTEMS_CONFIG
+        sync_registry_if_due()
@@ -1,9 +1,12 @@
+import signal
 import threading
 import time
 
 import click
 from app.extensions import db
 from app.models import System
+from app.services.cron_service import run_sync_worker
+from app.services.outbox_service import retry_failed
 from app.services.system_service import rest_index
 from flask import current_app
 from flask.cli import with_appcontext
@@ -106,3 +109,26 @@ def seed_db_command():
 @with_appcontext
 def index_systems():
     index_systems()
+
+
+@click.command("sync-worker")
+@with_appcontext
+def sync_worker_command():
+    """Exit expired sessions and upload them to the STELLA server in this process. Run it with SYNC_WORKER=True, so the app
+    processes do not start the scheduler."""
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stop.set())
+    click.echo("Sync worker started")
+    run_sync_worker(stop)
+    click.echo("Sync worker stopped")
+
+
+@click.command("retry-uploads")
+@click.argument("session_ids", nargs=-1)
+@with_appcontext
+def retry_uploads_command(session_ids):
+    """Post the units of sessions that failed for good again with the next sync. Without session ids, all of them are retried."""
+    retried = retry_failed(list(session_ids))
+    db.session.commit()
+    click.echo(f"Retrying {retried} upload(s)")
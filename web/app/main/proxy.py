@@ -1,9 +1,7 @@
-import asyncio
-
-from app.models import Session, db
+from app.services import client_service
 from app.services.proxy_service import build_query_string, make_results
 from app.services.result_service import get_cached_response
-from app.services.session_service import create_new_session
+from app.services.session_service import create_new_session, has_session
 from app.services.system_service import get_least_served_system
 from flask import Response, current_app, json, request
 
@@ -90,7 +88,7 @@ def proxy(url):
     container_name = params.pop("stella-container", None)
 
     session_id = params.pop("stella-sid", None)
-    session_exists = db.session.query(Session).filter_by(id=session_id).first()
+    session_exists = has_session(session_id)
 
     query = build_query_string(url, params)
 
@@ -103,6 +101,8 @@ def proxy(url):
                 json.dumps(response, sort_keys=False, ensure_ascii=False, indent=2),
                 mimetype="application/json",
             )
+        # the session may have been deleted by the sync since it was cached
+        session_exists = has_session(session_id, cached=False)
 
     if container_name is None:
         current_app.logger.debug("No container name provided")
@@ -114,7 +114,7 @@ def proxy(url):
         current_app.logger.debug(f"Session {session_id} does not exist, create new")
         session_id = create_new_session(container_name, sid=session_id, type=type)
 
-    response = asyncio.run(
+    response = client_service.run(
         make_results(container_name, session_id, url, params, system_type)
     )
 
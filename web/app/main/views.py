@@ -1,7 +1,8 @@
 from . import main
 from flask import render_template, current_app, jsonify, request
 from app.models import db, System
-from config import parse_systems_config
+from app.services.cache_service import get_result_cache
+from app.services.registry_service import apply_systems_config, publish_systems_config
 
 
 def prep_list(container_list, db_systems):
@@ -46,6 +47,11 @@ def get_systems_config():
     return jsonify(current_app.config["SYSTEMS_CONFIG"]), 200
 
 
+@main.route("/cache_stats")
+def cache_stats():
+    return jsonify(get_result_cache().stats), 200
+
+
 @main.route("/set_systems_config", methods=["POST"])
 def set_systems_config():
 
@@ -54,17 +60,11 @@ def set_systems_config():
         return jsonify({"ok": False, "error": "Invalid/missing JSON"}), 400
     
     try:
-        (
-            current_app.config["RANKING_CONTAINER_NAMES"],
-            current_app.config["RANKING_PRECOMPUTED_CONTAINER_NAMES"],
-            current_app.config["RANKING_BASELINE_CONTAINER"],
-            current_app.config["RECOMMENDER_CONTAINER_NAMES"],
-            current_app.config["RECOMMENDER_PRECOMPUTED_CONTAINER_NAMES"],
-            current_app.config["RECOMMENDER_BASELINE_CONTAINER"],
-            current_app.config["SYSTEMS_CONFIG"],
-        ) = parse_systems_config(payload)
+        apply_systems_config(payload)
     except ValueError as ve:
         return jsonify({"error": str(ve)}), 400
+    # the other workers use the new config on their next check
+    publish_systems_config()
 
     current_app.logger.debug(f"SYSTEMS_CONFIG updated: {current_app.config['SYSTEMS_CONFIG']}")
 
@@ -1,8 +1,20 @@
 from app.extensions import db
+from sqlalchemy import event
 
 
 class Session(db.Model):
     __tablename__ = "sessions"
+    __table_args__ = (
+        # sessions that are not sent yet are scanned by the cron job, sent sessions are not indexed. Expired sessions are found
+        # by their start.
+        db.Index(
+            "ix_sessions_unsent",
+            "exit",
+            "start",
+            postgresql_where=db.text("sent = false"),
+            sqlite_where=db.text("sent = 0"),
+        ),
+    )
     id = db.Column(db.String(64), primary_key=True)
     start = db.Column(db.DateTime(timezone=True), nullable=True)
     end = db.Column(db.DateTime(timezone=True), nullable=True)
@@ -16,6 +28,24 @@ class Session(db.Model):
 
 class Result(db.Model):
     __tablename__ = "results"
+    __table_args__ = (
+        # Cached rankings of a session (`get_cached_response`). The query string is checked on the few rankings of a session,
+        # long queries would exceed the maximum key size of a composite B-tree index.
+        db.Index("ix_results_session_page", "session_id", "page"),
+        # only interleaved rankings and rankings with feedback are looked up by these columns
+        db.Index(
+            "ix_results_tdi",
+            "tdi",
+            postgresql_where=db.text("tdi IS NOT NULL"),
+            sqlite_where=db.text("tdi IS NOT NULL"),
+        ),
+        db.Index(
+            "ix_results_feedback_id",
+            "feedback_id",
+            postgresql_where=db.text("feedback_id IS NOT NULL"),
+            sqlite_where=db.text("feedback_id IS NOT NULL"),
+        ),
+    )
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(64), db.ForeignKey("sessions.id"))
     system_id = db.Column(db.Integer, db.ForeignKey("systems.id"))
@@ -28,9 +58,47 @@ class Result(db.Model):
     page = db.Column(db.Integer)
     rpp = db.Column(db.Integer)
     hits = db.Column(db.Integer)
-    items = db.Column(db.JSON)
+    _items = db.Column("items", db.JSON)
+    # compact storage of the items with ITEM_STORAGE=compact, see item_service
+    ranked = db.Column(db.LargeBinary, nullable=True)
+    # team of every position of an interleaved ranking with INTERLEAVED_STORAGE=selection, see interleave_service
+    selection = db.Column(db.LargeBinary, nullable=True)
     tdi = db.Column(db.Integer, db.ForeignKey("results.id"))
     custom_response = db.Column(db.JSON, nullable=True)
+    # Impressions of a cached ranking reference the shown ranking instead of copying its items and custom response
+    ref = db.Column(db.Integer, db.ForeignKey("results.id"), nullable=True)
+    original = db.relationship("Result", remote_side=[id], foreign_keys=[ref])
+
+    @property
+    def items(self):
+        """Ranked items in the API shape `{position: {"docid": ..., "type": ...}}`. Compactly stored items are decoded and
+        interleaved rankings stored as selection are rebuilt on access."""
+        if self._items is None and (self.ranked is not None or self.selection is not None):
+            unpacked = self.__dict__.get("_unpacked")
+            if unpacked is None:
+                if self.ranked is not None:
+                    from app.services.item_service import decode_items
+
+                    unpacked = decode_items(self.ranked)
+                else:
+                    from app.services.interleave_service import rebuild_items
+
+                    unpacked = rebuild_items(self)
+                self.__dict__["_unpacked"] = unpacked
+            return unpacked
+        return self._items
+
+    @items.setter
+    def items(self, value):
+        self._items = value
+        self.ranked = None
+        self.selection = None
+        self.__dict__.pop("_unpacked", None)
+
+    @property
+    def source(self):
+        """The ranking with the items shown by this row, i.e., the referenced ranking for impressions."""
+        return self.original if self.ref is not None else self
 
     @property
     def serialize(self):
@@ -47,18 +115,33 @@ class Result(db.Model):
             "page": self.page,
             "rpp": self.rpp,
             "hits": self.hits,
-            "items": self.items,
+            "items": self.source.items,
             "tdi": self.tdi,
-            "custom_response": self.custom_response,
+            "custom_response": self.source.custom_response,
+            "ref": self.ref,
         }
 
 
+@event.listens_for(Result, "expire")
+def _forget_unpacked_items(target, attrs):
+    # decode the items again after the columns are reloaded
+    target.__dict__.pop("_unpacked", None)
+
+
+class Document(db.Model):
+    """Interned document ids of the compactly stored rankings."""
+
+    __tablename__ = "documents"
+    id = db.Column(db.Integer, primary_key=True)
+    docid = db.Column(db.String(512), unique=True, nullable=False)
+
+
 class Feedback(db.Model):
     __tablename__ = "feedbacks"
     id = db.Column(db.Integer, primary_key=True)
     start = db.Column(db.DateTime(timezone=True), nullable=True)
     end = db.Column(db.DateTime(timezone=True), nullable=True)
-    session_id = db.Column(db.String(64), db.ForeignKey("sessions.id"))
+    session_id = db.Column(db.String(64), db.ForeignKey("sessions.id"), index=True)
     interleave = db.Column(db.Boolean)
     results = db.relationship("Result", backref="feedback", lazy="dynamic")
     clicks = db.Column(db.JSON)
@@ -83,5 +166,46 @@ class System(db.Model):
             "system_type": self.system_type,
             "num_requests": self.num_requests,
             "num_requests_no_head": self.num_requests_no_head,
-        }    
+        }
+
+
+class Upload(db.Model):
+    """Outbox of the uploads to the STELLA server. Every session, feedback and ranking is uploaded as a unit with an
+    idempotency key, the id the server returned for a session or feedback is kept for the units that reference it."""
+
+    __tablename__ = "uploads"
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), unique=True, nullable=False)
+    session_id = db.Column(db.String(64), db.ForeignKey("sessions.id"), index=True, nullable=False)
+    # "session", "feedback" or "ranking", or "batch" for a session with its feedback and rankings in batch mode
+    kind = db.Column(db.String(16), nullable=False)
+    parent_id = db.Column(db.Integer, db.ForeignKey("uploads.id"), nullable=True)
+    payload = db.Column(db.JSON, nullable=False)
+    # "pending", "sent" or "failed" after UPLOAD_MAX_ATTEMPTS
+    status = db.Column(db.String(16), nullable=False, default="pending")
+    server_id = db.Column(db.Integer, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.String(512), nullable=True)
+    parent = db.relationship("Upload", remote_side=[id], backref="children")
+
+
+class Lease(db.Model):
+    """Leadership of a job on databases without advisory locks. The holder renews the lease before it expires."""
+
+    __tablename__ = "leases"
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=False)
+    expires = db.Column(db.DateTime, nullable=False)
+
+
+class SystemsConfig(db.Model):
+    """Versions of the SYSTEMS_CONFIG shared by all workers. The id is the version, the latest version is used."""
+
+    __tablename__ = "systems_configs"
+    id = db.Column(db.Integer, primary_key=True)
+    config = db.Column(db.JSON, nullable=False)
+    # hash of the SYSTEMS_CONFIG the publishing worker was started with, to detect a redeploy with a new config
+    startup_hash = db.Column(db.String(64))
+    created = db.Column(db.DateTime, nullable=False)
             
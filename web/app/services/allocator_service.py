@@ -0,0 +1,152 @@
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from app.models import System, db
+from app.services.counter_service import counted_requests, pending_requests
+from app.services.registry_service import SystemRegistry, get_registry
+from flask import current_app
+
+STRATEGIES = ("least_served", "weighted", "round_robin")
+
+
+class SystemCounts(NamedTuple):
+    system_type: str
+    # requests of all workers at the last sync, minus the requests counted by this worker until then
+    num_requests: int
+    num_requests_no_head: int
+
+
+class TrafficAllocator:
+    """Assigns requests to systems in memory.
+
+    The request counts of all workers are loaded from the systems table every `sync_interval` seconds and when the system
+    registry changes. In between, the requests counted by this worker are added, so the assignment needs no database access.
+
+    Strategies:
+        least_served: The system with the fewest requests.
+        weighted: The system with the fewest requests relative to its weight, the traffic is shared by weight across workers.
+        round_robin: Smooth weighted round-robin of this worker, independent of the request counts.
+    """
+
+    def __init__(self, strategy: str = "least_served", sync_interval: float = 5):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown allocation strategy: {strategy}")
+        self.strategy = strategy
+        self.sync_interval = sync_interval
+        self._systems: Dict[str, SystemCounts] = {}
+        self._current_weights: Dict[str, float] = {}
+        self._synced_at: Optional[float] = None
+        self._registry: Optional[SystemRegistry] = None
+        self._lock = threading.Lock()
+
+    def sync(self) -> None:
+        """Load the request counts of all systems. Counts of this worker that are not written yet are added. The requests this
+        worker counted so far are subtracted, they are added again by `count` with the requests counted after the sync."""
+        registry = get_registry()
+        rows = db.session.query(
+            System.name, System.system_type, System.num_requests, System.num_requests_no_head
+        ).all()
+        systems = {
+            name: SystemCounts(
+                system_type,
+                (num_requests or 0)
+                + pending_requests(name, head=True)
+                - counted_requests(name, head=True),
+                (num_requests_no_head or 0) + pending_requests(name) - counted_requests(name),
+            )
+            for name, system_type, num_requests, num_requests_no_head in rows
+        }
+        with self._lock:
+            self._systems = systems
+            self._synced_at = time.monotonic()
+            self._registry = registry
+
+    def sync_if_due(self) -> None:
+        if (
+            self._synced_at is None
+            or time.monotonic() - self._synced_at >= self.sync_interval
+            or self._registry is not get_registry()
+        ):
+            self.sync()
+
+    def systems(self) -> List[str]:
+        """Names of the systems in the database."""
+        return list(self._systems)
+
+    def is_live(self, name: str) -> bool:
+        system = self._systems.get(name)
+        return system is not None and system.system_type == "LIVE"
+
+    def count(self, name: str, head: bool = False) -> int:
+        """Estimated number of requests of a system of all workers."""
+        column = "num_requests" if head else "num_requests_no_head"
+        system = self._systems.get(name)
+        synced = getattr(system, column) if system is not None else 0
+        return synced + counted_requests(name, head)
+
+    def choose(self, candidates: List[str], head: bool = False, strategy: Optional[str] = None) -> str:
+        """Choose a system for a request. The request is counted when the system is requested.
+
+        Args:
+            candidates (List[str]): Names of the systems that may be assigned. Ties are broken by their order.
+            head (bool, optional): Whether the request is a head query. Defaults to False.
+            strategy (Optional[str], optional): Overrides the strategy of the allocator. Defaults to None.
+
+        Returns:
+            str: Name of the assigned system.
+        """
+        if not candidates:
+            raise ValueError("No system available for allocation")
+        strategy = strategy or self.strategy
+        weights = self._get_weights(candidates) if strategy != "least_served" else {}
+        with self._lock:
+            if strategy == "least_served":
+                name = min(candidates, key=lambda c: self.count(c, head))
+            elif strategy == "weighted":
+                name = min(
+                    (c for c in candidates if weights[c] > 0),
+                    key=lambda c: self.count(c, head) / weights[c],
+                    default=candidates[0],
+                )
+            else:
+                name = self._round_robin(candidates, weights)
+        return name
+
+    def _get_weights(self, candidates: List[str]) -> Dict[str, float]:
+        registry = get_registry()
+        return {
+            name: registry[name].weight if name in registry else 1.0 for name in candidates
+        }
+
+    def _round_robin(self, candidates: List[str], weights: Dict[str, float]) -> str:
+        # smooth weighted round-robin: every system gains its weight, the chosen one loses the total
+        total = sum(max(weights[c], 0) for c in candidates)
+        for name in candidates:
+            self._current_weights[name] = self._current_weights.get(name, 0) + max(weights[name], 0)
+        name = max(candidates, key=lambda c: self._current_weights[c])
+        self._current_weights[name] -= total
+        return name
+
+
+_allocator: Optional[TrafficAllocator] = None
+_allocator_lock = threading.Lock()
+
+
+def get_allocator() -> TrafficAllocator:
+    """Get the traffic allocator of this worker. It is created on first use."""
+    global _allocator
+    with _allocator_lock:
+        if _allocator is None:
+            _allocator = TrafficAllocator(
+                strategy=current_app.config["ALLOCATION_STRATEGY"],
+                sync_interval=current_app.config["ALLOCATOR_SYNC_INTERVAL"],
+            )
+        return _allocator
+
+
+def reset_allocator() -> None:
+    """Drop the allocator, it is created again with the current config on next use."""
+    global _allocator
+    with _allocator_lock:
+        _allocator = None
@@ -0,0 +1,132 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.services.registry_service import get_system_settings
+
+CLOSED = "CLOSED"
+OPEN = "OPEN"
+HALF_OPEN = "HALF_OPEN"
+
+class CircuitBreaker:
+    """Circuit breaker for a single system container.
+
+    The breaker is CLOSED while the container answers. After `failures` consecutive failed (or too slow) requests it OPENs and
+    requests are rejected without contacting the container. After `reset_timeout` seconds the breaker is HALF_OPEN and lets a
+    single probe request through. A successful probe closes the breaker, a failed probe opens it again.
+    """
+
+    def __init__(
+        self,
+        failures: int = 5,
+        reset_timeout: float = 30,
+        slow_call: Optional[float] = None,
+    ):
+        self.failure_threshold = failures
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.latency: Optional[float] = None  # moving average in seconds
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    @property
+    def settings(self) -> Dict:
+        return {"failures": self.failure_threshold, "reset_timeout": self.reset_timeout, "slow_call": self.slow_call}
+
+    def configure(self, failures: int, reset_timeout: float, slow_call: Optional[float] = None) -> None:
+        """Change the settings of the breaker, e.g., for a new SYSTEMS_CONFIG. The state of the breaker is kept."""
+        with self._lock:
+            self.failure_threshold = failures
+            self.reset_timeout = reset_timeout
+            self.slow_call = slow_call
+
+    def allow_request(self) -> bool:
+        """Check if a request may be sent to the container. In the half-open state, only one probe request is allowed at a time."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self, latency: float) -> None:
+        """Record a successful request and its latency in seconds."""
+        if self.slow_call is not None and latency > self.slow_call:
+            self.record_failure(latency)
+            return
+        with self._lock:
+            self._update_latency(latency)
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self, latency: Optional[float] = None) -> None:
+        """Record a failed request."""
+        with self._lock:
+            if latency is not None:
+                self._update_latency(latency)
+            self._failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """Release a probe request without a verdict, e.g., because it was cancelled."""
+        with self._lock:
+            self._probing = False
+
+    def _update_latency(self, latency: float) -> None:
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(container_name: str) -> CircuitBreaker:
+    """Get the circuit breaker of a system container of this worker. The settings are taken from the system registry, values
+    from the SYSTEMS_CONFIG take precedence over the global defaults. A new SYSTEMS_CONFIG changes the settings of the breaker.
+
+    Args:
+        container_name (str): Name of the system container.
+
+    Returns:
+        CircuitBreaker: Circuit breaker of the container.
+    """
+    settings = dict(get_system_settings(container_name).breaker)
+    breaker = _breakers.get(container_name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(container_name, CircuitBreaker(**settings))
+    if breaker.settings != settings:
+        breaker.configure(**settings)
+    return breaker
+
+
+def get_open_circuits() -> List[str]:
+    """Get the names of all containers whose circuit breaker is open and that should not be requested."""
+    return [name for name, breaker in list(_breakers.items()) if breaker.state == OPEN]
+
+
+def reset_breakers() -> None:
+    """Forget the state of all circuit breakers."""
+    with _breakers_lock:
+        _breakers.clear()
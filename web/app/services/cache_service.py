@@ -0,0 +1,177 @@
+import asyncio
+import copy
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.services.registry_service import get_system_settings
+from flask import current_app
+
+
+class TTLCache:
+    """Bounded in-process cache with least recently used (LRU) eviction and an expiry time per entry."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_result_cache: Optional[TTLCache] = None
+
+
+def get_result_cache() -> TTLCache:
+    """Get the cache for raw container responses of this worker. The cache is shared by all sessions."""
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = TTLCache(
+            maxsize=current_app.config["RESULT_CACHE_SIZE"],
+            ttl=current_app.config["RESULT_CACHE_TTL"],
+        )
+    return _result_cache
+
+
+def reset_result_cache() -> None:
+    """Drop the result cache, it is created again with the current config on next use."""
+    global _result_cache
+    _result_cache = None
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for the cache key, so trivial differences in case and whitespace share the same entry."""
+    return " ".join(query.split()).lower()
+
+
+def is_cacheable(container_name: str) -> bool:
+    """Check if the responses of a system may be shared between sessions. Non-deterministic systems can opt out with `"cache": false` in the SYSTEMS_CONFIG."""
+    return get_system_settings(container_name).cache_ttl > 0
+
+
+def get_cached_result(key: tuple) -> Optional[Dict]:
+    """Get a copy of a cached container response.
+
+    Args:
+        key (tuple): Cache key, starting with the container name.
+
+    Returns:
+        Optional[Dict]: Copy of the cached response or None.
+    """
+    if not is_cacheable(key[0]):
+        return None
+    result = get_result_cache().get(key)
+    # the responses are modified when building the stella response
+    return copy.deepcopy(result) if result is not None else None
+
+
+def cache_result(key: tuple, result: Dict) -> None:
+    """Store a copy of a container response with the TTL of the system.
+
+    Args:
+        key (tuple): Cache key, starting with the container name.
+        result (Dict): Raw response of the container.
+    """
+    ttl = get_system_settings(key[0]).cache_ttl
+    if ttl <= 0:
+        return
+    get_result_cache().set(key, copy.deepcopy(result), ttl=ttl)
+
+
+class _Flight:
+    """A request to a container that is in flight and the number of requests waiting for it."""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+# In-flight requests per event loop. Futures can only be shared by requests on the same loop.
+_flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, _Flight]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+async def singleflight(key: Hashable, fetch: Callable[[], Awaitable[Dict]]) -> Dict:
+    """Coalesce identical concurrent requests to a container. The first request for a key starts `fetch`, all requests for the same key
+    that arrive while it is in flight wait for the same result. Every caller gets its own copy of the response.
+    The shared request is only cancelled if all waiting requests are cancelled.
+
+    Args:
+        key (Hashable): Key of the request, e.g., the cache key.
+        fetch (Callable[[], Awaitable[Dict]]): Function starting the request to the container.
+
+    Returns:
+        Dict: Copy of the container response.
+    """
+    loop = asyncio.get_running_loop()
+    flights = _flights.setdefault(loop, {})
+
+    flight = flights.get(key)
+    if flight is None:
+        flight = flights[key] = _Flight(loop.create_task(fetch()))
+        flight.task.add_done_callback(
+            lambda _: flights.pop(key) if flights.get(key) is flight else None
+        )
+    else:
+        current_app.logger.debug(f"Joining request in flight: {key}")
+
+    flight.waiters += 1
+    try:
+        result = await asyncio.shield(flight.task)
+    except asyncio.CancelledError:
+        if flight.waiters == 1:
+            flight.task.cancel()
+        raise
+    finally:
+        flight.waiters -= 1
+    return copy.deepcopy(result)
@@ -0,0 +1,162 @@
+import asyncio
+import atexit
+import threading
+import weakref
+from typing import Any, Coroutine, Dict, Optional
+
+import aiohttp
+from app.services.db_service import dispose_engines
+from app.services.registry_service import get_system_settings
+from flask import current_app
+
+# One client per system and event loop. aiohttp sessions are bound to the loop they are created in.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, aiohttp.ClientSession]]" = (
+    weakref.WeakKeyDictionary()
+)
+# Pool settings the clients were created with, per event loop and system
+_client_settings: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Dict[str, Any]]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+_worker_thread: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+
+def get_pool_settings(container_name: str) -> Dict[str, Any]:
+    """Get the connection pool settings for a system from the system registry. Values from the SYSTEMS_CONFIG take precedence
+    over the global defaults.
+
+    Args:
+        container_name (str): Name of the system container.
+
+    Returns:
+        Dict[str, Any]: Pool settings for the system.
+    """
+    return dict(get_system_settings(container_name).pool)
+
+
+def get_client(container_name: str) -> aiohttp.ClientSession:
+    """Get the long-lived client of a system for the running event loop. The client is created on first use and keeps its connections alive between requests.
+    When the pool settings of the system change with a new SYSTEMS_CONFIG, a new client is created and the old one is closed.
+
+    Args:
+        container_name (str): Name of the system container.
+
+    Returns:
+        aiohttp.ClientSession: Pooled client session for the system.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _clients.setdefault(loop, {})
+    client_settings = _client_settings.setdefault(loop, {})
+    settings = get_pool_settings(container_name)
+
+    client = clients.get(container_name)
+    if client is not None and not client.closed and client_settings.get(container_name) != settings:
+        loop.create_task(_close_later(client, client_settings[container_name]["timeout"]))
+        client = None
+    if client is None or client.closed:
+        connector = aiohttp.TCPConnector(
+            limit=settings["limit"],
+            limit_per_host=settings["limit_per_host"],
+            keepalive_timeout=settings["keepalive_timeout"],
+            ttl_dns_cache=settings["ttl_dns_cache"],
+            use_dns_cache=True,
+        )
+        client = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=settings["timeout"]),
+        )
+        clients[container_name] = client
+        client_settings[container_name] = settings
+        current_app.logger.debug(
+            f'Created pooled client for "{container_name}": {settings}'
+        )
+    return client
+
+
+async def _close_later(client: aiohttp.ClientSession, delay: Optional[float]) -> None:
+    """Close a replaced client once the requests that still use it are done or timed out."""
+    await asyncio.sleep(delay or 0)
+    await client.close()
+
+
+async def close_clients() -> None:
+    """Close all clients of the running event loop."""
+    _client_settings.pop(asyncio.get_running_loop(), None)
+    clients = _clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        if not client.closed:
+            await client.close()
+
+
+async def _close_connections() -> None:
+    """Close the clients and the async database connections of the running event loop."""
+    await close_clients()
+    await dispose_engines()
+
+
+def _get_worker_loop() -> asyncio.AbstractEventLoop:
+    """Start the event loop of this worker process in a background thread on first use."""
+    global _worker_loop, _worker_thread
+    with _worker_lock:
+        if _worker_loop is None or _worker_loop.is_closed():
+            _worker_loop = asyncio.new_event_loop()
+            _worker_thread = threading.Thread(
+                target=_worker_loop.run_forever, name="stella-client-loop", daemon=True
+            )
+            _worker_thread.start()
+        return _worker_loop
+
+
+async def _run_and_close(coro: Coroutine) -> Any:
+    """Await a coroutine and close the connections that were opened on its short-lived event loop."""
+    try:
+        return await coro
+    finally:
+        await _close_connections()
+
+
+def run(coro: Coroutine) -> Any:
+    """Run a coroutine from a request handler and wait for its result.
+
+    With `ASYNC_SERVING` enabled, the coroutine is scheduled on the long-lived event loop of this worker.
+    The loop and therefore the pooled clients and their connections survive between requests, and all request threads of a worker share the loop, so many container calls can be in flight at once.
+    The Flask context of the caller is copied to the coroutine.
+
+    Otherwise, the coroutine is run on a new event loop with `asyncio.run` as a fallback. The clients are closed again when the request is done.
+
+    Args:
+        coro (Coroutine): Coroutine to run.
+
+    Returns:
+        Any: Result of the coroutine.
+    """
+    if not current_app.config["ASYNC_SERVING"]:
+        return asyncio.run(_run_and_close(coro))
+
+    future = asyncio.run_coroutine_threadsafe(coro, _get_worker_loop())
+    return future.result()
+
+
+def shutdown() -> None:
+    """Close the pooled clients and database connections and stop the event loop of this worker."""
+    global _worker_loop, _worker_thread
+    with _worker_lock:
+        loop, thread = _worker_loop, _worker_thread
+        _worker_loop, _worker_thread = None, None
+
+    if loop is None or loop.is_closed():
+        return
+
+    if loop.is_running():
+        try:
+            asyncio.run_coroutine_threadsafe(_close_connections(), loop).result(timeout=5)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+    loop.close()
+
+
+atexit.register(shutdown)
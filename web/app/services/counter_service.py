@@ -0,0 +1,176 @@
+import atexit
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from app.models import System, db
+from flask import Flask, current_app
+from sqlalchemy import Update, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Request counters of this worker that are not written to the database yet
+_pending: Dict[str, Counter] = {"num_requests": Counter(), "num_requests_no_head": Counter()}
+# All requests counted by this worker, also after they are written
+_counted: Dict[str, Counter] = {"num_requests": Counter(), "num_requests_no_head": Counter()}
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+_app: Optional[Flask] = None
+
+
+def count_request(container_name: str, head: bool = False) -> None:
+    """Count a request to a system in memory. The counts are written to the database in batches by `flush_counters`.
+
+    Args:
+        container_name (str): Name of the requested system.
+        head (bool, optional): Whether the request is a head query. Defaults to False.
+    """
+    global _app
+    if _app is None:
+        _app = current_app._get_current_object()
+    column = "num_requests" if head else "num_requests_no_head"
+    with _lock:
+        _pending[column][container_name] += 1
+        _counted[column][container_name] += 1
+
+
+def pending_requests(container_name: str, head: bool = False) -> int:
+    """Get the number of requests to a system that were counted by this worker but are not in the database yet."""
+    column = "num_requests" if head else "num_requests_no_head"
+    with _lock:
+        return _pending[column][container_name]
+
+
+def counted_requests(container_name: str, head: bool = False) -> int:
+    """Get the number of requests to a system that were counted by this worker since it started."""
+    column = "num_requests" if head else "num_requests_no_head"
+    with _lock:
+        return _counted[column][container_name]
+
+
+def _take_pending() -> Dict[str, Counter]:
+    """Take the pending request counts for a flush."""
+    global _last_flush
+    with _lock:
+        pending = {column: Counter(counter) for column, counter in _pending.items()}
+        for counter in _pending.values():
+            counter.clear()
+        _last_flush = time.monotonic()
+    return pending
+
+
+def restore_counters(pending: Dict[str, Counter]) -> None:
+    """Keep the counts of a failed flush for the next flush, e.g., when the transaction of the caller that the counts were
+    flushed in with `flush_counters(commit=False)` fails."""
+    with _lock:
+        for column, counter in pending.items():
+            _pending[column].update(counter)
+
+
+def _build_updates(pending: Dict[str, Counter]) -> List[Update]:
+    """Build one atomic UPDATE statement per system with pending counts. The systems are updated in the order of their names, so
+    concurrent workers lock the rows in the same order and do not deadlock."""
+    updates = []
+    for container_name in sorted(set().union(*pending.values())):
+        values = {
+            column: getattr(System, column) + counter[container_name]
+            for column, counter in pending.items()
+            if counter[container_name]
+        }
+        updates.append(
+            update(System).where(System.name == container_name).values(**values)
+        )
+    return updates
+
+
+def _is_due() -> bool:
+    return time.monotonic() - _last_flush >= current_app.config["COUNTER_FLUSH_INTERVAL"]
+
+
+def flush_counters(commit: bool = True) -> Optional[Dict[str, Counter]]:
+    """Add the pending request counts to the systems table with atomic `UPDATE systems SET n = n + k` statements.
+    Concurrent workers therefore do not overwrite each others counts. If the updates fail, the counts are kept for the next flush.
+
+    Args:
+        commit (bool, optional): Whether to commit the updates. Without a commit, the updates are part of the transaction of the caller,
+            in a savepoint, so failing updates do not roll back the rest of the transaction. Defaults to True.
+
+    Returns:
+        Optional[Dict[str, Counter]]: Without a commit, the counts that are written in the transaction of the caller. They are
+            passed to `restore_counters` if the transaction fails.
+    """
+    pending = _take_pending()
+    updates = _build_updates(pending)
+    if not updates:
+        return None
+
+    try:
+        if commit:
+            for statement in updates:
+                db.session.execute(statement)
+            db.session.commit()
+        else:
+            with db.session.begin_nested():
+                for statement in updates:
+                    db.session.execute(statement)
+    except Exception as e:
+        restore_counters(pending)
+        if commit:
+            db.session.rollback()
+        current_app.logger.error(f"Could not write request counters: {str(e)}")
+        return None
+    return None if commit else pending
+
+
+def flush_counters_if_due(commit: bool = True) -> Optional[Dict[str, Counter]]:
+    """Flush the pending request counts if the last flush is older than `COUNTER_FLUSH_INTERVAL` seconds. See `flush_counters`."""
+    if _is_due():
+        return flush_counters(commit=commit)
+    return None
+
+
+async def flush_counters_if_due_async(session: AsyncSession) -> Optional[Dict[str, Counter]]:
+    """Flush the pending request counts like `flush_counters_if_due`, but with an async session. The updates are part of the
+    transaction of the caller, in a savepoint like `flush_counters(commit=False)`.
+
+    Args:
+        session (AsyncSession): Async session of the caller.
+
+    Returns:
+        Optional[Dict[str, Counter]]: The counts that are written in the transaction of the caller, see `flush_counters`.
+    """
+    if not _is_due():
+        return None
+    pending = _take_pending()
+    updates = _build_updates(pending)
+    if not updates:
+        return None
+    try:
+        async with session.begin_nested():
+            for statement in updates:
+                await session.execute(statement)
+    except Exception as e:
+        restore_counters(pending)
+        current_app.logger.error(f"Could not write request counters: {str(e)}")
+        return None
+    return pending
+
+
+def shutdown() -> None:
+    """Write the remaining request counts of this worker before it exits."""
+    if _app is None:
+        return
+    with _app.app_context():
+        flush_counters()
+
+
+def reset_counters() -> None:
+    """Forget all pending request counts."""
+    global _last_flush
+    with _lock:
+        for counter in list(_pending.values()) + list(_counted.values()):
+            counter.clear()
+        _last_flush = time.monotonic()
+
+
+atexit.register(shutdown)
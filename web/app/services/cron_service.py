@@ -1,56 +1,175 @@
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 import requests as req
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, HTTPError
 from app.extensions import scheduler
-from app.models import Feedback, Result, Session, System, db
+from app.models import Feedback, Result, Session, System, Upload, db
+from app.services.cache_service import TTLCache
+from app.services.leader_service import LeaderLock, get_leader_lock
+from app.services.outbox_service import (
+    add_upload,
+    get_uploads,
+    has_failed,
+    is_due,
+    is_sent,
+    record_failure,
+    record_sent,
+)
+from app.services.session_service import forget_session
 from flask import current_app
+from sqlalchemy import Select, delete, func, or_, select, tuple_, update
+from sqlalchemy.exc import SQLAlchemyError
 
-logger = scheduler.app.logger
-
-def update_expired_sessions(sessions_not_exited):
-    for session in sessions_not_exited:
-        delta = datetime.now(timezone.utc) - session.start.replace(tzinfo=timezone.utc)
-
-        if delta.total_seconds() > current_app.config["SESSION_EXPIRATION"]:
-            complete = False
-            feedbacks = Feedback.query.filter_by(session_id=session.id).all()
-            for feedback in feedbacks:
-                results = Result.query.filter_by(feedback_id=feedback.id).all()
-                if len(results) > 0:
-                    complete = True
-                    break
-
-            if complete:
-                session.exit = True
-                db.session.add(session)
-                db.session.commit()
-            else:
-                if current_app.config["SESSION_KILL"] is not None and delta.total_seconds() > current_app.config["SESSION_KILL"]:
-                    # 1. get all results that are NOT interleaved results
-                    results_not_tdi = Result.query.filter(
-                        Result.id != Result.tdi, Result.session_id == session.id
-                    ).all()
-                    for result in results_not_tdi:
-                        db.session.delete(result)
-                        db.session.commit()
-                    # 2. get all remaining results that ARE interleaved results
-                    results = Result.query.filter_by(session_id=session.id).all()
-                    for result in results:
-                        db.session.delete(result)
-                        db.session.commit()
-                    feedbacks = Feedback.query.filter_by(session_id=session.id).all()
-                    for feedback in feedbacks:
-                        db.session.delete(feedback)
-                        db.session.commit()
-                    db.session.delete(session)
-                    db.session.commit()
+
+class ResultUpload(NamedTuple):
+    endpoint: str  # "rankings" or "recommendations"
+    system_name: str
+    payload: Dict
+
+
+class FeedbackUpload(NamedTuple):
+    payload: Dict
+    results: List[ResultUpload]
+
+
+class SessionUpload(NamedTuple):
+    session_id: str
+    payload: Dict
+    feedbacks: List[FeedbackUpload]
+
+
+_http: Optional[req.Session] = None
+_http_lock = threading.Lock()
+
+
+def get_http_session() -> req.Session:
+    """Get the pooled HTTP session to the STELLA server. Its connections are reused by all uploads of this process."""
+    global _http
+    with _http_lock:
+        if _http is None:
+            _http = req.Session()
+            adapter = HTTPAdapter(pool_maxsize=current_app.config["UPLOAD_CONCURRENCY"])
+            _http.mount("http://", adapter)
+            _http.mount("https://", adapter)
+        return _http
+
+
+def reset_http_session() -> None:
+    """Close the pooled HTTP session, a new one is created on next use."""
+    global _http
+    with _http_lock:
+        if _http is not None:
+            _http.close()
+        _http = None
+
+
+# server ids of the systems by name, for the token they were looked up with
+_server_system_ids: Optional[TTLCache] = None
+_server_system_ids_token: Optional[str] = None
+_server_system_ids_lock = threading.Lock()
+
+
+def get_server_system_ids() -> TTLCache:
+    """Get the cache of the server ids of the systems. It is cleared when the token changes."""
+    global _server_system_ids, _server_system_ids_token
+    token = current_app.config["STELLA_SERVER_TOKEN"]
+    with _server_system_ids_lock:
+        if _server_system_ids is None:
+            _server_system_ids = TTLCache(
+                maxsize=current_app.config["SERVER_SYSTEM_ID_CACHE_SIZE"],
+                ttl=current_app.config["SERVER_SYSTEM_ID_TTL"],
+            )
+        elif _server_system_ids_token != token:
+            _server_system_ids.clear()
+        _server_system_ids_token = token
+        return _server_system_ids
+
+
+def reset_server_system_ids() -> None:
+    """Drop the cached server ids, the cache is created again with the current config on next use."""
+    global _server_system_ids, _server_system_ids_token
+    with _server_system_ids_lock:
+        _server_system_ids = None
+        _server_system_ids_token = None
+
+
+def expired_sessions_query(
+    expired_before: datetime, after: Optional[Tuple[datetime, str]] = None, limit: int = 500
+) -> Select:
+    """Page of the running sessions that started before `expired_before`, ordered by their start. A session is complete if
+    a ranking got feedback of the session.
+
+    Args:
+        expired_before (datetime): Sessions that started before are expired (naive UTC).
+        after (Optional[Tuple[datetime, str]], optional): Start and id of the last session of the previous page. Defaults to None.
+        limit (int, optional): Page size. Defaults to 500.
+
+    Returns:
+        Select: Query of the id, start and completeness of the sessions.
+    """
+    complete = (
+        select(Result.id)
+        .join(Feedback, Result.feedback_id == Feedback.id)
+        .where(Feedback.session_id == Session.id)
+        .exists()
+    )
+    query = select(Session.id, Session.start, complete.label("complete")).where(
+        Session.exit == False,  # noqa: E712
+        Session.sent == False,  # noqa: E712
+        Session.start < expired_before,
+    )
+    if after is not None:
+        query = query.where(tuple_(Session.start, Session.id) > tuple_(*after))
+    return query.order_by(Session.start, Session.id).limit(limit)
+
+
+def update_expired_sessions():
+    """Set expired sessions with feedback to exit and delete expired sessions without feedback after `SESSION_KILL` seconds.
+    Only the expired sessions are scanned, in pages of `SESSION_SCAN_PAGE_SIZE`."""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    expired_before = now - timedelta(seconds=current_app.config["SESSION_EXPIRATION"])
+    killed_before = (
+        now - timedelta(seconds=current_app.config["SESSION_KILL"])
+        if current_app.config["SESSION_KILL"] is not None
+        else None
+    )
+    page_size = current_app.config["SESSION_SCAN_PAGE_SIZE"]
+
+    after = None
+    while True:
+        rows = db.session.execute(expired_sessions_query(expired_before, after, page_size)).all()
+        exited = [row.id for row in rows if row.complete]
+        # delete sessions without feedback
+        killed = [
+            row.id for row in rows if not row.complete and killed_before is not None and row.start < killed_before
+        ]
+
+        if exited:
+            db.session.execute(
+                update(Session)
+                .where(Session.id.in_(exited))
+                .values(exit=True)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            for session_id in exited:
+                forget_session(session_id)
+        if killed:
+            delete_sessions(killed)
+
+        if len(rows) < page_size:
+            break
+        after = (rows[-1].start, rows[-1].id)
 
 
 def update_token():
     try:
-        r = req.post(
+        r = get_http_session().post(
             current_app.config["STELLA_SERVER_API"] + "/tokens",
             auth=(
                 current_app.config["STELLA_SERVER_USER"],
@@ -67,7 +186,7 @@ def update_token():
         return
     
     r_json = json.loads(r.text)
-    logger.debug("Received new token from Stella Server. Token: %s", r_json.get("token"))
+    current_app.logger.debug("Received new token from Stella Server. Token: %s", r_json.get("token"))
     delta_exp = r_json.get("expiration")
     # get new token five min (300 s) before expiration
     current_app.config["TOKEN_EXPIRATION"] = datetime.now(timezone.utc) + timedelta(
@@ -78,7 +197,7 @@ def update_token():
 
 def get_side_identifier():
     try:
-        r = req.get(
+        r = get_http_session().get(
             current_app.config["STELLA_SERVER_API"]
             + "/sites/"
             + current_app.config["STELLA_SERVER_USERNAME"],
@@ -101,44 +220,38 @@ def get_side_identifier():
     
 
 
-def post_session(session, site_id):
-
-    system_ranking = System.query.filter_by(
-        id=session.system_ranking, type="RANK"
-    ).first()
-    system_recommendation = System.query.filter_by(
-        id=session.system_recommendation, type="REC"
-    ).first()
-    system_ranking_name = system_ranking.name if system_ranking else None
-    system_recommendation_name = (
-        system_recommendation.name if system_recommendation else None
+def _request(method: str, path: str, **kwargs) -> req.Response:
+    return get_http_session().request(
+        method,
+        current_app.config["STELLA_SERVER_API"] + path,
+        auth=(current_app.config["STELLA_SERVER_TOKEN"], ""),
+        timeout=current_app.config["UPLOAD_TIMEOUT"],
+        **kwargs,
     )
 
-    payload = {
+
+def build_session_payload(session, systems):
+    system_ranking = systems.get(session.system_ranking)
+    system_recommendation = systems.get(session.system_recommendation)
+    return {
         "site_user": session.site_user,
         "start": session.start.strftime("%Y-%m-%d %H:%M:%S"),
         "end": (
             session.start + timedelta(0, current_app.config["SESSION_EXPIRATION"])
         ).strftime("%Y-%m-%d %H:%M:%S"),
-        "system_ranking": system_ranking_name,
-        "system_recommendation": system_recommendation_name,
+        "system_ranking": (
+            system_ranking.name if system_ranking is not None and system_ranking.type == "RANK" else None
+        ),
+        "system_recommendation": (
+            system_recommendation.name
+            if system_recommendation is not None and system_recommendation.type == "REC"
+            else None
+        ),
     }
 
-    r = req.post(
-        current_app.config["STELLA_SERVER_API"]
-        + "/sites/"
-        + str(site_id)
-        + "/sessions",
-        data=payload,
-        auth=(current_app.config["STELLA_SERVER_TOKEN"], ""),
-    )
-    r_json = json.loads(r.text)
-
-    return r_json["session_id"]
-
 
-def post_feedback(feedback, session_id_server):
-    payload = {
+def build_feedback_payload(feedback):
+    return {
         "start": feedback.start.strftime("%Y-%m-%d %H:%M:%S"),
         "end": feedback.start.strftime("%Y-%m-%d %H:%M:%S"),  # add end datetime
         "interleave": feedback.interleave,
@@ -148,185 +261,421 @@ def post_feedback(feedback, session_id_server):
             else json.dumps(feedback.clicks)
         ),
     }
-    # post feedback from local db
-    r = req.post(
-        current_app.config["STELLA_SERVER_API"]
-        + "/sessions/"
-        + str(session_id_server)
-        + "/feedbacks",
-        data=payload,
-        auth=(current_app.config["STELLA_SERVER_TOKEN"], ""),
-    )
-    current_app.logger.debug(f"Posted feedback, received response: {r.text}")
-    # get feedback id from stella-server
-    r_json = json.loads(r.text)
-
-    return r_json["feedback_id"]
 
 
-def post_result(result, feedback_id_server, session_type):
-    system = System.query.filter_by(id=result.system_id).first()
-    system_name = system.name
-    r = req.get(
-        current_app.config["STELLA_SERVER_API"] + "/system/id/" + system_name,
-        auth=(current_app.config["STELLA_SERVER_TOKEN"], ""),
-    )
-    r_dict = json.loads(r.text)
-    system_id_server = r_dict.get("system_id")
+def build_result_upload(result, system, session_type) -> Optional[ResultUpload]:
+    """Build the upload of a ranking, None if it is not sent to the STELLA server."""
+    if system is None:
+        return None
+    if current_app.config["INTERLEAVE"]:
+        # In interleaved mode, we only expect results of type RANK/REC
+        system_type = session_type
+    else:
+        # Non-interleaved: send all results of type EXP/BASE as well
+        if result.type not in ("EXP", "BASE"):
+            return None
+        system_type = system.type
+    endpoints = {"RANK": "rankings", "REC": "recommendations"}
+    if system_type not in endpoints:
+        return None
 
     payload = {
         "q": result.q,
-        "q_date": result.q_date,
+        "q_date": str(result.q_date),
         "q_time": result.q_time,
-        "system_id": system_id_server,
         "num_found": result.num_found,
         "page": result.page,
         "rpp": result.rpp,
-        "items": json.dumps(result.items),
+        # impressions of cached rankings are expanded with the items of the referenced ranking
+        "items": json.dumps(result.source.items),
     }
+    return ResultUpload(endpoints[system_type], system.name, payload)
 
-    # post rankings to stella-server with (remote) feedback id
-    if current_app.config["INTERLEAVE"]:
-        # In interleaved mode, we only expect results of type RANK/REC
-        if session_type == "RANK":
-            r = req.post(
-                current_app.config["STELLA_SERVER_API"]
-                + "/feedbacks/"
-                + str(feedback_id_server)
-                + "/rankings",
-                data=payload,
-                auth=(current_app.config["STELLA_SERVER_TOKEN"], ""),
-            )
-        elif session_type == "REC":
-            r = req.post(
-                current_app.config["STELLA_SERVER_API"]
-                + "/feedbacks/"
-                + str(feedback_id_server)
-                + "/recommendations",
-                data=payload,
-                auth=(current_app.config["STELLA_SERVER_TOKEN"], ""),
-            )
-        else:
-            return 400
-    else:
-        # Non-interleaved: send all results of type EXP/BASE as well
-        if result.type not in ("EXP", "BASE"):
-            return 400
-
-        if system.type == "RANK":
-            r = req.post(
-                current_app.config["STELLA_SERVER_API"]
-                + "/feedbacks/"
-                + str(feedback_id_server)
-                + "/rankings",
-                data=payload,
-                auth=(current_app.config["STELLA_SERVER_TOKEN"], ""),
-            )
-        elif system.type == "REC":
-            r = req.post(
-                current_app.config["STELLA_SERVER_API"]
-                + "/feedbacks/"
-                + str(feedback_id_server)
-                + "/recommendations",
-                data=payload,
-                auth=(current_app.config["STELLA_SERVER_TOKEN"], ""),
-            )
-        else:
-            return 400
-    return r.status_code
 
+def prepare_upload(session, systems) -> SessionUpload:
+    """Load a session with its feedback and rankings from the local database.
 
-def delete_exited_session(session):
-    # 1. get all results that are NOT interleaved results
-    results_not_tdi = Result.query.filter(
-        Result.id != Result.tdi, Result.session_id == session.id
-    ).all()
-    for result in results_not_tdi:
-        db.session.delete(result)
-        db.session.commit()
-    # 2. get all remaining results that ARE interleaved results
-    results = Result.query.filter_by(session_id=session.id).all()
-    for result in results:
-        db.session.delete(result)
-        db.session.commit()
-    feedbacks = Feedback.query.filter_by(session_id=session.id).all()
-    for feedback in feedbacks:
-        db.session.delete(feedback)
-        db.session.commit()
-    db.session.delete(session)
-    db.session.commit()
+    Args:
+        session (Session): Exited session.
+        systems (Dict[int, System]): All systems by their id.
 
+    Returns:
+        SessionUpload: Payloads of the session, its feedback and rankings.
+    """
+    session_type = "RANK" if session.system_ranking is not None else "REC"
+    feedbacks = []
+    for feedback in Feedback.query.filter_by(session_id=session.id).all():
+        results = Result.query.filter_by(feedback_id=feedback.id).all()
+        uploads = [build_result_upload(result, systems.get(result.system_id), session_type) for result in results]
+        feedbacks.append(
+            FeedbackUpload(build_feedback_payload(feedback), [upload for upload in uploads if upload is not None])
+        )
+    return SessionUpload(session.id, build_session_payload(session, systems), feedbacks)
 
-def post_results(results, feedback_id_server, session_type):
-    for result in results:
-        # POST result
-        post_result(result, feedback_id_server, session_type)
 
+def get_server_system_id(system_name: str) -> Optional[int]:
+    """Get the id of a system on the STELLA server. Ids are cached for `SERVER_SYSTEM_ID_TTL` seconds, unknown systems are not.
 
-def post_feedbacks(session, session_id_server):
-    session_type = 'RANK' if session.system_ranking is not None else 'REC'
+    Raises:
+        RequestException: If the id could not be looked up.
+    """
+    cache = get_server_system_ids()
+    system_id_server = cache.get(system_name)
+    if system_id_server is None:
+        r = _request("GET", "/system/id/" + system_name)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        system_id_server = r.json().get("system_id")
+        if system_id_server is not None:
+            cache.set(system_name, system_id_server)
+    return system_id_server
 
-    feedbacks = Feedback.query.filter_by(session_id=session.id).all()
-    current_app.logger.debug(
-        "There is/are " + str(len(feedbacks)) + " feedback(s) to be sent."
+
+def post_result(upload: ResultUpload, feedback_id_server, key: Optional[str] = None) -> int:
+    path = "/feedbacks/" + str(feedback_id_server) + "/" + upload.endpoint
+    headers = {"Idempotency-Key": key} if key else None
+
+    # post rankings to stella-server with (remote) feedback id
+    r = _request(
+        "POST", path, data={**upload.payload, "system_id": get_server_system_id(upload.system_name)}, headers=headers
     )
+    if r.status_code == 404:
+        # the cached id of the system may be outdated, e.g., if the system was registered again
+        get_server_system_ids().pop(upload.system_name)
+        r = _request(
+            "POST", path, data={**upload.payload, "system_id": get_server_system_id(upload.system_name)}, headers=headers
+        )
+    if not r.ok:
+        current_app.logger.warning(f"Posting a ranking failed with status {r.status_code}: {r.text}")
+    return r.status_code
 
-    for feedback in feedbacks:
-        # POST feedback
-        feedback_id_server = post_feedback(feedback, session_id_server)
 
-        # post results
-        results = Result.query.filter_by(feedback_id=feedback.id).all()
-        post_results(results, feedback_id_server, session_type)
+def build_batch_payload(upload: SessionUpload) -> Dict:
+    """Nest the feedback and rankings of a session into its payload for the batch upload. The rankings reference their system
+    by name."""
+    return {
+        **upload.payload,
+        "feedbacks": [
+            {
+                **feedback.payload,
+                **{
+                    endpoint: [
+                        {**result.payload, "system": result.system_name}
+                        for result in feedback.results
+                        if result.endpoint == endpoint
+                    ]
+                    for endpoint in ("rankings", "recommendations")
+                },
+            }
+            for feedback in upload.feedbacks
+        ],
+    }
+
+
+def enqueue_upload(upload: SessionUpload) -> List[Upload]:
+    """Add a session to the outbox. In batch mode, the session is a single unit with its feedback and rankings. Otherwise, the
+    session, every feedback and every ranking are units, posted to the server id of their parent unit.
+
+    Returns:
+        List[Upload]: The units, every unit after its parent.
+    """
+    if current_app.config["UPLOAD_MODE"] == "batch":
+        return [add_upload(upload.session_id, "batch", build_batch_payload(upload))]
+    session_unit = add_upload(upload.session_id, "session", upload.payload)
+    units = [session_unit]
+    for feedback in upload.feedbacks:
+        feedback_unit = add_upload(upload.session_id, "feedback", feedback.payload, parent=session_unit)
+        units.append(feedback_unit)
+        for result in feedback.results:
+            units.append(add_upload(upload.session_id, "ranking", result._asdict(), parent=feedback_unit))
+    return units
+
+
+class UploadTask(NamedTuple):
+    """Snapshot of an upload unit for the upload threads, which do not access the database."""
+
+    id: int
+    key: str
+    kind: str
+    payload: Dict
+    parent_id: Optional[int]
+    server_id: Optional[int]
+    due: bool
+
+    @classmethod
+    def of(cls, upload: Upload, now: datetime) -> "UploadTask":
+        return cls(
+            upload.id, upload.key, upload.kind, upload.payload, upload.parent_id, upload.server_id, is_due(upload, now)
+        )
 
 
-def post_sessions(sessions_exited):
+class UploadOutcome(NamedTuple):
+    id: int
+    server_id: Optional[int]
+    error: Optional[str]
+
+
+def post_unit(task: UploadTask, parent_server_id) -> Optional[int]:
+    """Post an upload unit to the server id of its parent, the site id for sessions.
+
+    Returns:
+        Optional[int]: Server id of a session or feedback.
+
+    Raises:
+        RequestException: If the unit was not posted.
+    """
+    headers = {"Idempotency-Key": task.key}
+    if task.kind == "session":
+        r = _request("POST", "/sites/" + str(parent_server_id) + "/sessions", data=task.payload, headers=headers)
+        r.raise_for_status()
+        return r.json()["session_id"]
+    if task.kind == "feedback":
+        # post feedback from local db
+        r = _request("POST", "/sessions/" + str(parent_server_id) + "/feedbacks", data=task.payload, headers=headers)
+        r.raise_for_status()
+        current_app.logger.debug(f"Posted feedback, received response: {r.text}")
+        # get feedback id from stella-server
+        return r.json()["feedback_id"]
+    status_code = post_result(ResultUpload(**task.payload), parent_server_id, key=task.key)
+    if status_code >= 400:
+        raise HTTPError(f"Posting a ranking failed with status {status_code}")
+    return None
+
+
+def post_session(tasks: List[UploadTask], site_id) -> List[UploadOutcome]:
+    """Post the due units of a session. A unit is posted after its parent was posted, in this or an earlier run.
+
+    Args:
+        tasks (List[UploadTask]): All units of the session, every unit after its parent.
+        site_id: Site identifier on the STELLA server.
+
+    Returns:
+        List[UploadOutcome]: Outcomes of the posted units.
+    """
+    server_ids = {task.id: task.server_id for task in tasks if not task.due}
+    outcomes = []
+    for task in tasks:
+        if not task.due:
+            continue
+        parent_server_id = site_id if task.kind == "session" else server_ids.get(task.parent_id)
+        if parent_server_id is None:
+            # the parent is not posted yet
+            continue
+        try:
+            server_id = post_unit(task, parent_server_id)
+        except (req.RequestException, KeyError, ValueError) as e:
+            current_app.logger.error(f"Posting the {task.kind} upload {task.key} failed: {e}")
+            outcomes.append(UploadOutcome(task.id, None, str(e)))
+            continue
+        server_ids[task.id] = server_id
+        outcomes.append(UploadOutcome(task.id, server_id, None))
+    return outcomes
+
+
+def post_batch(tasks: List[UploadTask], site_id) -> List[UploadOutcome]:
+    """Post sessions with their feedback and rankings to the STELLA server in a single request. Every session carries the
+    idempotency key of its unit.
+
+    Returns:
+        List[UploadOutcome]: Outcomes of the units.
+    """
+    payload = {"sessions": [{**task.payload, "idempotency_key": task.key} for task in tasks]}
+    try:
+        r = _request("POST", "/sites/" + str(site_id) + "/sessions/batch", json=payload)
+        r.raise_for_status()
+    except req.RequestException as e:
+        current_app.logger.error(f"Posting a batch of {len(tasks)} session(s) failed: {e}")
+        return [UploadOutcome(task.id, None, str(e)) for task in tasks]
+    return [UploadOutcome(task.id, None, None) for task in tasks]
+
+
+def delete_sessions(session_ids: List[str]) -> int:
+    """Delete sessions with their feedback and rankings. Every `DELETE_CHUNK_SIZE` sessions are deleted with a few
+    statements in their own transaction, so the tables are not locked for long.
+
+    Args:
+        session_ids (List[str]): Ids of the sessions.
+
+    Returns:
+        int: Number of deleted sessions.
+    """
+    chunk_size = current_app.config["DELETE_CHUNK_SIZE"]
+    deleted = 0
+    for i in range(0, len(session_ids), chunk_size):
+        chunk = session_ids[i : i + chunk_size]
+        try:
+            # 1. results that are NOT interleaved results and the impressions referencing them, the interleaved results are
+            # referenced by their tdi
+            db.session.execute(
+                delete(Result)
+                .where(
+                    Result.session_id.in_(chunk),
+                    or_(Result.id != Result.tdi, Result.ref.isnot(None)),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            # 2. all remaining results, including the interleaved results
+            db.session.execute(
+                delete(Result).where(Result.session_id.in_(chunk)).execution_options(synchronize_session=False)
+            )
+            db.session.execute(
+                delete(Feedback).where(Feedback.session_id.in_(chunk)).execution_options(synchronize_session=False)
+            )
+            # 3. the outbox, every unit before the unit it is posted to
+            for kinds in (["ranking"], ["feedback"], ["session", "batch"]):
+                db.session.execute(
+                    delete(Upload)
+                    .where(Upload.session_id.in_(chunk), Upload.kind.in_(kinds))
+                    .execution_options(synchronize_session=False)
+                )
+            deleted += db.session.execute(
+                delete(Session).where(Session.id.in_(chunk)).execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.error(f"Deleting {len(chunk)} session(s) failed: {str(e)}")
+            continue
+        for session_id in chunk:
+            forget_session(session_id)
+    return deleted
+
+
+def post_sessions(sessions_exited, lock: Optional[LeaderLock] = None):
     # get site identifier
     site_id = get_side_identifier()
     if site_id is None:
         current_app.logger.error(f"Posting sessions aborted: Couldn't get site identifier")
         return
-    
-    for session in sessions_exited:
 
-        # POST session/make new session
-        session_id_server = post_session(session, site_id)
+    # add new sessions to the outbox, sessions of earlier runs continue with their units that are not sent yet
+    uploads = get_uploads([session.id for session in sessions_exited])
+    new_sessions = [session for session in sessions_exited if not uploads[session.id]]
+    if new_sessions:
+        systems = {system.id: system for system in System.query.all()}
+        for session in new_sessions:
+            uploads[session.id] = enqueue_upload(prepare_upload(session, systems))
+        db.session.commit()
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    tasks = {
+        session_id: [UploadTask.of(upload, now) for upload in units]
+        for session_id, units in uploads.items()
+        if any(is_due(upload, now) for upload in units)
+    }
+    batch_tasks = [task for session_tasks in tasks.values() for task in session_tasks if task.kind == "batch" and task.due]
+    batch_size = current_app.config["UPLOAD_BATCH_SIZE"]
+    jobs = [(post_batch, batch_tasks[i : i + batch_size]) for i in range(0, len(batch_tasks), batch_size)]
+    jobs += [
+        (post_session, session_tasks)
+        for session_tasks in tasks.values()
+        if any(task.kind != "batch" for task in session_tasks)
+    ]
+
+    app = current_app._get_current_object()
+
+    def upload(job) -> List[UploadOutcome]:
+        post, job_tasks = job
+        with app.app_context():
+            return post(job_tasks, site_id)
+
+    # the uploads only use HTTP, the outbox is updated in this thread
+    with ThreadPoolExecutor(max_workers=current_app.config["UPLOAD_CONCURRENCY"]) as executor:
+        outcomes = [outcome for job_outcomes in executor.map(upload, jobs) for outcome in job_outcomes]
+
+    # another process may have become the leader meanwhile and posts the same units, with the same idempotency keys
+    if lock is not None and not lock.is_held():
+        current_app.logger.warning("Lost the leadership while posting the sessions, the next leader updates the outbox")
+        db.session.rollback()
+        return
 
-        # post feedbacks
-        post_feedbacks(session, session_id_server)
+    units = {upload.id: upload for session_uploads in uploads.values() for upload in session_uploads}
+    for outcome in outcomes:
+        if outcome.error is None:
+            record_sent(units[outcome.id], outcome.server_id)
+        else:
+            record_failure(units[outcome.id], outcome.error)
 
-        # set status to sent=True
+    sent_sessions = [session for session in sessions_exited if is_sent(uploads[session.id])]
+    # set status to sent=True
+    for session in sent_sessions:
         session.sent = True
-        db.session.add(session)
-        db.session.commit()
+    db.session.commit()
+
+    # sessions with units that failed for good are kept unsent until they are retried, e.g., with `flask retry-uploads`
+    num_failed = sum(1 for session in sessions_exited if has_failed(uploads[session.id]))
+    if num_failed:
+        current_app.logger.warning(f"{num_failed} session(s) could not be posted, retry them with `flask retry-uploads`")
 
-        # optionally delete entry from local database
-        if current_app.config["DELETE_SENT_SESSION"]:
-            delete_exited_session(session)
+    # optionally delete entry from local database
+    if current_app.config["DELETE_SENT_SESSION"]:
+        delete_sessions([session.id for session in sent_sessions])
 
 sessions_not_exited_prev = 0
 
-def check_db_sessions():
+
+def sync_sessions(lock: Optional[LeaderLock] = None):
+    """Exit expired sessions and upload the exited sessions to the STELLA server.
+
+    Args:
+        lock (Optional[LeaderLock], optional): Leadership of the sync, the outbox is only updated while it is held. Defaults to None.
+    """
     global sessions_not_exited_prev
-    with scheduler.app.app_context():
 
-        sessions_not_exited = Session.query.filter_by(exit=False, sent=False).all()
+    # counted in the index of the unsent sessions, the sessions are not loaded
+    num_sessions_not_exited = (
+        db.session.query(func.count(Session.id)).filter_by(exit=False, sent=False).scalar()
+    )
+
+    if num_sessions_not_exited != sessions_not_exited_prev:
+        current_app.logger.info("There is/are " + str(num_sessions_not_exited) + " running session(s).")
+
+    sessions_not_exited_prev = num_sessions_not_exited
+
+    # set expired sessions to 'exit'
+    update_expired_sessions()
 
-        if len(sessions_not_exited) != sessions_not_exited_prev:
-            scheduler.app.logger.info("There is/are " + str(len(sessions_not_exited)) + " running session(s).")
+    sessions_exited = Session.query.filter_by(exit=True, sent=False).all()
 
-        sessions_not_exited_prev = len(sessions_not_exited)
+    if current_app.config["STELLA_SERVER_TOKEN"] is None or current_app.config["TOKEN_EXPIRATION"] < datetime.now(timezone.utc):
 
-        # set expired sessions to 'exit'
-        update_expired_sessions(sessions_not_exited)
+        current_app.logger.info("Updating Stella Server token...", )
+        update_token()
 
-        sessions_exited = Session.query.filter_by(exit=True, sent=False).all()
+    if len(sessions_exited) > 0 and current_app.config["STELLA_SERVER_TOKEN"] is not None:
+        current_app.logger.info("Posting " + str(len(sessions_exited)) + " session(s).")
+        post_sessions(sessions_exited, lock)
 
-        if current_app.config["STELLA_SERVER_TOKEN"] is None or current_app.config["TOKEN_EXPIRATION"] < datetime.now(timezone.utc):
-            
-            logger.info("Updating Stella Server token...", )
-            update_token()
 
-        if len(sessions_exited) > 0 and current_app.config["STELLA_SERVER_TOKEN"] is not None:
-            scheduler.app.logger.info("Posting " + str(len(sessions_exited)) + " session(s).")
-            post_sessions(sessions_exited)
+def check_db_sessions():
+    """Job of the scheduler. Only the leader of all processes that share the database syncs the sessions."""
+    with scheduler.app.app_context():
+        lock = get_leader_lock()
+        if lock.acquire():
+            with lock.renewing():
+                sync_sessions(lock)
+
+
+def run_sync_worker(stop: Optional[threading.Event] = None) -> None:
+    """Sync the sessions every `INTERVAL_DB_CHECK` seconds until stopped. Every sync worker and scheduler competes for the
+    leadership, only the leader syncs and the others take over when it is gone.
+
+    Args:
+        stop (Optional[threading.Event], optional): Stops the worker when set. Defaults to None.
+    """
+    stop = stop or threading.Event()
+    lock = get_leader_lock()
+    try:
+        while not stop.is_set():
+            if lock.acquire():
+                try:
+                    with lock.renewing():
+                        sync_sessions(lock)
+                except Exception as e:
+                    current_app.logger.exception(f"Syncing the sessions failed: {str(e)}")
+                finally:
+                    db.session.remove()
+            stop.wait(current_app.config["INTERVAL_DB_CHECK"])
+    finally:
+        lock.release()
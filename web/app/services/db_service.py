@@ -0,0 +1,65 @@
+import asyncio
+import weakref
+from typing import Dict
+
+from flask import current_app
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+# Async drivers for the database backends
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+# One engine per event loop. The connections of the async drivers are bound to the loop they are opened in.
+_engines: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncEngine]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def is_enabled() -> bool:
+    """Check if the database work of the coroutines uses the async engine (`ASYNC_DATABASE`)."""
+    return current_app.config["ASYNC_DATABASE"]
+
+
+def get_async_database_uri() -> str:
+    """Get the URI of the async engine. Defaults to the `SQLALCHEMY_DATABASE_URI` with the async driver of its backend.
+
+    Returns:
+        str: Database URI with an async driver.
+    """
+    if current_app.config.get("ASYNC_DATABASE_URI"):
+        return current_app.config["ASYNC_DATABASE_URI"]
+    url = make_url(current_app.config["SQLALCHEMY_DATABASE_URI"])
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]).render_as_string(
+        hide_password=False
+    )
+
+
+def get_async_engine() -> AsyncEngine:
+    """Get the async engine of the running event loop. It is created on first use."""
+    engines = _engines.setdefault(asyncio.get_running_loop(), {})
+    uri = get_async_database_uri()
+    engine = engines.get(uri)
+    if engine is None:
+        engine = engines[uri] = create_async_engine(uri)
+        current_app.logger.debug(f"Created async database engine: {engine.url}")
+    return engine
+
+
+def get_async_session() -> AsyncSession:
+    """Create an async session for the running event loop."""
+    return async_sessionmaker(get_async_engine(), expire_on_commit=False)()
+
+
+async def dispose_engines() -> None:
+    """Close the database connections of the running event loop."""
+    engines = _engines.pop(asyncio.get_running_loop(), {})
+    for engine in engines.values():
+        await engine.dispose()
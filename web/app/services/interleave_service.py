@@ -1,6 +1,11 @@
 import random
+import struct
+from typing import Dict, List, Optional
 
 from app.models import Result, db
+from app.services.item_service import TEAMS, pack_teams, unpack_teams
+from app.services.writer_service import add_result
+from flask import current_app
 
 
 def team_draft_interleave(ranking_base, ranking_exp, rpp=None):
@@ -79,6 +84,70 @@ def add_missing_results(result_list, interleaved_results, result_type, rpp):
     return interleaved_results
 
 
+def select_items(ranking_base: List, ranking_exp: List, teams: List[str]) -> Optional[Dict]:
+    """Rebuild interleaved items from the docids of the baseline and experimental ranking and the team of every position.
+
+    Every position takes the highest ranked docid of its team that is not interleaved yet, like `team_draft_interleave` and
+    `add_missing_results` do.
+
+    Returns:
+        Optional[Dict]: Interleaved items, None if a team runs out of docids.
+    """
+    rankings = {"BASE": ranking_base, "EXP": ranking_exp}
+    pointers = {"BASE": 0, "EXP": 0}
+    result = {}
+    result_set = set()
+    for pos, team in enumerate(teams, start=1):
+        ranking, pointer = rankings[team], pointers[team]
+        while pointer < len(ranking) and ranking[pointer] in result_set:
+            pointer += 1
+        if pointer == len(ranking):
+            return None
+        result[pos] = {"docid": ranking[pointer], "type": team}
+        result_set.add(ranking[pointer])
+        pointers[team] = pointer + 1
+    return result
+
+
+def encode_selection(item_dict: Dict) -> bytes:
+    """Encode the team of every position of interleaved items as the number of positions and one bit per position."""
+    teams = [item_dict[pos]["type"] for pos in sorted(item_dict, key=int)]
+    return struct.pack("<H", len(teams)) + pack_teams(teams)
+
+
+def decode_selection(data: bytes) -> List[str]:
+    """Decode the teams of the positions encoded by `encode_selection`."""
+    (length,) = struct.unpack_from("<H", data)
+    return unpack_teams(data[2:], length)
+
+
+def rebuild_items(ranking: Result) -> Optional[Dict]:
+    """Rebuild the items of an interleaved ranking stored as selection from its baseline and experimental ranking.
+
+    Args:
+        ranking (Result): Interleaved ranking with a `selection`.
+
+    Returns:
+        Optional[Dict]: Items in the API shape `{"1": {"docid": ..., "type": ...}, ...}`, None if the rankings are missing.
+    """
+    parents = {
+        parent.type: parent
+        for parent in db.session.query(Result).filter(
+            Result.tdi == ranking.id, Result.type.in_(TEAMS), Result.ref.is_(None)
+        )
+    }
+    if len(parents) < 2:
+        current_app.logger.warning(f"Rankings of interleaved ranking {ranking.id} not found")
+        return None
+    base = [v.get("docid") for v in parents["BASE"].items.values()]
+    exp = [v.get("docid") for v in parents["EXP"].items.values()]
+    item_dict = select_items(base, exp, decode_selection(ranking.selection))
+    if item_dict is None:
+        current_app.logger.warning(f"Interleaved ranking {ranking.id} does not match its rankings")
+        return None
+    return {str(pos): item for pos, item in item_dict.items()}
+
+
 def interleave_rankings(ranking_exp, ranking_base, system_type, rpp):
     """
     Create interleaved ranking from experimental and baseline system
@@ -117,16 +186,23 @@ def interleave_rankings(ranking_exp, ranking_base, system_type, rpp):
         rpp=rpp,
         items=item_dict,
     )
-
-    db.session.add(ranking)
-    db.session.flush()
+    if (
+        current_app.config["INTERLEAVED_STORAGE"] == "selection"
+        and select_items(base, exp, [item["type"] for item in item_dict.values()]) == item_dict
+    ):
+        # store only the team of every position, the items are rebuilt from the baseline and experimental ranking
+        ranking.selection = encode_selection(item_dict)
+        ranking._items = None
+        ranking.__dict__["_unpacked"] = item_dict
+
+    add_result(ranking)
+    if ranking.id is None:
+        # inserts the interleaved ranking together with the pending baseline and experimental rankings
+        db.session.flush()
 
     ranking_id = ranking.id
     ranking.tdi = ranking_id
     ranking_exp.tdi = ranking_id
     ranking_base.tdi = ranking_id
 
-    db.session.add_all([ranking_exp, ranking_base])
-    db.session.commit()
-
     return ranking
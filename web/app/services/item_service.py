@@ -0,0 +1,259 @@
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.models import Document, Result, db
+from app.services.cache_service import TTLCache
+from flask import current_app
+from sqlalchemy import event, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, SessionTransaction
+
+# Team of an item by its bit in the compact storage
+TEAMS = ("BASE", "EXP")
+MAX_DOCID_LENGTH = Document.docid.property.columns[0].type.length
+
+# Document ids interned in a transaction are only cached when the transaction is committed. They are kept per transaction or
+# savepoint, so the ids of a rolled back savepoint are dropped.
+PENDING_DOCIDS = "interned_docids"
+
+_ids: Optional[TTLCache] = None  # docid -> id
+_docids: Optional[TTLCache] = None  # id -> docid
+
+
+def is_enabled() -> bool:
+    """Check if the ranked items are stored compactly (`ITEM_STORAGE=compact`)."""
+    return current_app.config["ITEM_STORAGE"] == "compact"
+
+
+def _get_caches() -> Tuple[TTLCache, TTLCache]:
+    global _ids, _docids
+    if _ids is None or _docids is None:
+        maxsize = current_app.config["DOCID_CACHE_SIZE"]
+        # interned ids never change, the entries do not expire
+        _ids = TTLCache(maxsize=maxsize, ttl=float("inf"))
+        _docids = TTLCache(maxsize=maxsize, ttl=float("inf"))
+    return _ids, _docids
+
+
+def reset_docid_cache() -> None:
+    """Forget the cached document ids of this worker."""
+    global _ids, _docids
+    _ids, _docids = None, None
+
+
+def can_pack(items: Optional[Dict]) -> bool:
+    """Check if items can be stored compactly. Items need consecutive positions starting at 1, string docids and a BASE or EXP type."""
+    if not items or len(items) > 0xFFFF:
+        return False
+    if {str(position) for position in items} != {str(i) for i in range(1, len(items) + 1)}:
+        return False
+    return all(
+        item.keys() == {"docid", "type"}
+        and item["type"] in TEAMS
+        and isinstance(item["docid"], str)
+        and len(item["docid"]) <= MAX_DOCID_LENGTH
+        for item in items.values()
+    )
+
+
+def pack_teams(types: List[str]) -> bytes:
+    """Pack the team of every position into one bit per position, BASE is 0 and EXP is 1."""
+    teams = 0
+    for i, team in enumerate(types):
+        teams |= TEAMS.index(team) << i
+    return teams.to_bytes((len(types) + 7) // 8, "little")
+
+
+def unpack_teams(data: bytes, length: int) -> List[str]:
+    """Unpack the teams of `length` positions packed by `pack_teams`."""
+    teams = int.from_bytes(data, "little")
+    return [TEAMS[(teams >> i) & 1] for i in range(length)]
+
+
+def encode_items(items: Dict, ids: Dict[str, int]) -> bytes:
+    """Encode items as the number of items, the interned id of every document and one team bit per position.
+
+    Args:
+        items (Dict): Items in the API shape.
+        ids (Dict[str, int]): Interned ids of the docids.
+
+    Returns:
+        bytes: Compact items.
+    """
+    ranked = [items[p] if p in items else items[str(p)] for p in range(1, len(items) + 1)]
+    return struct.pack(
+        f"<H{len(ranked)}I", len(ranked), *(ids[item["docid"]] for item in ranked)
+    ) + pack_teams([item["type"] for item in ranked])
+
+
+def decode_items(data: bytes) -> Dict[str, Dict]:
+    """Decode compact items into the API shape `{"1": {"docid": ..., "type": ...}, ...}`."""
+    (length,) = struct.unpack_from("<H", data)
+    ids = struct.unpack_from(f"<{length}I", data, 2)
+    teams = unpack_teams(data[2 + 4 * length :], length)
+    docids = lookup_docids(ids)
+    return {
+        str(i + 1): {"docid": docids[document_id], "type": team}
+        for i, (document_id, team) in enumerate(zip(ids, teams))
+    }
+
+
+def lookup_docids(ids: Iterable[int]) -> Dict[int, str]:
+    """Get the docids of interned document ids."""
+    _, docids_cache = _get_caches()
+    docids, missing = {}, []
+    for document_id in set(ids):
+        docid = docids_cache.get(document_id)
+        if docid is None:
+            missing.append(document_id)
+        else:
+            docids[document_id] = docid
+    if missing:
+        rows = db.session.execute(
+            select(Document.id, Document.docid).where(Document.id.in_(missing))
+        ).all()
+        for document_id, docid in rows:
+            docids[document_id] = docid
+            docids_cache.set(document_id, docid)
+    return docids
+
+
+def _lookup(docids: Iterable[str], pending: Dict[str, int]) -> Tuple[Dict[str, int], List[str]]:
+    """Split docids into known ids and docids that have to be interned."""
+    ids_cache, _ = _get_caches()
+    ids, missing = {}, []
+    for docid in set(docids):
+        document_id = pending.get(docid) or ids_cache.get(docid)
+        if document_id is None:
+            missing.append(docid)
+        else:
+            ids[docid] = document_id
+    return ids, missing
+
+
+def _get_pending(session: Session) -> Dict[str, int]:
+    """Get the ids interned in the transaction of a session and in its savepoints that are not rolled back."""
+    pending = session.info.get(PENDING_DOCIDS, {})
+    return {docid: document_id for ids in pending.values() for docid, document_id in ids.items()}
+
+
+def _add_pending(session: Session, rows: Iterable[Tuple[str, int]]) -> None:
+    """Keep ids interned in the innermost transaction of a session, until it is committed or rolled back."""
+    transaction = session.get_nested_transaction() or session.get_transaction()
+    session.info.setdefault(PENDING_DOCIDS, {}).setdefault(transaction, {}).update(rows)
+
+
+def _build_insert(dialect_name: str, docids: List[str]):
+    """Insert docids that are not interned yet, docids interned concurrently by other workers are skipped."""
+    rows = [{"docid": docid} for docid in docids]
+    if dialect_name == "postgresql":
+        return postgresql.insert(Document).values(rows).on_conflict_do_nothing(index_elements=["docid"])
+    if dialect_name == "sqlite":
+        return sqlite.insert(Document).values(rows).on_conflict_do_nothing(index_elements=["docid"])
+    return insert(Document).values(rows)
+
+
+def intern_docids(docids: Iterable[str]) -> Dict[str, int]:
+    """Get the interned ids of docids and intern the new ones in the transaction of the request.
+
+    Args:
+        docids (Iterable[str]): Document ids.
+
+    Returns:
+        Dict[str, int]: Interned id per docid.
+    """
+    session = db.session()
+    ids, missing = _lookup(docids, _get_pending(session))
+    if missing:
+        session.execute(_build_insert(session.get_bind().dialect.name, missing))
+        rows = session.execute(
+            select(Document.docid, Document.id).where(Document.docid.in_(missing))
+        ).all()
+        _add_pending(session, rows)
+        ids.update(rows)
+    return ids
+
+
+async def intern_docids_async(session: AsyncSession, docids: Iterable[str]) -> Dict[str, int]:
+    """Like `intern_docids`, but with an async session."""
+    ids, missing = _lookup(docids, _get_pending(session.sync_session))
+    if missing:
+        await session.execute(_build_insert(session.get_bind().dialect.name, missing))
+        result = await session.execute(
+            select(Document.docid, Document.id).where(Document.docid.in_(missing))
+        )
+        rows = result.all()
+        _add_pending(session.sync_session, rows)
+        ids.update(rows)
+    return ids
+
+
+def _packable_docids(items_list: List[Dict]) -> set:
+    return {item["docid"] for items in items_list for item in items.values()}
+
+
+def pack_items(*rankings: Result) -> None:
+    """Store the items of rankings compactly. The rankings keep their items in memory, so they are not decoded again."""
+    rankings = [r for r in rankings if r.ranked is None and can_pack(r._items)]
+    if not rankings:
+        return
+    ids = intern_docids(_packable_docids([r._items for r in rankings]))
+    for ranking in rankings:
+        items = ranking._items
+        ranking.ranked = encode_items(items, ids)
+        ranking._items = None
+        ranking.__dict__["_unpacked"] = items
+
+
+def _pack_rows(rows: List[Dict], ids: Dict[str, int]) -> None:
+    for row in rows:
+        if row["ranked"] is None and can_pack(row["_items"]):
+            row["ranked"] = encode_items(row["_items"], ids)
+            row["_items"] = None
+
+
+def pack_rows(rows: List[Dict]) -> None:
+    """Store the items of rows for a multi-row INSERT of rankings compactly."""
+    items_list = [row["_items"] for row in rows if row["ranked"] is None and can_pack(row["_items"])]
+    if items_list:
+        _pack_rows(rows, intern_docids(_packable_docids(items_list)))
+
+
+async def pack_rows_async(session: AsyncSession, rows: List[Dict]) -> None:
+    """Like `pack_rows`, but with an async session."""
+    items_list = [row["_items"] for row in rows if row["ranked"] is None and can_pack(row["_items"])]
+    if items_list:
+        _pack_rows(rows, await intern_docids_async(session, _packable_docids(items_list)))
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_interned_docids(session: Session) -> None:
+    pending = _get_pending(session)
+    session.info.pop(PENDING_DOCIDS, None)
+    if pending:
+        ids_cache, docids_cache = _get_caches()
+        for docid, document_id in pending.items():
+            ids_cache.set(docid, document_id)
+            docids_cache.set(document_id, docid)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back_docids(session: Session, previous_transaction: SessionTransaction) -> None:
+    # the docids of a rolled back savepoint, and of the savepoints released within it, do not exist
+    pending = session.info.get(PENDING_DOCIDS)
+    if not pending:
+        return
+    for transaction in list(pending):
+        ancestor = transaction
+        while ancestor is not None and ancestor is not previous_transaction:
+            ancestor = ancestor.parent
+        if ancestor is not None:
+            del pending[transaction]
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _forget_interned_docids(session: Session, transaction) -> None:
+    # the docids of a rolled back transaction do not exist
+    if transaction.parent is None:
+        session.info.pop(PENDING_DOCIDS, None)
@@ -0,0 +1,105 @@
+from typing import Any, Optional, Tuple, Union
+
+from jsonpath_ng import JSONPath, parse
+from jsonpath_ng.jsonpath import Child, Fields, Index, Root
+
+
+class CompiledPath:
+    """JSONPath of plain keys and list indices, e.g., `$.hits.hits`, compiled into direct lookups."""
+
+    __slots__ = ("expression", "steps")
+
+    def __init__(self, expression: str, steps: Tuple[Union[str, int], ...]):
+        self.expression = expression
+        self.steps = steps
+
+    def get(self, data: Any) -> Any:
+        """Get the value at the path.
+
+        Raises:
+            LookupError: If the path does not exist in the data.
+        """
+        return self._walk(data, self.steps)
+
+    def set(self, data: Any, value: Any) -> Any:
+        """Replace the value at the path if it exists, like `JSONPath.update`."""
+        if not self.steps:
+            return value
+        try:
+            parent = self._walk(data, self.steps[:-1])
+        except LookupError:
+            return data
+        last = self.steps[-1]
+        if isinstance(last, str) and isinstance(parent, dict) and last in parent:
+            parent[last] = value
+        elif isinstance(last, int) and isinstance(parent, list) and last < len(parent):
+            parent[last] = value
+        return data
+
+    def _walk(self, data: Any, steps: Tuple[Union[str, int], ...]) -> Any:
+        for step in steps:
+            if isinstance(step, str):
+                if not isinstance(data, dict) or step not in data:
+                    raise LookupError(f"No match for {self.expression}")
+            elif not isinstance(data, list) or step >= len(data):
+                raise LookupError(f"No match for {self.expression}")
+            data = data[step]
+        return data
+
+    def __str__(self) -> str:
+        return self.expression
+
+
+class FallbackPath:
+    """Any other JSONPath, evaluated with jsonpath_ng. The first match is used."""
+
+    __slots__ = ("expression", "path")
+
+    def __init__(self, expression: str, path: JSONPath):
+        self.expression = expression
+        self.path = path
+
+    def get(self, data: Any) -> Any:
+        matches = self.path.find(data)
+        if not matches:
+            raise LookupError(f"No match for {self.expression}")
+        return matches[0].value
+
+    def set(self, data: Any, value: Any) -> Any:
+        return self.path.update(data, value)
+
+    def __str__(self) -> str:
+        return self.expression
+
+
+def _compile_steps(path: JSONPath) -> Optional[Tuple[Union[str, int], ...]]:
+    """Get the keys and indices of a parsed path, None if it uses other operators."""
+    if isinstance(path, Root):
+        return ()
+    if isinstance(path, Child):
+        left, right = _compile_steps(path.left), _compile_steps(path.right)
+        if left is None or right is None:
+            return None
+        return left + right
+    if isinstance(path, Fields) and len(path.fields) == 1 and path.fields[0] != "*":
+        return (path.fields[0],)
+    if isinstance(path, Index) and isinstance(path.index, int) and path.index >= 0:
+        return (path.index,)
+    return None
+
+
+def compile_path(expression: Union[str, JSONPath]) -> Union[CompiledPath, FallbackPath]:
+    """Compile a JSONPath into direct key and index lookups. Expressions with other operators, e.g., wildcards, slices or
+    filters, are evaluated with jsonpath_ng.
+
+    Args:
+        expression (Union[str, JSONPath]): JSONPath expression, as string or parsed by jsonpath_ng.
+
+    Returns:
+        Union[CompiledPath, FallbackPath]: Path with `get` and `set`.
+    """
+    path = parse(expression) if isinstance(expression, str) else expression
+    steps = _compile_steps(path)
+    if steps is None:
+        return FallbackPath(str(expression), path)
+    return CompiledPath(str(expression), steps)
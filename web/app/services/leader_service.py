@@ -0,0 +1,171 @@
+import os
+import socket
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional
+from uuid import uuid4
+
+from app.models import Lease, db
+from flask import current_app
+from sqlalchemy import Connection, Engine, delete, insert, or_, text, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class LeaderLock:
+    """Leadership of a job across all processes and replicas that share the database.
+
+    On PostgreSQL, the leader holds a session-level advisory lock on a dedicated connection, which the server releases when
+    the connection of a crashed leader is gone. Other databases have no advisory locks, there the leader renews a lease row
+    that another process takes over when it is not renewed for `lease_ttl` seconds.
+    """
+
+    def __init__(self, name: str, engine: Engine, lease_ttl: float = 30):
+        self.name = name
+        self.engine = engine
+        self.lease_ttl = lease_ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        # advisory lock keys are 64 bit integers
+        self.key = zlib.crc32(name.encode())
+        self._connection: Optional[Connection] = None
+        self._expires: Optional[datetime] = None  # end of the lease of this process
+        self._lock = threading.Lock()
+
+    @property
+    def advisory(self) -> bool:
+        return self.engine.dialect.name == "postgresql"
+
+    def acquire(self) -> bool:
+        """Become or stay the leader. Called before every run of the job.
+
+        Returns:
+            bool: True if this process is the leader.
+        """
+        with self._lock:
+            try:
+                return self._acquire_advisory() if self.advisory else self._acquire_lease()
+            except SQLAlchemyError as e:
+                current_app.logger.error(f"Leader election of {self.name} failed: {str(e)}")
+                self._close()
+                return False
+
+    def is_held(self) -> bool:
+        """Check without a database round trip if this process is still the leader, i.e., it holds the advisory lock or its
+        lease is not expired."""
+        with self._lock:
+            if self.advisory:
+                return self._connection is not None
+            return self._expires is not None and _now() < self._expires
+
+    @contextmanager
+    def renewing(self) -> Iterator[None]:
+        """Renew the leadership in a background thread every third of `lease_ttl` while the block runs, so a run of the job
+        that takes longer than `lease_ttl` keeps the lease."""
+        app = current_app._get_current_object()
+        done = threading.Event()
+
+        def renew() -> None:
+            with app.app_context():
+                while not done.wait(self.lease_ttl / 3):
+                    if not self.acquire():
+                        app.logger.warning(f"{self.holder} lost the leadership of {self.name}")
+
+        thread = threading.Thread(target=renew, name=f"{self.name}-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def release(self) -> None:
+        """Give up the leadership, e.g., on shutdown, so another process takes over without waiting."""
+        with self._lock:
+            try:
+                if self.advisory:
+                    if self._connection is not None:
+                        self._connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+                else:
+                    with self.engine.begin() as connection:
+                        connection.execute(delete(Lease).where(Lease.name == self.name, Lease.holder == self.holder))
+            except SQLAlchemyError as e:
+                current_app.logger.warning(f"Releasing the leadership of {self.name} failed: {str(e)}")
+            finally:
+                self._close()
+
+    def _acquire_advisory(self) -> bool:
+        if self._connection is not None:
+            # the lock is held as long as the connection is alive
+            self._connection.execute(text("SELECT 1"))
+            self._connection.commit()
+            return True
+        connection = self.engine.connect()
+        acquired = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}).scalar()
+        connection.commit()
+        if not acquired:
+            connection.close()
+            return False
+        self._connection = connection
+        current_app.logger.info(f"{self.holder} is the leader of {self.name}")
+        return True
+
+    def _acquire_lease(self) -> bool:
+        now = _now()
+        expires = now + timedelta(seconds=self.lease_ttl)
+        self._expires = None
+        with self.engine.begin() as connection:
+            renewed = connection.execute(
+                update(Lease)
+                .where(Lease.name == self.name, or_(Lease.holder == self.holder, Lease.expires < now))
+                .values(holder=self.holder, expires=expires)
+            ).rowcount
+        if renewed:
+            self._expires = expires
+            return True
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(insert(Lease).values(name=self.name, holder=self.holder, expires=expires))
+        except IntegrityError:
+            # another process holds the lease
+            return False
+        self._expires = expires
+        current_app.logger.info(f"{self.holder} is the leader of {self.name}")
+        return True
+
+    def _close(self) -> None:
+        self._expires = None
+        if self._connection is not None:
+            try:
+                # the connection is not returned to the pool, so a lock that is still held ends with its database session
+                self._connection.invalidate()
+                self._connection.close()
+            except SQLAlchemyError:
+                pass
+            self._connection = None
+
+
+_leader_lock: Optional[LeaderLock] = None
+_leader_lock_lock = threading.Lock()
+
+
+def get_leader_lock() -> LeaderLock:
+    """Get the lock of the sync work of this process. It is created on first use."""
+    global _leader_lock
+    with _leader_lock_lock:
+        if _leader_lock is None:
+            _leader_lock = LeaderLock("sync-worker", db.engine, current_app.config["LEADER_LEASE_TTL"])
+        return _leader_lock
+
+
+def reset_leader_lock() -> None:
+    """Release and drop the lock, it is created again on next use."""
+    global _leader_lock
+    with _leader_lock_lock:
+        if _leader_lock is not None:
+            _leader_lock.release()
+        _leader_lock = None
@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+from app.models import Upload, db
+from flask import current_app
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def add_upload(session_id: str, kind: str, payload: Dict, parent: Optional[Upload] = None) -> Upload:
+    """Add an upload unit to the outbox. It is written with the next commit.
+
+    Args:
+        session_id (str): Id of the session the unit belongs to.
+        kind (str): "session", "feedback", "ranking" or "batch".
+        payload (Dict): Payload of the unit.
+        parent (Optional[Upload], optional): Unit whose server id the unit is posted to. Defaults to None.
+
+    Returns:
+        Upload: The new unit.
+    """
+    upload = Upload(
+        key=uuid4().hex,
+        session_id=session_id,
+        kind=kind,
+        payload=payload,
+        parent=parent,
+        status=PENDING,
+        attempts=0,
+    )
+    db.session.add(upload)
+    return upload
+
+
+def get_uploads(session_ids: List[str]) -> Dict[str, List[Upload]]:
+    """Get the upload units of sessions in the order they were added, i.e., every unit after its parent."""
+    uploads: Dict[str, List[Upload]] = {session_id: [] for session_id in session_ids}
+    if not session_ids:
+        return uploads
+    for upload in Upload.query.filter(Upload.session_id.in_(session_ids)).order_by(Upload.id):
+        uploads[upload.session_id].append(upload)
+    return uploads
+
+
+def is_due(upload: Upload, now: Optional[datetime] = None) -> bool:
+    """Check if a unit is pending and not backing off after a failed attempt."""
+    now = now or _now()
+    return upload.status == PENDING and (upload.next_attempt is None or upload.next_attempt <= now)
+
+
+def is_sent(uploads: List[Upload]) -> bool:
+    """Check if all units of a session are sent."""
+    return all(upload.status == SENT for upload in uploads)
+
+
+def has_failed(uploads: List[Upload]) -> bool:
+    """Check if a unit of a session failed for good. The session is kept until the unit is retried with `retry_failed`."""
+    return any(upload.status == FAILED for upload in uploads)
+
+
+def retry_failed(session_ids: Optional[List[str]] = None) -> int:
+    """Set the units that failed for good back to pending, so they are posted again with the next sync. It is written with
+    the next commit.
+
+    Args:
+        session_ids (Optional[List[str]], optional): Only retry the units of these sessions. Defaults to None, i.e., all.
+
+    Returns:
+        int: Number of units that are retried.
+    """
+    query = Upload.query.filter_by(status=FAILED)
+    if session_ids:
+        query = query.filter(Upload.session_id.in_(session_ids))
+    uploads = query.all()
+    for upload in uploads:
+        upload.status = PENDING
+        upload.attempts = 0
+        upload.next_attempt = None
+    return len(uploads)
+
+
+def record_sent(upload: Upload, server_id: Optional[int] = None) -> None:
+    upload.status = SENT
+    upload.server_id = server_id
+    upload.attempts += 1
+    upload.next_attempt = None
+    upload.error = None
+
+
+def record_failure(upload: Upload, error: str) -> None:
+    """Record a failed attempt. The unit is retried after an exponential backoff of `UPLOAD_BACKOFF` seconds, doubled per
+    attempt up to `UPLOAD_BACKOFF_MAX`, and fails for good after `UPLOAD_MAX_ATTEMPTS` attempts, with all units posted to it.
+    """
+    upload.attempts += 1
+    upload.error = error[:512]
+    if upload.attempts >= current_app.config["UPLOAD_MAX_ATTEMPTS"]:
+        current_app.logger.error(f"Upload {upload.key} of session {upload.session_id} failed for good: {error}")
+        _fail(upload)
+        return
+    backoff = min(
+        current_app.config["UPLOAD_BACKOFF"] * 2 ** (upload.attempts - 1),
+        current_app.config["UPLOAD_BACKOFF_MAX"],
+    )
+    upload.next_attempt = _now() + timedelta(seconds=backoff)
+
+
+def _fail(upload: Upload) -> None:
+    upload.status = FAILED
+    upload.next_attempt = None
+    for child in upload.children:
+        if child.status == PENDING:
+            child.error = f"Upload {upload.key} failed"
+            _fail(child)
@@ -6,8 +6,26 @@ from typing import Any
 import aiohttp
 from aiohttp import ClientError, ClientResponseError
 from app.models import Result, System, db
+from app.services import db_service
+from app.services.breaker_service import get_breaker
+from app.services.cache_service import (
+    cache_result,
+    get_cached_result,
+    is_cacheable,
+    singleflight,
+)
+from app.services.client_service import get_client
+from app.services.counter_service import count_request
 from app.services.interleave_service import interleave_rankings
-from app.services.result_service import build_response, extract_hits
+from app.services.registry_service import get_system
+from app.services.result_service import (
+    build_response,
+    extract_hits,
+    gather_within_budget,
+    save_results,
+)
+from app.services.system_service import get_system_id
+from app.services.writer_service import add_result
 from flask import current_app
 from werkzeug.datastructures.structures import MultiDict
 
@@ -33,41 +51,48 @@ async def request_results_from_container(
         f'Start getting results from container: "{container_name}"'
     )
 
-    if current_app.config["SYSTEMS_CONFIG"][container_name].get("url"):
-        # Use custom URL if provided in the config
-        system_url = current_app.config["SYSTEMS_CONFIG"][container_name]["url"]
-    else:
-        system_url = f"http://{container_name}:5000"
-
-    url = f"{system_url}/{url}"
-
-    try:
+    url = f"{get_system(container_name).base_url}/{url}"
 
-        async with session.get(
-            url=url,
-            params=params,
-            headers={"Host": "localhost"},
-            timeout=aiohttp.ClientTimeout(total=3),
-        ) as response:
-            response.raise_for_status()
-            return await response.json()
-
-    except asyncio.TimeoutError:
-        current_app.logger.error(
-            f'Timeout while trying to reach "{container_name.upper()}"'
-        )
-    except ClientResponseError as e:
-        current_app.logger.error(
-            f'Client error with "{container_name.upper()}": {e.status} - {e.message}'
-        )
-    except ClientError as e:
-        current_app.logger.error(
-            f'Connection error "{container_name.upper()}": {str(e)}'
-        )
-    except Exception as e:
-        current_app.logger.exception(
-            f'Unexpected error "{container_name.upper()}": {str(e)}'
+    breaker = get_breaker(container_name)
+    if not breaker.allow_request():
+        # Fail fast instead of waiting for the timeout of a container that is known to be down
+        current_app.logger.debug(
+            f'Circuit breaker of "{container_name.upper()}" is open, skipping request'
         )
+    else:
+        ts_start = time.time()
+        try:
+            async with session.get(
+                url=url,
+                params=params,
+                headers={"Host": "localhost"},
+            ) as response:
+                response.raise_for_status()
+                result = await response.json()
+            breaker.record_success(time.time() - ts_start)
+            return result
+
+        except asyncio.CancelledError:
+            # e.g. cancelled because the latency budget ran out
+            breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            current_app.logger.error(
+                f'Timeout while trying to reach "{container_name.upper()}"'
+            )
+        except ClientResponseError as e:
+            current_app.logger.error(
+                f'Client error with "{container_name.upper()}": {e.status} - {e.message}'
+            )
+        except ClientError as e:
+            current_app.logger.error(
+                f'Connection error "{container_name.upper()}": {str(e)}'
+            )
+        except Exception as e:
+            current_app.logger.exception(
+                f'Unexpected error "{container_name.upper()}": {str(e)}'
+            )
+        breaker.record_failure(time.time() - ts_start)
 
     return {
         "item_id": "query",
@@ -98,24 +123,24 @@ async def forward_request(
     q_date = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
     ts_start = time.time()
 
-    # Get system ID
-    # increase number of request counter before actual request, in case of a failure
-    database_uri = current_app.config["SQLALCHEMY_DATABASE_URI"]
-    if current_app.config["TESTING"]:
-        database_uri = database_uri.replace("sqlite:///", "sqlite+aiosqlite:///")
-    else:
-        database_uri = database_uri.replace("postgresql", "postgresql+asyncpg")
-    system = db.session.query(System).where(System.name == container_name).first()
-    system.num_requests_no_head += 1
-    db.session.commit()
-
-    # Get the results from the container
-    async with aiohttp.ClientSession() as session:
-        result = await request_results_from_container(
-            session, container_name, url, params
-        )
+    # the counters are aggregated in memory and written in batches
+    count_request(container_name)
+
+    # Get the results from the shared cache or the container using the pooled client of this worker
+    cache_key = (container_name, "proxy", build_query_string(url, params))
+    result = get_cached_result(cache_key)
+    cached = result is not None
+    if not cached:
+        def fetch():
+            return request_results_from_container(get_client(container_name), container_name, url, params)
+
+        # identical requests in flight share one request to the container, unless the system opted out of sharing responses
+        result = await singleflight(cache_key, fetch) if is_cacheable(container_name) else await fetch()
 
     item_dict, hits = extract_hits(result, container_name, system_role)
+    if not cached and len(hits) > 0:
+        # empty responses are not shared, they might be caused by a failing container
+        cache_result(cache_key, result)
 
     # calc query execution time in ms
     ts_end = time.time()
@@ -131,11 +156,19 @@ async def forward_request(
         )
 
     # Save the ranking to the database
-    system_id = db.session.query(System).where(System.name == container_name).first()
+    system_id = get_system(container_name).system_id
+    if system_id is None:
+        # the system was added to the database after the registry was compiled
+        if db_service.is_enabled():
+            system_id = await get_system_id(container_name)
+        else:
+            system_id = (
+                db.session.query(System.id).where(System.name == container_name).scalar()
+            )
 
     ranking = Result(
         session_id=session_id,
-        system_id=system_id.id,
+        system_id=system_id,
         type=system_role,
         q=query,
         q_date=q_date,
@@ -146,8 +179,8 @@ async def forward_request(
         items=item_dict,
     )
 
-    db.session.add(ranking)
-    db.session.commit()
+    # written together with the other rankings of the request by `make_results`
+    add_result(ranking)
 
     return ranking, result
 
@@ -167,7 +200,7 @@ async def make_results(
             container_name_base = current_app.config["RECOMMENDER_BASELINE_CONTAINER"]
         current_app.logger.debug("Started gathering")
 
-        baseline, experimental = await asyncio.gather(
+        baseline, experimental = await gather_within_budget(
             forward_request(
                 container_name=container_name_base,
                 url=url,
@@ -182,23 +215,36 @@ async def make_results(
                 session_id=session_id,
                 system_role="EXP",
             ),
+            budget=current_app.config["LATENCY_BUDGET"].get("proxy"),
         )
-        ranking_base, result_base = baseline
-        ranking, result = experimental
+        if baseline is None:
+            ranking, result = experimental
+            response = build_response(ranking, container_name, result=result)
+            rankings = [ranking]
+        elif experimental is None:
+            ranking_base, result_base = baseline
+            response = build_response(
+                ranking_base, container_name_base, result=result_base
+            )
+            rankings = [ranking_base]
+        else:
+            ranking_base, result_base = baseline
+            ranking, result = experimental
 
-        interleaved_ranking = interleave_rankings(
-            ranking, ranking_base, system_type, rpp=len(ranking_base.items)
-        )
+            interleaved_ranking = interleave_rankings(
+                ranking, ranking_base, system_type, rpp=len(ranking_base.items)
+            )
 
-        response = build_response(
-            ranking=ranking,
-            container_name=container_name,
-            interleaved_ranking=interleaved_ranking,
-            ranking_base=ranking_base,
-            container_name_base=container_name_base,
-            result=result,
-            result_base=result_base,
-        )
+            response = build_response(
+                ranking=ranking,
+                container_name=container_name,
+                interleaved_ranking=interleaved_ranking,
+                ranking_base=ranking_base,
+                container_name_base=container_name_base,
+                result=result,
+                result_base=result_base,
+            )
+            rankings = [ranking_base, ranking, interleaved_ranking]
 
     else:
         # A/B testing
@@ -210,4 +256,7 @@ async def make_results(
             system_role="EXP",
         )
         response = build_response(ranking, container_name, result=result)
+        rankings = [ranking]
+
+    await save_results(*rankings)
     return response
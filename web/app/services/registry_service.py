@@ -0,0 +1,293 @@
+import copy
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Union
+
+from app.models import System, SystemsConfig, db
+from app.services.jsonpath_service import CompiledPath, FallbackPath, compile_path
+from config import parse_systems_config
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+
+
+# Connection pool settings that can be overwritten per system in the SYSTEMS_CONFIG
+POOL_SETTINGS = {
+    "timeout": "HTTP_TIMEOUT",
+    "limit": "HTTP_POOL_LIMIT",
+    "limit_per_host": "HTTP_POOL_LIMIT_PER_HOST",
+    "keepalive_timeout": "HTTP_KEEPALIVE_TIMEOUT",
+    "ttl_dns_cache": "HTTP_DNS_CACHE_TTL",
+}
+
+# Circuit breaker settings that can be overwritten per system in the SYSTEMS_CONFIG
+BREAKER_SETTINGS = {
+    "breaker_failures": "CIRCUIT_BREAKER_FAILURES",
+    "breaker_reset_timeout": "CIRCUIT_BREAKER_RESET_TIMEOUT",
+    "breaker_slow_call": "CIRCUIT_BREAKER_SLOW_CALL",
+}
+
+
+class SystemSpec:
+    """Compiled settings of a system that are read on every request. Instances are immutable."""
+
+    __slots__ = ("name", "type", "base_url", "system_id", "docid", "hits_path", "weight", "pool", "breaker", "cache_ttl")
+
+    def __init__(
+        self,
+        name: str,
+        type: str,
+        base_url: str,
+        system_id: Optional[int],
+        docid: str,
+        hits_path: Optional[Union[CompiledPath, FallbackPath]],
+        weight: float = 1.0,
+        pool: Optional[Mapping] = None,
+        breaker: Optional[Mapping] = None,
+        cache_ttl: float = 0,
+    ):
+        for slot, value in zip(
+            self.__slots__,
+            (
+                name,
+                type,
+                base_url,
+                system_id,
+                docid,
+                hits_path,
+                weight,
+                MappingProxyType(dict(pool or {})),
+                MappingProxyType(dict(breaker or {})),
+                cache_ttl,
+            ),
+        ):
+            object.__setattr__(self, slot, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SystemSpec is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("SystemSpec is immutable")
+
+    def __repr__(self) -> str:
+        return f"SystemSpec(name={self.name!r}, base_url={self.base_url!r}, system_id={self.system_id!r})"
+
+
+class SystemRegistry:
+    """Immutable snapshot of the compiled systems by name and by database id. A changed config is compiled into a new
+    registry that replaces the old one, so a request never sees a partially updated registry."""
+
+    __slots__ = ("systems", "names")
+
+    def __init__(self, systems: Dict[str, SystemSpec]):
+        object.__setattr__(self, "systems", MappingProxyType(dict(systems)))
+        object.__setattr__(
+            self,
+            "names",
+            MappingProxyType(
+                {spec.system_id: name for name, spec in systems.items() if spec.system_id is not None}
+            ),
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SystemRegistry is immutable")
+
+    def __getitem__(self, name: str) -> SystemSpec:
+        return self.systems[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.systems
+
+    def get(self, name: str) -> Optional[SystemSpec]:
+        return self.systems.get(name)
+
+
+def compile_system(name: str, system_config: Mapping, system_id: Optional[int] = None) -> SystemSpec:
+    """Compile the settings of a system from its SYSTEMS_CONFIG entry. Settings that are not in the entry are taken from the
+    global defaults of the app config.
+
+    Args:
+        name (str): Name of the system container.
+        system_config (Mapping): Entry of the system in the SYSTEMS_CONFIG.
+        system_id (Optional[int], optional): Database id of the system. Defaults to None.
+
+    Returns:
+        SystemSpec: Compiled system.
+    """
+    hits_path = system_config.get("hits_path")
+    if hits_path:
+        hits_path = compile_path(hits_path)
+    return SystemSpec(
+        name=name,
+        type=system_config.get("type"),
+        # Use custom URL if provided in the config
+        base_url=system_config.get("url") or f"http://{name}:5000",
+        system_id=system_id,
+        docid=system_config.get("docid", "docid"),
+        hits_path=hits_path,
+        # share of the traffic for the weighted allocation strategies
+        weight=float(system_config.get("weight", 1)),
+        pool={key: system_config.get(key, current_app.config[config_key]) for key, config_key in POOL_SETTINGS.items()},
+        breaker={
+            key.replace("breaker_", ""): system_config.get(key, current_app.config[config_key])
+            for key, config_key in BREAKER_SETTINGS.items()
+        },
+        # non-deterministic systems opt out of the result cache with "cache": false
+        cache_ttl=(
+            float(system_config.get("cache_ttl", current_app.config["RESULT_CACHE_TTL"]))
+            if system_config.get("cache", True)
+            else 0
+        ),
+    )
+
+
+def compile_registry(systems_config: Mapping, system_ids: Mapping[str, int]) -> SystemRegistry:
+    """Compile the SYSTEMS_CONFIG and the database ids of the systems into a registry."""
+    return SystemRegistry(
+        {
+            name: compile_system(name, system_config, system_ids.get(name))
+            for name, system_config in systems_config.items()
+        }
+    )
+
+
+_registry: Optional[SystemRegistry] = None
+# version of the shared SYSTEMS_CONFIG used by this worker, 0 before it uses a shared version
+_version = 0
+_last_check = 0.0
+
+
+def refresh_registry() -> SystemRegistry:
+    """Compile the current SYSTEMS_CONFIG and the systems in the database and swap the registry of this worker.
+
+    Returns:
+        SystemRegistry: The new registry.
+    """
+    global _registry
+    system_ids = dict(db.session.query(System.name, System.id).all())
+    registry = compile_registry(current_app.config["SYSTEMS_CONFIG"], system_ids)
+    _registry = registry
+    current_app.logger.debug(f"System registry compiled: {list(registry.systems)}")
+    return registry
+
+
+def get_registry() -> SystemRegistry:
+    """Get the system registry of this worker. It is compiled on first use."""
+    registry = _registry
+    if registry is None:
+        registry = refresh_registry()
+    return registry
+
+
+def get_system(container_name: str) -> SystemSpec:
+    """Get the compiled settings of a system.
+
+    Raises:
+        KeyError: If the system is not in the SYSTEMS_CONFIG.
+    """
+    return get_registry()[container_name]
+
+
+def get_system_settings(container_name: str) -> SystemSpec:
+    """Get the compiled settings of a system, or the global defaults for a system that is not in the SYSTEMS_CONFIG."""
+    return get_registry().get(container_name) or compile_system(container_name, {})
+
+
+def get_system_name(system_id: int) -> Optional[str]:
+    """Get the name of a system by its database id, looked up in the database if it is not in the registry."""
+    name = get_registry().names.get(system_id)
+    if name is None:
+        name = db.session.query(System.name).filter_by(id=system_id).scalar()
+    return name
+
+
+def apply_systems_config(systems_config: Dict) -> None:
+    """Use a SYSTEMS_CONFIG in this worker. The system lists are derived from it and the registry is swapped.
+
+    Raises:
+        ValueError: If the config is invalid. The current config is kept.
+    """
+    (
+        current_app.config["RANKING_CONTAINER_NAMES"],
+        current_app.config["RANKING_PRECOMPUTED_CONTAINER_NAMES"],
+        current_app.config["RANKING_BASELINE_CONTAINER"],
+        current_app.config["RECOMMENDER_CONTAINER_NAMES"],
+        current_app.config["RECOMMENDER_PRECOMPUTED_CONTAINER_NAMES"],
+        current_app.config["RECOMMENDER_BASELINE_CONTAINER"],
+        current_app.config["SYSTEMS_CONFIG"],
+    ) = parse_systems_config(systems_config)
+    refresh_registry()
+
+
+def hash_systems_config(systems_config: Dict) -> str:
+    """Hash the content of a SYSTEMS_CONFIG, independent of the order of its keys."""
+    return hashlib.sha256(json.dumps(systems_config, sort_keys=True).encode()).hexdigest()
+
+
+def publish_systems_config() -> int:
+    """Store the SYSTEMS_CONFIG of this worker as the new shared version, the other workers use it on their next check.
+
+    Returns:
+        int: The new version.
+    """
+    global _version
+    systems_config = SystemsConfig(
+        config=copy.deepcopy(current_app.config["SYSTEMS_CONFIG"]),
+        startup_hash=current_app.config["SYSTEMS_CONFIG_HASH"],
+        created=datetime.now(timezone.utc).replace(tzinfo=None),
+    )
+    db.session.add(systems_config)
+    db.session.commit()
+    _version = systems_config.id
+    current_app.logger.info(f"SYSTEMS_CONFIG version {_version} published")
+    return _version
+
+
+def sync_registry() -> bool:
+    """Use the latest shared SYSTEMS_CONFIG if it is newer than the one of this worker.
+
+    On the first check of a worker, a stored version only wins if it was published by a deployment that was started
+    with the same SYSTEMS_CONFIG as this worker. Otherwise, the SYSTEMS_CONFIG was changed by a redeploy and the
+    config this worker was started with is published as the new version.
+
+    Returns:
+        bool: True if a newer version is used now.
+    """
+    global _version
+    try:
+        latest = db.session.query(func.max(SystemsConfig.id)).scalar()
+        if latest is None or latest <= _version:
+            return False
+        systems_config = db.session.get(SystemsConfig, latest)
+        if _version == 0 and systems_config.startup_hash != current_app.config["SYSTEMS_CONFIG_HASH"]:
+            publish_systems_config()
+            return False
+        apply_systems_config(copy.deepcopy(systems_config.config))
+    except (SQLAlchemyError, ValueError) as e:
+        db.session.rollback()
+        current_app.logger.error(f"Could not sync the SYSTEMS_CONFIG: {str(e)}")
+        return False
+    _version = latest
+    current_app.logger.info(f"Using SYSTEMS_CONFIG version {latest}")
+    return True
+
+
+def sync_registry_if_due() -> bool:
+    """Check for a newer shared SYSTEMS_CONFIG at most every `REGISTRY_SYNC_INTERVAL` seconds. Runs before every request."""
+    global _last_check
+    now = time.monotonic()
+    if now - _last_check < current_app.config["REGISTRY_SYNC_INTERVAL"]:
+        return False
+    _last_check = now
+    return sync_registry()
+
+
+def reset_system_registry() -> None:
+    """Drop the registry, it is compiled again with the current config on next use."""
+    global _registry, _version, _last_check
+    _registry = None
+    _version = 0
+    _last_check = 0.0
@@ -1,13 +1,41 @@
 import asyncio
 import time
 from datetime import datetime, timezone
-from typing import Dict, Optional, Union
+from typing import Any, Coroutine, Dict, Optional, Tuple, Union
 
 import aiohttp
 from aiohttp import ClientError, ClientResponseError
 from app.models import Result, System, db
+from app.services import db_service, item_service, writer_service
+from app.services.breaker_service import get_breaker
+from app.services.cache_service import (
+    cache_result,
+    get_cached_result,
+    is_cacheable,
+    normalize_query,
+    singleflight,
+)
+from app.services.client_service import get_client
+from app.services.counter_service import (
+    count_request,
+    flush_counters_if_due,
+    flush_counters_if_due_async,
+    restore_counters,
+)
+from app.services.db_service import get_async_session
 from app.services.interleave_service import interleave_rankings
+from app.services.item_service import pack_rows_async
+from app.services.registry_service import get_system, get_system_name
+from app.services.system_service import get_system_id
+from app.services.writer_service import (
+    add_result,
+    find_pending_result,
+    get_pending_result,
+    log_results,
+    result_rows,
+)
 from flask import current_app
+from sqlalchemy import insert
 
 
 async def request_results_from_container(
@@ -39,41 +67,48 @@ async def request_results_from_container(
 
     query_key = "itemid" if system_type == "recommendation" else "query"
 
-    if current_app.config["SYSTEMS_CONFIG"][container_name].get("url"):
-        # Use custom URL if provided in the config
-        url = (
-            current_app.config["SYSTEMS_CONFIG"][container_name]["url"]
-            + f"/{system_type}"
+    url = f"{get_system(container_name).base_url}/{system_type}"
+
+    breaker = get_breaker(container_name)
+    if not breaker.allow_request():
+        # Fail fast instead of waiting for the timeout of a container that is known to be down
+        current_app.logger.debug(
+            f'Circuit breaker of "{container_name.upper()}" is open, skipping request'
         )
     else:
-        url = f"http://{container_name}:5000/{system_type}"
+        ts_start = time.time()
+        try:
+            async with session.get(
+                url,
+                params={query_key: query, "rpp": rpp, "page": page},
+                headers={"Host": "localhost"},
+            ) as response:
+                response.raise_for_status()
+                result = await response.json()
+            breaker.record_success(time.time() - ts_start)
+            return result
 
-    try:
-        async with session.get(
-            url,
-            params={query_key: query, "rpp": rpp, "page": page},
-            headers={"Host": "localhost"},
-            timeout=aiohttp.ClientTimeout(total=3),  # optional: set your timeout
-        ) as response:
-            response.raise_for_status()
-            return await response.json()
-
-    except asyncio.TimeoutError:
-        current_app.logger.error(
-            f'Timeout while trying to reach "{container_name.upper()}"'
-        )
-    except ClientResponseError as e:
-        current_app.logger.error(
-            f'Client error with "{container_name.upper()}": {e.status} - {e.message}'
-        )
-    except ClientError as e:
-        current_app.logger.error(
-            f'Connection error "{container_name.upper()}": {str(e)}'
-        )
-    except Exception as e:
-        current_app.logger.exception(
-            f'Unexpected error "{container_name.upper()}": {str(e)}'
-        )
+        except asyncio.CancelledError:
+            # e.g. cancelled because the latency budget ran out
+            breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            current_app.logger.error(
+                f'Timeout while trying to reach "{container_name.upper()}"'
+            )
+        except ClientResponseError as e:
+            current_app.logger.error(
+                f'Client error with "{container_name.upper()}": {e.status} - {e.message}'
+            )
+        except ClientError as e:
+            current_app.logger.error(
+                f'Connection error "{container_name.upper()}": {str(e)}'
+            )
+        except Exception as e:
+            current_app.logger.exception(
+                f'Unexpected error "{container_name.upper()}": {str(e)}'
+            )
+        breaker.record_failure(time.time() - ts_start)
 
     return {
         "itemid": query,
@@ -98,11 +133,10 @@ def extract_hits(
     Returns:
         Union[Dict, list]: The extracted item dicts in the standardized stella format is returned and the hits list as in the original response.
     """
+    system = get_system(container_name)
     # How docids are referenced in the result
-    docid_key = current_app.config["SYSTEMS_CONFIG"][container_name].get(
-        "docid", "docid"
-    )
-    hits_path = current_app.config["SYSTEMS_CONFIG"][container_name].get("hits_path")
+    docid_key = system.docid
+    hits_path = system.hits_path
     current_app.logger.debug(f"Extracting hits from {container_name}: {hits_path}")
     if hits_path is None:
         current_app.logger.debug("No custom hits path provided")
@@ -110,7 +144,7 @@ def extract_hits(
         current_app.logger.debug(hits)
 
     else:
-        hits = hits_path.find(result)[0].value
+        hits = hits_path.get(result)
 
     if len(hits) > 0 and isinstance(hits[0], dict):  # Custom format
         item_dict = {
@@ -134,6 +168,7 @@ async def query_system(
     system_type: str = "ranking",
 ) -> Union[Result, Dict]:
     """Handle the requesting of a system container. This function increments the request counter for the system, gets the results from the container, extracts the hits, and saves the results to the database.
+    Responses of the container are shared between sessions by the result cache. The logged rankings are still created per session.
 
     Args:
         container_name (str): Name of the container results are requested from.
@@ -152,29 +187,26 @@ async def query_system(
     q_date = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
     ts_start = time.time()
 
-    # Get system ID and check for HEAD request
-    # increase number of request counter before actual request, in case of a failure
-    database_uri = current_app.config["SQLALCHEMY_DATABASE_URI"]
-    if current_app.config["TESTING"]:
-        database_uri = database_uri.replace("sqlite:///", "sqlite+aiosqlite:///")
-    else:
-        database_uri = database_uri.replace("postgresql", "postgresql+asyncpg")
-
-    system = db.session.query(System).where(System.name == container_name).first()
+    # the counters are aggregated in memory and written in batches
+    count_request(container_name, head=query in current_app.config["HEAD_QUERIES"])
 
-    if query in current_app.config["HEAD_QUERIES"]:
-        system.num_requests += 1
-    else:
-        system.num_requests_no_head += 1
-    db.session.commit()
+    # Get the results from the shared cache or the container using the pooled client of this worker
+    cache_key = (container_name, system_type, normalize_query(query), rpp, page)
+    result = get_cached_result(cache_key)
+    cached = result is not None
+    if not cached:
+        def fetch():
+            return request_results_from_container(
+                get_client(container_name), container_name, query, rpp, page, system_type=system_type
+            )
 
-    # Get the results from the container
-    async with aiohttp.ClientSession() as session:
-        result = await request_results_from_container(
-            session, container_name, query, rpp, page, system_type=system_type
-        )
+        # identical requests in flight share one request to the container, unless the system opted out of sharing responses
+        result = await singleflight(cache_key, fetch) if is_cacheable(container_name) else await fetch()
 
     item_dict, hits = extract_hits(result, container_name, system_role)
+    if not cached and len(hits) > 0:
+        # empty responses are not shared, they might be caused by a failing container
+        cache_result(cache_key, result)
 
     # calc query execution time in ms
     ts_end = time.time()
@@ -189,11 +221,19 @@ async def query_system(
 
     # Save the ranking to the database
 
-    system_id = db.session.query(System).where(System.name == container_name).first()
+    system_id = get_system(container_name).system_id
+    if system_id is None:
+        # the system was added to the database after the registry was compiled
+        if db_service.is_enabled():
+            system_id = await get_system_id(container_name)
+        else:
+            system_id = (
+                db.session.query(System.id).where(System.name == container_name).scalar()
+            )
 
     ranking = Result(
         session_id=session_id,
-        system_id=system_id.id,
+        system_id=system_id,
         type=system_role,
         q=query,
         q_date=q_date,
@@ -204,8 +244,8 @@ async def query_system(
         items=item_dict,
     )
 
-    db.session.add(ranking)
-    db.session.commit()
+    # written together with the other rankings of the request by `make_results`
+    add_result(ranking)
 
     return ranking, result
 
@@ -221,11 +261,12 @@ def build_header(ranking: Result, experimental_system: Optional[str] = None) ->
         Dict: A dictionary containing the header information for the response.
     """
     if not experimental_system:
-        experimental_system = (
-            db.session.query(System).filter_by(id=ranking.system_id).first().name
-        )
+        experimental_system = get_system_name(ranking.system_id)
     if not current_app.config["INTERLEAVE"]:
         container = {"exp": experimental_system}
+    elif ranking.type in ["BASE", "EXP"]:
+        # Interleaving fell back to the only system that answered within the latency budget
+        container = {ranking.type.lower(): experimental_system}
     else:
         if ranking.type == "RANK":
             container_name_base = current_app.config["RANKING_BASELINE_CONTAINER"]
@@ -236,6 +277,9 @@ def build_header(ranking: Result, experimental_system: Optional[str] = None) ->
     # Use TDI id when available (interleaved results), otherwise fall back to the
     # primary key of this ranking. This ensures non-interleaved requests still
     # get a valid rid instead of null.
+    if ranking.tdi is None and ranking.id is None:
+        # the ranking is not written yet, flush the pending rankings of the request to get its id
+        db.session.flush()
     rid = ranking.tdi if ranking.tdi is not None else ranking.id
 
     return {
@@ -249,6 +293,19 @@ def build_header(ranking: Result, experimental_system: Optional[str] = None) ->
     }
 
 
+def build_body(items: Dict) -> Dict:
+    """Build the body of the response from the items of a ranking. The ranks are string keys, as in rankings loaded from the
+    database, so new and cached rankings give the same response.
+
+    Args:
+        items (Dict): Items of the ranking by rank.
+
+    Returns:
+        Dict: Items by rank as a string.
+    """
+    return {str(rank): item for rank, item in items.items()}
+
+
 def build_response(
     ranking: Result,
     container_name: str,
@@ -263,7 +320,7 @@ def build_response(
     Args:
         ranking (Result): Ranking from the requested system. If only this is provided, hence only one system is requested, this is treated as the experimental responds.
         container_name (str): Name of the container the ranking corresponds to.
-        interleaved_ranking (Optional[Result], optional): An interleaved ranking. Defaults to None.
+        interleaved_ranking (Optional[Result], optional): An interleaved ranking. If it is missing, only the ranking is returned. Defaults to None.
         ranking_base (Optional[Result], optional): Ranking from the requested baseline system. Defaults to None.
         container_name_base (Optional[str], optional): Name of the container the ranking_base corresponds to. Defaults to None.
         result (Optional[Result], optional): Parsed results from the requested experimental system. Defaults to None.
@@ -272,16 +329,11 @@ def build_response(
 
     def build_id_map(container_name, ranking, result):
         """Build the docid ranking position map to construct passthrough responses from interleaved rankings."""
-        hits_path = current_app.config["SYSTEMS_CONFIG"][container_name].get(
-            "hits_path"
-        )
-        docid_name = current_app.config["SYSTEMS_CONFIG"][container_name].get(
-            "docid", "docid"
-        )
+        system = get_system(container_name)
+        hits_path = system.hits_path
+        docid_name = system.docid
         if hits_path:
-            matches = hits_path.find(result)
-            assert len(matches) == 1
-            hits = matches[0].value
+            hits = hits_path.get(result)
             if hits and isinstance(hits[0], dict):
                 id_map = {hit[docid_name]: hit for hit in hits}
             else:
@@ -291,19 +343,17 @@ def build_response(
             id_map = {hit[docid_name]: hit for hit in ranking.items.values()}
         return id_map
 
-    if not current_app.config["INTERLEAVE"]:
+    if not current_app.config["INTERLEAVE"] or interleaved_ranking is None:
         header = build_header(ranking, container_name)
         # Not interleaved and custom returns
-        if current_app.config["SYSTEMS_CONFIG"][container_name].get("hits_path"):
+        if get_system(container_name).hits_path:
             current_app.logger.debug("Not interleaved, custom returns")
 
-            header["body"] = ranking.items
+            header["body"] = build_body(ranking.items)
             result["_stella"] = header
 
             # add result to db object for consistency based on session_id,
             ranking.custom_response = result
-            db.session.add(ranking)
-            db.session.commit()
             return result  # add header parameters directly to response
 
         else:
@@ -311,10 +361,8 @@ def build_response(
             current_app.logger.debug("Not interleaved, no custom returns")
             # TODO: this will always state the system type as EXP even if its a BASE system.
             # This can be a problem for A/B test configurations.
-            return {"header": header, "body": ranking.items}
+            return {"header": header, "body": build_body(ranking.items)}
     else:
-        assert interleaved_ranking is not None, "Interleaved ranking is required"
-
         # parse hits from both systems
         base_map = build_id_map(container_name_base, ranking_base, result_base)
         exp_map = build_id_map(container_name, ranking, result)
@@ -331,29 +379,68 @@ def build_response(
                     f"Docid '{docid}' not found in {doc_type} map."
                 )
 
-        base_path = current_app.config["SYSTEMS_CONFIG"][container_name_base].get(
-            "hits_path"
-        )
+        base_path = get_system(container_name_base).hits_path
 
         header = build_header(interleaved_ranking, container_name)
         if base_path:
             # Interleaved and custom returns
             current_app.logger.debug("Interleaved, custom returns")
-            base_path.update(result_base, hits)
+            base_path.set(result_base, hits)
             result = result_base
-            header["body"] = interleaved_ranking.items
+            header["body"] = build_body(interleaved_ranking.items)
             result["_stella"] = header
 
             # add result to db object for consistency based on session_id,
             interleaved_ranking.custom_response = result
-            db.session.add(interleaved_ranking)
-            db.session.commit()
             return result
 
         else:
             # Interleaved and no custom returns
             current_app.logger.debug("Interleaved, no custom returns")
-            return {"header": header, "body": interleaved_ranking.items}
+            return {"header": header, "body": build_body(interleaved_ranking.items)}
+
+
+async def gather_within_budget(
+    baseline: Coroutine, experimental: Coroutine, budget: Optional[float] = None
+) -> Tuple[Optional[Any], Optional[Any]]:
+    """Run the requests to the baseline and the experimental system concurrently within a latency budget.
+    If the budget runs out and only one system has answered, the request to the other system is cancelled.
+    If no system has answered yet, the first system that answers is used.
+    Rankings that fall back to a single system are not interleaved. Their feedback is marked as not interleaved and can be excluded from the evaluation.
+
+    Args:
+        baseline (Coroutine): Request to the baseline system.
+        experimental (Coroutine): Request to the experimental system.
+        budget (Optional[float], optional): Latency budget in seconds. If None, both systems are awaited. Defaults to None.
+
+    Returns:
+        Tuple[Optional[Any], Optional[Any]]: Results of the baseline and the experimental system. The result of a cancelled request is None.
+    """
+    if budget is None:
+        return tuple(await asyncio.gather(baseline, experimental))
+
+    tasks = {
+        "BASE": asyncio.ensure_future(baseline),
+        "EXP": asyncio.ensure_future(experimental),
+    }
+    done, pending = await asyncio.wait(tasks.values(), timeout=budget)
+    if not done:
+        done, pending = await asyncio.wait(
+            tasks.values(), return_when=asyncio.FIRST_COMPLETED
+        )
+
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        current_app.logger.warning(
+            f"Latency budget of {budget}s exceeded. Falling back to the {'baseline' if tasks['BASE'] in done else 'experimental'} system without interleaving."
+        )
+
+    return tuple(
+        task.result() if task in done else None
+        for task in (tasks["BASE"], tasks["EXP"])
+    )
 
 
 async def make_results(
@@ -372,7 +459,7 @@ async def make_results(
             container_name_base = current_app.config["RECOMMENDER_BASELINE_CONTAINER"]
         current_app.logger.debug("Started gathering")
 
-        baseline, experimental = await asyncio.gather(
+        baseline, experimental = await gather_within_budget(
             query_system(
                 container_name_base,
                 query,
@@ -391,23 +478,36 @@ async def make_results(
                 system_role="EXP",
                 system_type=system_type,
             ),
+            budget=current_app.config["LATENCY_BUDGET"].get(system_type),
         )
-        ranking_base, result_base = baseline
-        ranking, result = experimental
-
-        interleaved_ranking = interleave_rankings(
-            ranking, ranking_base, system_type, rpp
-        )
-
-        response = build_response(
-            ranking=ranking,
-            container_name=container_name,
-            interleaved_ranking=interleaved_ranking,
-            ranking_base=ranking_base,
-            container_name_base=container_name_base,
-            result=result,
-            result_base=result_base,
-        )
+        if baseline is None:
+            ranking, result = experimental
+            response = build_response(ranking, container_name, result=result)
+            rankings = [ranking]
+        elif experimental is None:
+            ranking_base, result_base = baseline
+            response = build_response(
+                ranking_base, container_name_base, result=result_base
+            )
+            rankings = [ranking_base]
+        else:
+            ranking_base, result_base = baseline
+            ranking, result = experimental
+
+            interleaved_ranking = interleave_rankings(
+                ranking, ranking_base, system_type, rpp
+            )
+
+            response = build_response(
+                ranking=ranking,
+                container_name=container_name,
+                interleaved_ranking=interleaved_ranking,
+                ranking_base=ranking_base,
+                container_name_base=container_name_base,
+                result=result,
+                result_base=result_base,
+            )
+            rankings = [ranking_base, ranking, interleaved_ranking]
 
     else:
         ranking, result = await query_system(
@@ -420,12 +520,67 @@ async def make_results(
             system_type=system_type,
         )
         response = build_response(ranking, container_name, result=result)
+        rankings = [ranking]
 
+    await save_results(*rankings)
     return response
 
 
+def commit_results(*rankings: Result) -> None:
+    """Write the rankings of a request in a single transaction. The baseline, experimental and interleaved rankings are inserted
+    together, and due request counters are written in the same transaction.
+    With `ASYNC_RESULT_LOGGING`, the rankings are queued for the background writer instead.
+
+    Args:
+        *rankings (Result): Rankings of the request.
+    """
+    if writer_service.is_enabled():
+        log_results(rankings)
+        flush_counters_if_due()
+        return
+
+    # the rankings are only in the session yet if they were added without async engine
+    db.session.add_all(rankings)
+    counts = flush_counters_if_due(commit=False)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # the counts are not written with the failed transaction
+        if counts:
+            restore_counters(counts)
+        raise
+
+
+async def save_results(*rankings: Result) -> None:
+    """Write the rankings of a request from a coroutine. With `ASYNC_DATABASE`, the rankings and due request counters are written
+    in a single transaction of the async engine, so the event loop can serve other requests meanwhile. Otherwise see `commit_results`.
+
+    Args:
+        *rankings (Result): Rankings of the request.
+    """
+    if writer_service.is_enabled() or not db_service.is_enabled():
+        commit_results(*rankings)
+        return
+
+    rows = result_rows(rankings)
+    counts = None
+    async with get_async_session() as session:
+        try:
+            async with session.begin():
+                if item_service.is_enabled():
+                    await pack_rows_async(session, rows)
+                await session.execute(insert(Result), rows)
+                counts = await flush_counters_if_due_async(session)
+        except Exception:
+            # the counts are not written with the failed transaction
+            if counts:
+                restore_counters(counts)
+            raise
+
+
 def get_cached_response(query: str, page: int, session_id: str) -> Optional[Dict]:
-    """Get a cached response for the given query, page, and session ID. Cached results are only returned if they are not older than the session expiration time. The cached result is returned with a new ranking ID and updated timestamp and the updated result is saved to the database. This is done to ensure consistent results throughout a session but still track when a user requests the ranking again.
+    """Get a cached response for the given query, page, and session ID. Cached results are only returned if they are not older than the session expiration time. The cached result is returned with a new ranking ID and updated timestamp. The new impression is saved to the database and references the cached ranking instead of copying its items. This is done to ensure consistent results throughout a session but still track when a user requests the ranking again.
 
     Args:
         query (str): Query string for the ranking.
@@ -441,6 +596,9 @@ def get_cached_response(query: str, page: int, session_id: str) -> Optional[Dict
         .filter_by(q=query, page=page, session_id=session_id)
         .first()
     )
+    if not result:
+        # the rankings of the session might not be written yet
+        result = find_pending_result(query, page, session_id)
     if not result:
         current_app.logger.debug("No cached result found")
         return None
@@ -459,14 +617,23 @@ def get_cached_response(query: str, page: int, session_id: str) -> Optional[Dict
         )
         return None
 
+    # get the ranking shown by an impression
+    if result.ref is not None:
+        result = get_pending_result(result.ref) or db.session.get(Result, result.ref)
+        if not result:
+            current_app.logger.warning("Referenced ranking not found")
+            return None
+
     # get the interleaved ranking
     if result.tdi:
-        result = db.session.query(Result).filter_by(id=result.tdi).first()
+        result = get_pending_result(result.tdi) or (
+            db.session.query(Result).filter_by(id=result.tdi).first()
+        )
         if not result:
             current_app.logger.warning("Interleaved ranking not found")
             return None
 
-    # update timestamp and add as a new record to db
+    # update timestamp and add an impression referencing the ranking to db
     result_new = Result(
         session_id=session_id,
         system_id=result.system_id,
@@ -478,19 +645,18 @@ def get_cached_response(query: str, page: int, session_id: str) -> Optional[Dict
         num_found=result.num_found,
         page=page,
         rpp=result.rpp,
-        items=result.items,
         tdi=result.tdi,
-        custom_response=result.custom_response,
+        ref=result.id,
     )
-    db.session.add(result_new)
-    db.session.commit()
+    add_result(result_new)
+    commit_results(result_new)
 
     # Check if we need a custom response. Base system dictates if custom response is needed.
-    if result_new.custom_response:
-        response = result_new.custom_response
+    if result.custom_response:
+        response = result.custom_response
     else:
         response = {
             "header": build_header(result_new),
-            "body": result_new.items,
+            "body": result.items,
         }
     return response
@@ -1,7 +1,61 @@
 from datetime import datetime, timezone
+from typing import Optional
 from uuid import uuid4
 
 from app.models import Session, System, db
+from app.services.cache_service import TTLCache
+from flask import current_app
+
+_session_cache: Optional[TTLCache] = None
+
+
+def get_session_cache() -> TTLCache:
+    """Get the cache of existing session ids of this worker."""
+    global _session_cache
+    if _session_cache is None:
+        _session_cache = TTLCache(
+            maxsize=current_app.config["SESSION_CACHE_SIZE"],
+            ttl=current_app.config["SESSION_CACHE_TTL"],
+        )
+    return _session_cache
+
+
+def reset_session_cache() -> None:
+    """Drop the session cache, it is created again with the current config on next use."""
+    global _session_cache
+    _session_cache = None
+
+
+def has_session(session_id: Optional[str], cached: bool = True) -> bool:
+    """Check if a session exists. Known sessions are cached, so returning users do not need a database round trip.
+
+    The sync deletes sessions in another process, which cannot remove them from the cache of this worker. A cached session
+    is therefore only good enough to look up its cached rankings, and is checked again with `cached=False` before new
+    rankings are written to it.
+
+    Args:
+        session_id (Optional[str]): Id of the session.
+        cached (bool, optional): Whether a cached session is trusted. Otherwise the database is asked and the cache is updated. Defaults to True.
+
+    Returns:
+        bool: True if the session exists.
+    """
+    if session_id is None:
+        return False
+    cache = get_session_cache()
+    if cached and cache.get(session_id):
+        return True
+    exists = db.session.query(Session.id).filter_by(id=session_id).first() is not None
+    if exists:
+        cache.set(session_id, True)
+    else:
+        cache.pop(session_id)
+    return exists
+
+
+def forget_session(session_id: str) -> None:
+    """Remove a session from the cache of this worker, e.g., when it is exited or deleted."""
+    get_session_cache().pop(session_id)
 
 
 def create_new_session(container_name=None, sid=None, type=None):
@@ -45,5 +99,6 @@ def create_new_session(container_name=None, sid=None, type=None):
     db.session.add(session)
 
     db.session.commit()
+    get_session_cache().set(session.id, True)
 
     return session.id
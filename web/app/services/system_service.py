@@ -1,15 +1,18 @@
+from typing import Optional
+
 import requests
-from app.models import System, db
+from app.models import System
+from app.services.allocator_service import get_allocator
+from app.services.breaker_service import get_open_circuits
+from app.services.db_service import get_async_session
+from app.services.registry_service import get_system
 from flask import current_app
+from sqlalchemy import select
 
 
 def rest_index(container_name):
     try:
-        if current_app.config["SYSTEMS_CONFIG"][container_name].get("url"):
-            # Use custom URL if provided in the config
-            url = current_app.config["SYSTEMS_CONFIG"][container_name]["url"] + "/index"
-        else:
-            url = f"http://{container_name}:5000/index"
+        url = get_system(container_name).base_url + "/index"
     except KeyError:
         msg = f"Container '{container_name}' not found in SYSTEMS_CONFIG."
         current_app.logger.error(msg)
@@ -42,13 +45,14 @@ def rest_index(container_name):
 
 def get_least_served_system(query: str = "", type: str = "RANK") -> str:
     """Get the least served system of a given system type. If a query is provided, it is first checked if a precomputed system is available for that query.
+    The request counts are kept in memory by the traffic allocator of the worker and synced with the database periodically.
 
     Args:
         query (str, optional): Query to check for precomputed runs. Defaults to "".
         type (str, optional): System type. Either RANK or REC. Defaults to "RANK".
 
     Returns:
-        str: Name of the least served system.
+        str: Name of the system assigned by the traffic allocator (`ALLOCATION_STRATEGY`). Systems whose circuit breaker is open are skipped.
     """
     if type == "RANK":
         exclude_systems = (
@@ -67,29 +71,43 @@ def get_least_served_system(query: str = "", type: str = "RANK") -> str:
             + current_app.config["RECOMMENDER_PRECOMPUTED_CONTAINER_NAMES"]
         )
 
+    allocator = get_allocator()
+    allocator.sync_if_due()
+    # Skip containers that are known to be down. If all of them are down, fall back to all of them.
+    open_circuits = set(get_open_circuits())
+
     if query in current_app.config["HEAD_QUERIES"]:
-        container_name = (
-            db.session.query(System)
-            .filter(System.name != current_app.config["RANKING_BASELINE_CONTAINER"])
-            .filter(
-                System.name.notin_(
-                    current_app.config["RECOMMENDER_CONTAINER_NAMES"]
-                    + current_app.config["RECOMMENDER_PRECOMPUTED_CONTAINER_NAMES"]
-                )
-            )
-            .order_by(System.num_requests)
-            .first()
-            .name
+        # Head queries go to the least served system of all systems in the database except the ranking baseline and recommenders
+        excluded = (
+            [current_app.config["RANKING_BASELINE_CONTAINER"]]
+            + current_app.config["RECOMMENDER_CONTAINER_NAMES"]
+            + current_app.config["RECOMMENDER_PRECOMPUTED_CONTAINER_NAMES"]
         )
+        candidates = [name for name in allocator.systems() if name not in excluded]
+        available = [name for name in candidates if name not in open_circuits]
+        container_name = allocator.choose(available or candidates, head=True, strategy="least_served")
     else:
-        # Select least served container
-        container_name = (
-            db.session.query(System)
-            .filter(System.name.in_(current_app.config["RANKING_CONTAINER_NAMES"] + current_app.config["RECOMMENDER_CONTAINER_NAMES"]))
-            .filter(System.name.notin_(exclude_systems))
-            .filter(System.system_type == 'LIVE')
-            .order_by(System.num_requests_no_head)
-            .first()
-            .name
-        )
+        candidates = [
+            name
+            for name in current_app.config["RANKING_CONTAINER_NAMES"] + current_app.config["RECOMMENDER_CONTAINER_NAMES"]
+            if name not in exclude_systems and allocator.is_live(name)
+        ]
+        available = [name for name in candidates if name not in open_circuits]
+        container_name = allocator.choose(available or candidates)
     return container_name
+
+
+async def get_system_id(container_name: str) -> Optional[int]:
+    """Get the database id of a system with the async engine.
+
+    Args:
+        container_name (str): Name of the system.
+
+    Returns:
+        Optional[int]: Id of the system or None if it does not exist.
+    """
+    async with get_async_session() as session:
+        result = await session.execute(
+            select(System.id).where(System.name == container_name)
+        )
+        return result.scalars().first()
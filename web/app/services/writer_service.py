@@ -0,0 +1,352 @@
+import atexit
+import queue
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from app.models import Result, db
+from app.services import item_service
+from flask import Flask, current_app
+from sqlalchemy import func, insert, inspect, text
+
+# attribute names of the columns for ORM bulk inserts
+RESULT_COLUMNS = [attribute.key for attribute in inspect(Result).column_attrs]
+
+
+def result_rows(rankings: Iterable[Result]) -> List[Dict]:
+    """Convert rankings with ids to rows for a multi-row INSERT. Interleaved rankings come first, they are referenced by the tdi of the other rankings."""
+    rankings = sorted(rankings, key=lambda r: r.tdi is not None and r.tdi != r.id)
+    return [{key: getattr(ranking, key) for key in RESULT_COLUMNS} for ranking in rankings]
+
+
+class IdAllocator:
+    """Reserves blocks of ranking ids, so rankings have their id for the response before they are written."""
+
+    def __init__(self, block_size: int = 100):
+        self.block_size = block_size
+        self._ids: deque = deque()
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def allocate(self) -> int:
+        with self._lock:
+            if not self._ids:
+                self._ids.extend(self._reserve())
+            return self._ids.popleft()
+
+    def _reserve(self) -> List[int]:
+        if db.engine.dialect.name == "postgresql":
+            # ids drawn from the sequence are never handed out twice, also not to other workers
+            return (
+                db.session.execute(
+                    text(
+                        "SELECT nextval(pg_get_serial_sequence('results', 'id')) FROM generate_series(1, :n)"
+                    ),
+                    {"n": self.block_size},
+                )
+                .scalars()
+                .all()
+            )
+        # Without a sequence, continue after the highest id. This is only safe for a single process, e.g., during development.
+        start = max(db.session.query(func.max(Result.id)).scalar() or 0, self._last) + 1
+        self._last = start + self.block_size - 1
+        return list(range(start, self._last + 1))
+
+
+class ResultWriter:
+    """Writes the logged rankings of the requests in batches in a background thread.
+
+    Requests submit their rankings to a bounded queue. The queue is written with multi-row INSERTs once it holds `batch_size`
+    rankings, at the latest after `interval` seconds, and when the worker exits. When the queue is full, a request waits up to
+    `timeout` seconds for space and writes its rankings itself otherwise. Rankings that are not written yet can still be looked up.
+    If a batch fails, its rankings are written one at a time, and rankings that still fail are retried with the next flush up to
+    `max_attempts` times.
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        maxsize: int = 10000,
+        batch_size: int = 500,
+        interval: float = 1,
+        timeout: float = 1,
+        max_attempts: int = 3,
+    ):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+
+        self._queue: "queue.Queue[List[Result]]" = queue.Queue(maxsize)
+        self._queued = 0  # rankings in the queue
+        # rankings that are not written yet by id and by (session_id, q, page)
+        self._pending: Dict[int, Result] = {}
+        self._pending_queries: Dict[tuple, int] = {}
+        self._attempts: Dict[int, int] = {}  # failed attempts by ranking id
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="stella-result-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, rankings: List[Result]) -> None:
+        """Queue the rankings of a request. The rankings of a request are always written in the same batch."""
+        with self._pending_lock:
+            for ranking in rankings:
+                self._pending[ranking.id] = ranking
+                self._pending_queries.setdefault(
+                    (ranking.session_id, ranking.q, ranking.page), ranking.id
+                )
+
+        try:
+            self._queue.put(rankings, timeout=self.timeout)
+        except queue.Full:
+            current_app.logger.warning(
+                "Result queue is full, the request writes its rankings itself"
+            )
+            self._write(rankings)
+            return
+
+        with self._pending_lock:
+            self._queued += len(rankings)
+            if self._queued >= self.batch_size:
+                self._wakeup.set()
+
+    def get(self, ranking_id: int) -> Optional[Result]:
+        """Get a ranking that is not written yet by its id."""
+        with self._pending_lock:
+            return self._pending.get(ranking_id)
+
+    def find(self, query: str, page: int, session_id: str) -> Optional[Result]:
+        """Get the first ranking of a session for a query and page that is not written yet."""
+        with self._pending_lock:
+            ranking_id = self._pending_queries.get((session_id, query, page))
+            return self._pending.get(ranking_id)
+
+    def flush(self) -> int:
+        """Write all queued rankings in the current app context.
+
+        Returns:
+            int: Number of rankings that were taken from the queue.
+        """
+        with self._write_lock:
+            rankings = []
+            while True:
+                try:
+                    rankings.extend(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self._pending_lock:
+                self._queued -= len(rankings)
+
+            # interleaved rankings first, they are referenced by the tdi of the other rankings
+            rankings.sort(key=lambda r: r.tdi is not None and r.tdi != r.id)
+            for start in range(0, len(rankings), self.batch_size):
+                self._write(rankings[start : start + self.batch_size])
+        return len(rankings)
+
+    def stop(self) -> None:
+        """Stop the background thread and write the remaining rankings."""
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        with self.app.app_context():
+            self.flush()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    current_app.logger.error(f"Result writer failed: {str(e)}")
+
+    def _write(self, rankings: List[Result]) -> None:
+        try:
+            self._insert(rankings)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Could not write {len(rankings)} rankings: {str(e)}")
+            failed = self._write_each(rankings) if len(rankings) > 1 else rankings
+            self._forget([ranking for ranking in rankings if ranking not in failed])
+            self._retry(failed)
+            return
+        self._forget(rankings)
+
+    def _insert(self, rankings: List[Result]) -> None:
+        rows = result_rows(rankings)
+        if item_service.is_enabled():
+            item_service.pack_rows(rows)
+        db.session.execute(insert(Result), rows)
+
+    def _write_each(self, rankings: List[Result]) -> List[Result]:
+        """Write the rankings of a failed batch one at a time, so a bad ranking does not keep the others from being written.
+
+        Returns:
+            List[Result]: Rankings that could not be written.
+        """
+        failed = []
+        # interleaved rankings first, they are referenced by the tdi of the other rankings
+        for ranking in sorted(rankings, key=lambda r: r.tdi is not None and r.tdi != r.id):
+            try:
+                with db.session.begin_nested():
+                    self._insert([ranking])
+            except Exception as e:
+                current_app.logger.error(f"Could not write ranking {ranking.id}: {str(e)}")
+                failed.append(ranking)
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Could not write {len(rankings)} rankings: {str(e)}")
+            return rankings
+        return failed
+
+    def _retry(self, rankings: List[Result]) -> None:
+        """Keep failed rankings for the next flush if there is space, until they failed `max_attempts` times."""
+        with self._pending_lock:
+            for ranking in rankings:
+                self._attempts[ranking.id] = self._attempts.get(ranking.id, 0) + 1
+            dropped = [ranking for ranking in rankings if self._attempts[ranking.id] >= self.max_attempts]
+        retried = [ranking for ranking in rankings if ranking not in dropped]
+        if retried:
+            try:
+                self._queue.put_nowait(retried)
+                with self._pending_lock:
+                    self._queued += len(retried)
+            except queue.Full:
+                dropped.extend(retried)
+        if dropped:
+            current_app.logger.error(f"Dropped {len(dropped)} rankings")
+            self._forget(dropped)
+
+    def _forget(self, rankings: List[Result]) -> None:
+        with self._pending_lock:
+            for ranking in rankings:
+                self._pending.pop(ranking.id, None)
+                self._attempts.pop(ranking.id, None)
+                key = (ranking.session_id, ranking.q, ranking.page)
+                if self._pending_queries.get(key) == ranking.id:
+                    del self._pending_queries[key]
+
+
+_writer: Optional[ResultWriter] = None
+_allocator: Optional[IdAllocator] = None
+_writer_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    """Check if the rankings are written in the background (`ASYNC_RESULT_LOGGING`)."""
+    return current_app.config["ASYNC_RESULT_LOGGING"]
+
+
+def get_result_writer() -> ResultWriter:
+    """Get the result writer of this worker. It is started on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ResultWriter(
+                current_app._get_current_object(),
+                maxsize=current_app.config["RESULT_QUEUE_SIZE"],
+                batch_size=current_app.config["RESULT_BATCH_SIZE"],
+                interval=current_app.config["RESULT_FLUSH_INTERVAL"],
+                timeout=current_app.config["RESULT_QUEUE_TIMEOUT"],
+                max_attempts=current_app.config["RESULT_MAX_ATTEMPTS"],
+            )
+        return _writer
+
+
+def check_id_allocation(workers: int) -> None:
+    """Check that the ranking ids can be reserved by the given number of worker processes. Without a sequence, i.e., on
+    SQLite, every process continues after the highest id, so several workers would hand out the same ids.
+
+    Args:
+        workers (int): Number of worker processes.
+
+    Raises:
+        RuntimeError: If ids are reserved per process with `ASYNC_RESULT_LOGGING` or `ASYNC_DATABASE` and more than one worker.
+    """
+    if not is_enabled() and not current_app.config["ASYNC_DATABASE"]:
+        return
+    if workers > 1 and db.engine.dialect.name != "postgresql":
+        raise RuntimeError(
+            f"ASYNC_RESULT_LOGGING and ASYNC_DATABASE need PostgreSQL with {workers} workers, "
+            f"{db.engine.dialect.name} has no sequence to reserve the ranking ids"
+        )
+
+
+def add_result(ranking: Result) -> None:
+    """Add a ranking of the current request to be logged.
+
+    With `ASYNC_RESULT_LOGGING` or `ASYNC_DATABASE`, the ranking gets an id from a reserved block and is written later by
+    `log_results` or the async engine. Otherwise, it is added to the session and written with the transaction of the request.
+    The items are stored compactly with `ITEM_STORAGE=compact` when the ranking is written.
+
+    Args:
+        ranking (Result): Ranking to log.
+    """
+    global _allocator
+    if not is_enabled() and not current_app.config["ASYNC_DATABASE"]:
+        if item_service.is_enabled():
+            item_service.pack_items(ranking)
+        db.session.add(ranking)
+        return
+
+    if _allocator is None:
+        with _writer_lock:
+            if _allocator is None:
+                _allocator = IdAllocator(current_app.config["RESULT_ID_BLOCK_SIZE"])
+    ranking.id = _allocator.allocate()
+
+
+def log_results(rankings: Iterable[Result]) -> None:
+    """Queue the rankings of a request for the background writer."""
+    get_result_writer().submit(list(rankings))
+
+
+def get_pending_result(ranking_id: int) -> Optional[Result]:
+    """Get a ranking by id that is queued but not written yet."""
+    return _writer.get(ranking_id) if _writer is not None else None
+
+
+def find_pending_result(query: str, page: int, session_id: str) -> Optional[Result]:
+    """Get the ranking of a session for a query and page that is queued but not written yet."""
+    return _writer.find(query, page, session_id) if _writer is not None else None
+
+
+def flush_results() -> int:
+    """Write the queued rankings of this worker now."""
+    return _writer.flush() if _writer is not None else 0
+
+
+def shutdown() -> None:
+    """Write the remaining rankings of this worker before it exits."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
+
+
+def reset_result_writer() -> None:
+    """Stop the result writer and forget the reserved ids without writing the queued rankings."""
+    global _writer, _allocator
+    with _writer_lock:
+        writer, _writer, _allocator = _writer, None, None
+    if writer is not None:
+        writer._stopped.set()
+        writer._wakeup.set()
+        writer._thread.join(timeout=5)
+
+
+atexit.register(shutdown)
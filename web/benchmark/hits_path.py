@@ -0,0 +1,66 @@
+"""Micro-benchmark of the hits extraction with compiled paths and jsonpath_ng.
+
+Elasticsearch-style responses (`$.hits.hits`) with `--hits` hits are searched with the compiled path of
+`jsonpath_service.compile_path` and with `jsonpath_ng`. Both the lookup (`extract_hits`, `build_id_map`) and the
+replacement of the hits (`build_response` of interleaved custom responses) are timed.
+
+Usage (from the `web` directory):
+    python -m benchmark.hits_path --hits 10 --repeat 100000
+"""
+import argparse
+import timeit
+from typing import Dict
+
+from jsonpath_ng import parse
+
+
+def create_response(num_hits: int) -> Dict:
+    """Elasticsearch-style search response."""
+    return {
+        "took": 5,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {
+            "total": {"value": 12312, "relation": "eq"},
+            "max_score": 12.5,
+            "hits": [
+                {
+                    "_index": "documents",
+                    "_id": f"M{27622217 + i}",
+                    "_score": 12.5 - i * 0.1,
+                    "_source": {"id": f"M{27622217 + i}", "title": f"Title {i}", "year": 2020},
+                }
+                for i in range(num_hits)
+            ],
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--path", default="$.hits.hits")
+    parser.add_argument("--hits", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=100000)
+    args = parser.parse_args()
+
+    from app.services.jsonpath_service import compile_path
+
+    response = create_response(args.hits)
+    hits = response["hits"]["hits"][::-1]
+    jsonpath = parse(args.path)
+    compiled = compile_path(args.path)
+    print(f"{args.path} is compiled to {type(compiled).__name__}\n")
+
+    timings = {
+        "get (jsonpath_ng)": lambda: jsonpath.find(response)[0].value,
+        "get (compiled)": lambda: compiled.get(response),
+        "set (jsonpath_ng)": lambda: jsonpath.update(response, hits),
+        "set (compiled)": lambda: compiled.set(response, hits),
+    }
+    for name, function in timings.items():
+        seconds = min(timeit.repeat(function, number=args.repeat, repeat=5))
+        print(f"{name:<20} {seconds / args.repeat * 1e6:8.3f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""Throughput comparison of the synchronous and the asynchronous serving mode.
+
+A fake system container answers every request after a fixed delay. The stella app is served with gunicorn, once with a synchronous
+worker and `asyncio.run` per request (`ASYNC_SERVING=False`, `GUNICORN_THREADS=1`) and once with a threaded worker sharing the
+long-lived event loop of the worker (`ASYNC_SERVING=True`). Both runs use a single worker and interleave two systems.
+
+Usage (from the `web` directory):
+    python -m benchmark.serving --requests 200 --concurrency 32 --delay 0.2
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+CONTAINER_PORT = 5055
+APP_PORT = 8055
+
+
+def create_container_app(delay: float) -> web.Application:
+    """Fake system container that returns a ranking in the stella format after `delay` seconds."""
+
+    async def ranking(request):
+        await asyncio.sleep(delay)
+        rpp = int(request.query.get("rpp", 10))
+        return web.json_response(
+            {
+                "query": request.query.get("query"),
+                "itemlist": [f"{request.path}-doc{i}" for i in range(rpp)],
+                "num_found": rpp,
+                "page": 0,
+                "rpp": rpp,
+            }
+        )
+
+    container = web.Application()
+    container.router.add_get("/{system}/ranking", ranking)
+    return container
+
+
+def serve_container(delay: float) -> None:
+    """Serve the fake container in a background thread."""
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(create_container_app(delay), access_log=None)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", CONTAINER_PORT).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+def create_benchmark_app():
+    """App factory used by gunicorn. The systems point to the fake container."""
+    from app.app import create_app, db
+    from app.models import System
+    from config import parse_systems_config
+
+    systems_config = {
+        "ranker_base": {
+            "type": "ranker",
+            "base": True,
+            "url": f"http://127.0.0.1:{CONTAINER_PORT}/ranker_base",
+        },
+        "ranker": {"type": "ranker", "url": f"http://127.0.0.1:{CONTAINER_PORT}/ranker"},
+    }
+    (
+        ranking_container_names,
+        ranking_precomputed_container_names,
+        ranking_baseline_container,
+        recommender_container_names,
+        recommender_precomputed_container_names,
+        recommender_baseline_container,
+        systems_config,
+    ) = parse_systems_config(systems_config)
+
+    app = create_app(
+        {
+            "DEBUG": False,
+            "TESTING": False,
+            "SENDFEEDBACK": False,
+            "INTERLEAVE": True,
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.environ["BENCHMARK_DB"],
+            "ASYNC_SERVING": os.environ.get("ASYNC_SERVING") != "False",
+            "SYSTEMS_CONFIG": systems_config,
+            "RANKING_CONTAINER_NAMES": ranking_container_names,
+            "RANKING_PRECOMPUTED_CONTAINER_NAMES": ranking_precomputed_container_names,
+            "RANKING_BASELINE_CONTAINER": ranking_baseline_container,
+            "RECOMMENDER_CONTAINER_NAMES": recommender_container_names,
+            "RECOMMENDER_PRECOMPUTED_CONTAINER_NAMES": recommender_precomputed_container_names,
+            "RECOMMENDER_BASELINE_CONTAINER": recommender_baseline_container,
+        }
+    )
+    with app.app_context():
+        db.create_all()
+        if db.session.query(System).count() == 0:
+            for name in systems_config:
+                db.session.add(
+                    System(
+                        name=name,
+                        type="RANK",
+                        system_type="LIVE",
+                        num_requests=0,
+                        num_requests_no_head=0,
+                    )
+                )
+            db.session.commit()
+    return app
+
+
+def wait_for_port(port: int, timeout: float = 30) -> None:
+    start = time.time()
+    while time.time() - start < timeout:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise TimeoutError(f"Port {port} not reachable")
+
+
+async def load(num_requests: int, concurrency: int) -> float:
+    """Send `num_requests` ranking requests with `concurrency` parallel clients and return the throughput in requests per second."""
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def request(session, i):
+        nonlocal errors
+        async with semaphore:
+            async with session.get(
+                f"http://127.0.0.1:{APP_PORT}/stella/api/v1/ranking",
+                params={"query": f"query {i}"},
+            ) as response:
+                if response.status != 200:
+                    errors += 1
+                await response.read()
+
+    timeout = aiohttp.ClientTimeout(total=600)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        start = time.time()
+        await asyncio.gather(*[request(session, i) for i in range(num_requests)])
+        duration = time.time() - start
+
+    if errors:
+        print(f"  {errors} request(s) failed")
+    return num_requests / duration
+
+
+def run_mode(async_serving: bool, threads: int, args) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            FLASK_CONFIG="test",
+            ASYNC_SERVING=str(async_serving),
+            GUNICORN_THREADS=str(threads),
+            BENCHMARK_DB=os.path.join(tmp, "benchmark.sqlite"),
+        )
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "-w",
+                "1",
+                "-b",
+                f"127.0.0.1:{APP_PORT}",
+                "--log-level",
+                "warning",
+                "benchmark.serving:create_benchmark_app()",
+            ],
+            env=env,
+        )
+        try:
+            wait_for_port(APP_PORT)
+            asyncio.run(load(args.concurrency, args.concurrency))  # warm up
+            return asyncio.run(load(args.requests, args.concurrency))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--delay", type=float, default=0.2, help="Container latency in seconds")
+    args = parser.parse_args()
+
+    serve_container(args.delay)
+
+    results = {
+        "sync (asyncio.run, 1 thread)": run_mode(False, 1, args),
+        f"sync (asyncio.run, {args.threads} threads)": run_mode(False, args.threads, args),
+        f"async (worker loop, {args.threads} threads)": run_mode(True, args.threads, args),
+    }
+    for mode, throughput in results.items():
+        print(f"{mode:<36} {throughput:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
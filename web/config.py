@@ -21,6 +21,12 @@ def load_as_list(env_var):
     return variable_list
 
 
+def load_as_float(env_var):
+    if os.environ.get(env_var):
+        return float(os.environ.get(env_var))
+    return None
+
+
 def parse_systems_config(SYSTEMS_CONFIG):
     RANKING_CONTAINER_NAMES = []
     RANKING_PRECOMPUTED_CONTAINER_NAMES = []
@@ -50,10 +56,9 @@ def parse_systems_config(SYSTEMS_CONFIG):
                     raise ValueError("Multiple ranking baselines defined!")
                 RANKING_BASELINE_CONTAINER = system
 
-        # JSON Path
+        # JSON Path, validated here and compiled by the system registry. The config keeps the expression to be shared as JSON.
         if SYSTEMS_CONFIG[system].get("hits_path"):
-            hits_path = parse(SYSTEMS_CONFIG[system]["hits_path"])
-            SYSTEMS_CONFIG[system]["hits_path"] = hits_path
+            parse(SYSTEMS_CONFIG[system]["hits_path"])
 
 
     return (
@@ -79,6 +84,73 @@ class Config:
     SESSION_EXPIRATION = int(os.environ.get("SESSION_EXPIRATION") or 6)
     SESSION_KILL = None if os.environ.get("SESSION_KILL") is None else int(os.environ.get("SESSION_KILL"))
     INTERVAL_DB_CHECK = int(os.environ.get("INTERVAL_DB_CHECK") or 3)  # seconds
+    SESSION_SCAN_PAGE_SIZE = int(os.environ.get("SESSION_SCAN_PAGE_SIZE") or 500)  # expired sessions per query of the cron job
+
+    # Run container requests on a long-lived event loop per worker instead of a new loop per request
+    ASYNC_SERVING = (
+        False if os.environ.get("ASYNC_SERVING") == "False" else True
+    )  # Opt out
+
+    # Database access of the coroutines with an async engine (asyncpg/aiosqlite), so it does not block the event loop
+    ASYNC_DATABASE = (
+        True if os.environ.get("ASYNC_DATABASE") == "True" else False
+    )  # Opt in
+    ASYNC_DATABASE_URI = os.environ.get("ASYNC_DATABASE_URI")  # defaults to SQLALCHEMY_DATABASE_URI with the async driver
+
+    # Latency budget per endpoint in seconds. When it runs out and only one system answered, its results are returned without interleaving.
+    LATENCY_BUDGET = {
+        "ranking": load_as_float("LATENCY_BUDGET_RANKING"),
+        "recommendation": load_as_float("LATENCY_BUDGET_RECOMMENDATION"),
+        "proxy": load_as_float("LATENCY_BUDGET_PROXY"),
+    }
+
+    # Request counters of the systems are written to the database in batches
+    COUNTER_FLUSH_INTERVAL = float(os.environ.get("COUNTER_FLUSH_INTERVAL") or 5)  # seconds
+
+    # Cache of container responses shared by all sessions (TTL can be overwritten per system in SYSTEMS_CONFIG)
+    RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE") or 1024)  # entries
+    RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL") or 300)  # seconds, 0 disables the cache
+
+    # Cache of existing session ids per worker. Sessions deleted by the cron job in another process are only forgotten after the TTL.
+    SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE") or 10000)  # sessions
+    SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL") or 60)  # seconds, 0 disables the cache
+
+    # Allocation of sessions to the experimental systems: "least_served", "weighted" (least served relative to the "weight" of
+    # the systems in SYSTEMS_CONFIG) or "round_robin" (weighted round-robin per worker)
+    ALLOCATION_STRATEGY = os.environ.get("ALLOCATION_STRATEGY") or "least_served"
+    ALLOCATOR_SYNC_INTERVAL = float(os.environ.get("ALLOCATOR_SYNC_INTERVAL") or 5)  # seconds between reloads of the request counts
+
+    # Workers check for a newer SYSTEMS_CONFIG in the database at most every REGISTRY_SYNC_INTERVAL seconds
+    REGISTRY_SYNC_INTERVAL = float(os.environ.get("REGISTRY_SYNC_INTERVAL") or 5)  # seconds
+
+    # Write the logged rankings in batches in the background instead of during the request
+    ASYNC_RESULT_LOGGING = (
+        True if os.environ.get("ASYNC_RESULT_LOGGING") == "True" else False
+    )  # Opt in
+    RESULT_QUEUE_SIZE = int(os.environ.get("RESULT_QUEUE_SIZE") or 10000)  # requests
+    RESULT_BATCH_SIZE = int(os.environ.get("RESULT_BATCH_SIZE") or 500)  # rankings
+    RESULT_FLUSH_INTERVAL = float(os.environ.get("RESULT_FLUSH_INTERVAL") or 1)  # seconds
+    RESULT_QUEUE_TIMEOUT = float(os.environ.get("RESULT_QUEUE_TIMEOUT") or 1)  # seconds, then the request writes its rankings itself
+    RESULT_MAX_ATTEMPTS = int(os.environ.get("RESULT_MAX_ATTEMPTS") or 3)  # failed writes of a ranking, then it is dropped
+    RESULT_ID_BLOCK_SIZE = int(os.environ.get("RESULT_ID_BLOCK_SIZE") or 100)  # ranking ids reserved at once
+
+    # Storage of the ranked items, "json" or "compact" (interned document ids and a team bit per position)
+    ITEM_STORAGE = os.environ.get("ITEM_STORAGE") or "json"
+    DOCID_CACHE_SIZE = int(os.environ.get("DOCID_CACHE_SIZE") or 100000)  # interned document ids per worker
+    # Storage of interleaved rankings, "items" or "selection" (the team of every position, rebuilt from the baseline and experimental ranking)
+    INTERLEAVED_STORAGE = os.environ.get("INTERLEAVED_STORAGE") or "items"
+
+    # Circuit breaker per system container (can be overwritten per system in SYSTEMS_CONFIG)
+    CIRCUIT_BREAKER_FAILURES = int(os.environ.get("CIRCUIT_BREAKER_FAILURES") or 5)
+    CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_BREAKER_RESET_TIMEOUT") or 30)  # seconds
+    CIRCUIT_BREAKER_SLOW_CALL = load_as_float("CIRCUIT_BREAKER_SLOW_CALL")  # seconds
+
+    # Pooled HTTP clients for the system containers (can be overwritten per system in SYSTEMS_CONFIG)
+    HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT") or 3)  # seconds
+    HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT") or 100)
+    HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST") or 20)
+    HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT") or 30)  # seconds
+    HTTP_DNS_CACHE_TTL = int(os.environ.get("HTTP_DNS_CACHE_TTL") or 300)  # seconds
 
     SENDFEEDBACK = (
         False if os.environ.get("SENDFEEDBACK") == "False" else True
@@ -86,6 +158,25 @@ class Config:
     DELETE_SENT_SESSION = (
         True if os.environ.get("DELETE_SENT_SESSION") == "True" else False
     )
+    DELETE_CHUNK_SIZE = int(os.environ.get("DELETE_CHUNK_SIZE") or 500)  # sessions deleted per transaction
+    # Sync the sessions in a separate `flask sync-worker` process instead of a scheduler in the app processes. Of all processes
+    # that share the database, only the leader syncs (advisory lock on PostgreSQL, otherwise a lease of LEADER_LEASE_TTL seconds).
+    SYNC_WORKER = True if os.environ.get("SYNC_WORKER") == "True" else False
+    LEADER_LEASE_TTL = float(os.environ.get("LEADER_LEASE_TTL") or 30)  # seconds
+
+    # Upload of the exited sessions to the STELLA server: "session" (a request per session, feedback and ranking) or "batch"
+    # (UPLOAD_BATCH_SIZE sessions with their feedback and rankings per request)
+    UPLOAD_MODE = os.environ.get("UPLOAD_MODE") or "session"
+    UPLOAD_BATCH_SIZE = int(os.environ.get("UPLOAD_BATCH_SIZE") or 100)  # sessions
+    UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY") or 8)  # concurrent uploads, also the HTTP pool size
+    UPLOAD_TIMEOUT = float(os.environ.get("UPLOAD_TIMEOUT") or 30)  # seconds
+    # Failed uploads of a session, feedback or ranking are retried after UPLOAD_BACKOFF seconds, doubled per attempt
+    UPLOAD_BACKOFF = float(os.environ.get("UPLOAD_BACKOFF") or 30)  # seconds
+    UPLOAD_BACKOFF_MAX = float(os.environ.get("UPLOAD_BACKOFF_MAX") or 3600)  # seconds
+    UPLOAD_MAX_ATTEMPTS = int(os.environ.get("UPLOAD_MAX_ATTEMPTS") or 10)  # then the upload is given up
+    # Server ids of the systems are cached by name and looked up again when the token changes or the server answers with 404
+    SERVER_SYSTEM_ID_CACHE_SIZE = int(os.environ.get("SERVER_SYSTEM_ID_CACHE_SIZE") or 1024)  # systems
+    SERVER_SYSTEM_ID_TTL = float(os.environ.get("SERVER_SYSTEM_ID_TTL") or 3600)  # seconds, 0 disables the cache
 
     # Stella Server
     STELLA_SERVER_ADDRESS = os.environ.get("STELLA_SERVER_ADDRESS") or "nginx"
@@ -126,10 +217,9 @@ class Config:
                 if SYSTEMS_CONFIG[system].get("base"):
                     RANKING_BASELINE_CONTAINER = system
 
-            # JSON Path
+            # JSON Path, validated here and compiled by the system registry
             if SYSTEMS_CONFIG[system].get("hits_path"):
-                hits_path = parse(SYSTEMS_CONFIG[system]["hits_path"])
-                SYSTEMS_CONFIG[system]["hits_path"] = hits_path
+                parse(SYSTEMS_CONFIG[system]["hits_path"])
     else:
         # Ranking
         RANKING_CONTAINER_NAMES = load_as_list("RANKSYS_LIST")  # container_list
@@ -1,14 +1,35 @@
+import os
+
+# Synchronous workers by default. With `GUNICORN_THREADS` > 1, threaded workers serve several requests at once and share the
+# event loop of the worker for the container requests (see ASYNC_SERVING). The database work of the threads stays blocking.
+threads = int(os.environ.get("GUNICORN_THREADS") or 1)
+worker_class = "gthread" if threads > 1 else "sync"
+
+
 def on_starting(server):
     print("Gunicorn master process is starting...")
 
 
 def when_ready(server):
     from app.app import create_app, scheduler
+    from app.services import writer_service
 
     app = create_app()  # Create an instance of the app
     with app.app_context():
-        if app.config["SENDFEEDBACK"]:
+        # refuse to start workers that would hand out the same ranking ids
+        writer_service.check_id_allocation(server.cfg.workers)
+        # with SYNC_WORKER, a separate `flask sync-worker` process does the sync work
+        if app.config["SENDFEEDBACK"] and not app.config["SYNC_WORKER"]:
             print("Initializing and starting scheduler inside Gunicorn master process")
             scheduler.init_app(app)  # Initialize the scheduler
             scheduler.start()  # Start the scheduler
     print("Scheduler started in Gunicorn master process")
+
+
+def worker_exit(server, worker):
+    from app.services import client_service, counter_service, writer_service
+
+    # write the remaining rankings and request counters and close the pooled container clients of this worker
+    writer_service.shutdown()
+    counter_service.shutdown()
+    client_service.shutdown()
@@ -1,6 +1,10 @@
+import asyncio
 import os
 
 import pytest
+from app.models import Feedback, Session
+from app.services.session_service import has_session
+from sqlalchemy import delete
 
 from ..create_test_data import (
     STELLA_RETURN_PARAMETER,
@@ -59,6 +63,25 @@ class TestRanking:
         assert data["_stella"]["hits"] == None
         assert data["_stella"]["q"] == query_params["query"]
 
+    def test_ranking_session_deleted_by_another_process(
+        self,
+        mock_request_base_system,
+        client,
+        sessions,
+        db_session,
+    ):
+        """A session that another process deleted is created again before rankings are written to it."""
+        session_id = sessions["ranker_base"].id
+        assert has_session(session_id)
+        db_session.execute(delete(Session).where(Session.id == session_id))
+        db_session.commit()
+
+        query_params = {"query": "new query", "container": "ranker_base", "sid": session_id}
+        result = client.get(self.URL, query_string=query_params)
+
+        assert 200 == result.status_code
+        assert db_session.get(Session, session_id) is not None
+
     def test_ranking_fixed_container(
         self,
         mock_request_base_system,
@@ -145,6 +168,46 @@ class TestRanking:
                     "10014575867",
                 ]
 
+    def test_ranking_interleaved_latency_budget(
+        self,
+        app,
+        client,
+        monkeypatch,
+        aio_mock,
+        results,
+        sessions,
+        mock_request_base_system,
+    ):
+        """The experimental system does not answer within the latency budget, so the baseline ranking is returned without interleaving."""
+        app.config["INTERLEAVE"] = True
+        monkeypatch.setitem(app.config["LATENCY_BUDGET"], "ranking", 0.1)
+
+        async def slow_response(url, **kwargs):
+            await asyncio.sleep(2)
+
+        aio_mock.get(
+            "http://ranker:5000/ranking?query=Test Query&rpp=10&page=0",
+            callback=slow_response,
+        )
+
+        result = client.get(self.URL, query_string={"query": "Test Query"})
+        data = result.json
+
+        assert 200 == result.status_code
+        assert data["header"]["container"] == {"base": "ranker_base"}
+        ranking = [r["docid"] for r in data["body"].values()]
+        assert ranking == create_return_base()["itemlist"]
+        assert {r["type"] for r in data["body"].values()} == {"BASE"}
+
+        # feedback for this ranking is not marked as interleaved
+        feedbacks = create_feedbacks(sessions)
+        result = client.post(
+            f"{self.URL}/{data['header']['rid']}/feedback",
+            data={"clicks": feedbacks["ranker_base"].clicks},
+        )
+        assert 201 == result.status_code
+        assert Feedback.query.order_by(Feedback.id.desc()).first().interleave is False
+
 
 class TestPostFeedback:
     URL = "/stella/api/v1/ranking/{}/feedback"
@@ -1,9 +1,24 @@
 from unittest.mock import AsyncMock, patch
 
 import pytest
+import pytest_asyncio
 from aioresponses import aioresponses
 from app.app import create_app, db
 from app.models import Result, Session
+from app.services.allocator_service import reset_allocator
+from app.services.breaker_service import reset_breakers
+from app.services.cache_service import reset_result_cache
+from app.services.client_service import close_clients
+from app.services.counter_service import reset_counters
+from app.services.cron_service import reset_http_session, reset_server_system_ids
+from app.services.db_service import dispose_engines
+from app.services.item_service import reset_docid_cache
+from app.services.leader_service import reset_leader_lock
+from app.services.registry_service import reset_system_registry
+from app.services.session_service import reset_session_cache
+from app.services.writer_service import reset_result_writer
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session as DbSession
 
 from .create_test_data import (
     create_feedbacks,
@@ -62,6 +77,32 @@ def db_session(app):
         session.remove()
 
 
+def reset_singletons():
+    """Drop the module-level state of the services that is kept per worker."""
+    reset_result_writer()
+    reset_counters()
+    reset_breakers()
+    reset_result_cache()
+    reset_session_cache()
+    reset_docid_cache()
+    reset_server_system_ids()
+    reset_system_registry()
+    reset_allocator()
+    reset_http_session()
+    reset_leader_lock()
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def singletons():
+    """Start every test with fresh service state, and close the pooled container clients and async database
+    connections that were opened on the event loop of the test."""
+    reset_singletons()
+    yield
+    await close_clients()
+    await dispose_engines()
+    reset_singletons()
+
+
 @pytest.fixture
 def systems():
     test_systems = create_systems()
@@ -271,4 +312,20 @@ def mock_request_custom_system_long_query(aio_mock):
         "custom-page": custom_page,
         "mock_url": mock_url,
         "mock_response": mock_response,
-    }
\ No newline at end of file
+    }
+
+
+@pytest.fixture
+def async_database(app, monkeypatch, tmp_path):
+    """Separate database for the async engine. The data of the test transaction is not visible to other connections."""
+    path = tmp_path / "async.sqlite"
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    with DbSession(engine) as session:
+        session.add_all(create_systems().values())
+        session.commit()
+
+    monkeypatch.setitem(app.config, "ASYNC_DATABASE", True)
+    monkeypatch.setitem(app.config, "ASYNC_DATABASE_URI", f"sqlite+aiosqlite:///{path}")
+    yield engine
+    engine.dispose()
@@ -0,0 +1,87 @@
+from collections import Counter
+from unittest.mock import patch
+
+import pytest
+from app.models import System
+from app.services.allocator_service import TrafficAllocator
+from app.services.counter_service import count_request, flush_counters
+from app.services.registry_service import apply_systems_config
+
+
+def weighted_config(app):
+    systems_config = dict(app.config["SYSTEMS_CONFIG"])
+    systems_config["ranker_2"] = {"type": "ranker", "weight": 3}
+    apply_systems_config(systems_config)
+
+
+def allocate(allocator, candidates, num_requests, strategy=None):
+    """Allocate requests like the app does, every request is counted when the system is requested."""
+    names = []
+    for _ in range(num_requests):
+        name = allocator.choose(candidates, strategy=strategy)
+        count_request(name)
+        names.append(name)
+    return names
+
+
+class TestTrafficAllocator:
+    def test_unknown_strategy(self):
+        with pytest.raises(ValueError):
+            TrafficAllocator(strategy="random")
+
+    def test_no_candidates(self, systems):
+        with pytest.raises(ValueError):
+            TrafficAllocator().choose([])
+
+    def test_least_served(self, systems, db_session):
+        system = db_session.query(System).filter_by(name="ranker").first()
+        system.num_requests_no_head = 3
+        db_session.commit()
+
+        allocator = TrafficAllocator()
+        allocator.sync()
+        names = allocate(allocator, ["ranker", "ranker_base"], 5)
+
+        # ties are broken by the order of the candidates
+        assert names == ["ranker_base"] * 3 + ["ranker", "ranker_base"]
+
+    def test_counts_are_not_counted_twice_after_flush(self, systems):
+        allocator = TrafficAllocator()
+        allocator.sync()
+        allocate(allocator, ["ranker", "ranker_base"], 4)
+        flush_counters()
+        allocator.sync()
+
+        assert allocator.count("ranker") == 2
+        assert allocator.count("ranker_base") == 2
+
+    def test_weighted(self, app, systems, db_session):
+        db_session.add(
+            System(name="ranker_2", type="RANK", system_type="LIVE", num_requests=0, num_requests_no_head=0)
+        )
+        db_session.commit()
+        weighted_config(app)
+
+        allocator = TrafficAllocator(strategy="weighted")
+        allocator.sync()
+        names = allocate(allocator, ["ranker", "ranker_2"], 40)
+
+        assert Counter(names) == {"ranker": 10, "ranker_2": 30}
+
+    def test_round_robin(self, app, systems):
+        weighted_config(app)
+
+        allocator = TrafficAllocator(strategy="round_robin")
+        names = [allocator.choose(["ranker", "ranker_2"]) for _ in range(8)]
+
+        # smooth: the requests of the lighter system are spread
+        assert names == ["ranker_2", "ranker", "ranker_2", "ranker_2"] * 2
+
+    def test_no_database_access_between_syncs(self, systems, db_session):
+        allocator = TrafficAllocator(sync_interval=60)
+        allocator.sync_if_due()
+
+        with patch.object(db_session, "query", side_effect=AssertionError("database access")):
+            for _ in range(10):
+                allocator.sync_if_due()
+                allocator.choose(["ranker", "ranker_base"])
@@ -0,0 +1,98 @@
+import aiohttp
+import pytest
+from app.services.breaker_service import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    get_breaker,
+    get_open_circuits,
+)
+from app.services.result_service import request_results_from_container
+
+
+class TestCircuitBreaker:
+    def test_opens_after_failures(self):
+        breaker = CircuitBreaker(failures=2, reset_timeout=30)
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+        assert breaker.allow_request()
+
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert not breaker.allow_request()
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failures=2, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_success(0.01)
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker(failures=1, reset_timeout=0)
+        breaker.record_failure()
+        assert breaker.state == HALF_OPEN
+
+        # only a single probe is let through
+        assert breaker.allow_request()
+        assert not breaker.allow_request()
+
+        breaker.record_success(0.01)
+        assert breaker.state == CLOSED
+        assert breaker.allow_request()
+
+    def test_failed_probe_opens_again(self):
+        breaker = CircuitBreaker(failures=1, reset_timeout=0)
+        breaker.record_failure()
+        assert breaker.allow_request()
+
+        breaker.reset_timeout = 30
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert not breaker.allow_request()
+
+    def test_released_probe(self):
+        breaker = CircuitBreaker(failures=1, reset_timeout=0)
+        breaker.record_failure()
+        assert breaker.allow_request()
+        breaker.release()
+        assert breaker.allow_request()
+
+    def test_slow_call_counts_as_failure(self):
+        breaker = CircuitBreaker(failures=1, reset_timeout=30, slow_call=0.5)
+        breaker.record_success(0.1)
+        assert breaker.state == CLOSED
+
+        breaker.record_success(1)
+        assert breaker.state == OPEN
+        assert breaker.latency == pytest.approx(0.28)
+
+
+class TestGetBreaker:
+    def test_system_settings(self, app, monkeypatch):
+        monkeypatch.setitem(app.config["SYSTEMS_CONFIG"]["ranker"], "breaker_failures", 1)
+
+        assert get_breaker("ranker").failure_threshold == 1
+        assert get_breaker("ranker") is get_breaker("ranker")
+        assert (
+            get_breaker("ranker_base").failure_threshold
+            == app.config["CIRCUIT_BREAKER_FAILURES"]
+        )
+
+    @pytest.mark.asyncio
+    async def test_open_circuit_skips_container(self, app, aio_mock, monkeypatch):
+        monkeypatch.setitem(app.config["SYSTEMS_CONFIG"]["ranker"], "breaker_failures", 2)
+        url = "http://ranker:5000/ranking?query=Test Query&rpp=10&page=0"
+        aio_mock.get(url, status=500, repeat=True)
+
+        async with aiohttp.ClientSession() as session:
+            for _ in range(3):
+                response = await request_results_from_container(
+                    session, "ranker", "Test Query", 10, 0
+                )
+                assert response["itemlist"] == []
+
+        # The third request is not sent to the container
+        assert sum(len(calls) for calls in aio_mock.requests.values()) == 2
+        assert get_open_circuits() == ["ranker"]
@@ -0,0 +1,215 @@
+import asyncio
+import time
+
+import pytest
+from app.models import Result
+from app.services.cache_service import (
+    TTLCache,
+    get_result_cache,
+    normalize_query,
+    singleflight,
+)
+from app.services.result_service import query_system
+
+from ..create_test_data import create_return_experimental
+
+
+def count_requests(aio_mock):
+    return sum(len(calls) for calls in aio_mock.requests.values())
+
+
+class TestTTLCache:
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1  # a is now the most recently used entry
+        cache.set("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+    def test_ttl(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("a", 1, ttl=0.01)
+        cache.set("b", 2)
+        time.sleep(0.02)
+
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+        assert len(cache) == 1
+
+    def test_stats(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+
+        assert cache.stats == {"size": 1, "maxsize": 2, "hits": 1, "misses": 1}
+
+    def test_disabled(self):
+        cache = TTLCache(maxsize=2, ttl=0)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+
+
+def test_normalize_query():
+    assert normalize_query("  Test   Query ") == normalize_query("test query")
+
+
+class TestSharedResults:
+    @pytest.mark.asyncio
+    async def test_results_shared_between_sessions(
+        self, aio_mock, mock_request_system, sessions, db_session
+    ):
+        for session in [sessions["ranker"], sessions["ranker_base"]]:
+            await query_system(
+                "ranker", "Test Query", 10, 0, session.id, system_role="EXP"
+            )
+
+        assert count_requests(aio_mock) == 1
+        assert get_result_cache().stats["hits"] == 1
+
+        # The rankings are still logged per session
+        rankings = db_session.query(Result).filter_by(type="EXP").all()
+        assert {r.session_id for r in rankings} == {
+            sessions["ranker"].id,
+            sessions["ranker_base"].id,
+        }
+        assert rankings[0].items == rankings[1].items
+
+    @pytest.mark.asyncio
+    async def test_cached_result_is_copied(self, mock_request_system, sessions):
+        _, result = await query_system(
+            "ranker", "Test Query", 10, 0, sessions["ranker"].id
+        )
+        result["_stella"] = {}
+
+        _, result = await query_system(
+            "ranker", "Test Query", 10, 0, sessions["ranker"].id
+        )
+        assert "_stella" not in result
+
+    @pytest.mark.asyncio
+    async def test_system_opt_out(
+        self, app, aio_mock, mock_request_system, sessions, monkeypatch
+    ):
+        monkeypatch.setitem(app.config["SYSTEMS_CONFIG"]["ranker"], "cache", False)
+        for _ in range(2):
+            await query_system("ranker", "Test Query", 10, 0, sessions["ranker"].id)
+
+        assert count_requests(aio_mock) == 2
+
+    @pytest.mark.asyncio
+    async def test_empty_results_not_cached(self, aio_mock, sessions):
+        aio_mock.get(
+            "http://ranker_base:5000/ranking?query=Test Query&rpp=10&page=0",
+            status=500,
+            repeat=True,
+        )
+        for _ in range(2):
+            await query_system(
+                "ranker_base", "Test Query", 10, 0, sessions["ranker_base"].id
+            )
+
+        assert count_requests(aio_mock) == 2
+        assert len(get_result_cache()) == 0
+
+
+class TestSingleflight:
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_coalesced(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"items": [1, 2]}
+
+        results = await asyncio.gather(*[singleflight("key", fetch) for _ in range(5)])
+
+        assert len(calls) == 1
+        assert all(result == {"items": [1, 2]} for result in results)
+        # every caller gets its own copy
+        assert len({id(result) for result in results}) == 5
+
+    @pytest.mark.asyncio
+    async def test_sequential_requests_not_coalesced(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return {}
+
+        await singleflight("key", fetch)
+        await singleflight("key", fetch)
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_cancel_single_waiter(self):
+        cancelled = asyncio.Event()
+
+        async def fetch():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = asyncio.ensure_future(singleflight("key", fetch))
+        second = asyncio.ensure_future(singleflight("key", fetch))
+        await asyncio.sleep(0.01)
+
+        # the request is still needed by the second waiter
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled.is_set()
+
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled.is_set()
+
+    @pytest.mark.asyncio
+    async def test_query_system_coalesced(self, app, aio_mock, sessions):
+        async def slow_response(url, **kwargs):
+            await asyncio.sleep(0.05)
+
+        aio_mock.get(
+            "http://ranker:5000/ranking?query=Test Query&rpp=10&page=0",
+            callback=slow_response,
+            payload=create_return_experimental(),
+            repeat=True,
+        )
+        results = await asyncio.gather(
+            *[
+                query_system("ranker", "Test Query", 10, 0, sessions["ranker"].id)
+                for _ in range(3)
+            ]
+        )
+
+        assert count_requests(aio_mock) == 1
+        assert all(len(ranking.items) == 10 for ranking, _ in results)
+
+    @pytest.mark.asyncio
+    async def test_uncacheable_system_not_coalesced(self, app, aio_mock, sessions, monkeypatch):
+        # non-deterministic systems answer every session on its own
+        monkeypatch.setitem(app.config["SYSTEMS_CONFIG"]["ranker"], "cache", False)
+
+        async def slow_response(url, **kwargs):
+            await asyncio.sleep(0.05)
+
+        aio_mock.get(
+            "http://ranker:5000/ranking?query=Test Query&rpp=10&page=0",
+            callback=slow_response,
+            payload=create_return_experimental(),
+            repeat=True,
+        )
+        await asyncio.gather(
+            *[
+                query_system("ranker", "Test Query", 10, 0, sessions["ranker"].id)
+                for _ in range(3)
+            ]
+        )
+
+        assert count_requests(aio_mock) == 3
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from app.services import client_service
+from app.services.client_service import get_client, get_pool_settings
+from app.services.registry_service import refresh_registry
+
+
+class TestPoolSettings:
+    def test_default_settings(self, app):
+        with app.app_context():
+            settings = get_pool_settings("ranker")
+
+        assert settings["timeout"] == app.config["HTTP_TIMEOUT"]
+        assert settings["limit_per_host"] == app.config["HTTP_POOL_LIMIT_PER_HOST"]
+
+    def test_system_settings(self, app, monkeypatch):
+        monkeypatch.setitem(app.config["SYSTEMS_CONFIG"]["ranker"], "timeout", 0.5)
+        monkeypatch.setitem(app.config["SYSTEMS_CONFIG"]["ranker"], "limit_per_host", 2)
+        with app.app_context():
+            settings = get_pool_settings("ranker")
+
+        assert settings["timeout"] == 0.5
+        assert settings["limit_per_host"] == 2
+        assert settings["limit"] == app.config["HTTP_POOL_LIMIT"]
+
+
+class TestGetClient:
+    @pytest.mark.asyncio
+    async def test_client_is_reused(self, app):
+        with app.app_context():
+            client = get_client("ranker")
+            assert get_client("ranker") is client
+            assert get_client("ranker_base") is not client
+
+    @pytest.mark.asyncio
+    async def test_client_settings(self, app, monkeypatch):
+        monkeypatch.setitem(app.config["SYSTEMS_CONFIG"]["ranker"], "timeout", 0.5)
+        with app.app_context():
+            client = get_client("ranker")
+
+        assert client.timeout.total == 0.5
+        assert client.connector.limit_per_host == app.config["HTTP_POOL_LIMIT_PER_HOST"]
+
+    @pytest.mark.asyncio
+    async def test_client_is_replaced_for_new_settings(self, app, monkeypatch):
+        monkeypatch.setitem(app.config["SYSTEMS_CONFIG"]["ranker"], "timeout", 0.01)
+        with app.app_context():
+            client = get_client("ranker")
+            monkeypatch.setitem(app.config["SYSTEMS_CONFIG"]["ranker"], "timeout", 0.5)
+            refresh_registry()
+
+            new_client = get_client("ranker")
+            assert new_client is not client
+            assert new_client.timeout.total == 0.5
+            # the old client is closed once its requests timed out
+            await asyncio.sleep(0.05)
+            assert client.closed
+
+
+class TestWorkerLoop:
+    def test_run_reuses_loop(self, app):
+        async def running_loop():
+            return asyncio.get_running_loop()
+
+        with app.app_context():
+            first = client_service.run(running_loop())
+            second = client_service.run(running_loop())
+
+        assert first is second
+        assert first.is_running()
+
+    def test_run_sync_fallback(self, app, monkeypatch):
+        monkeypatch.setitem(app.config, "ASYNC_SERVING", False)
+
+        async def open_client():
+            return asyncio.get_running_loop(), get_client("ranker")
+
+        with app.app_context():
+            first_loop, client = client_service.run(open_client())
+            second_loop, _ = client_service.run(open_client())
+
+        assert first_loop is not second_loop
+        assert first_loop.is_closed()
+        assert client.closed
+
+    def test_run_keeps_app_context(self, app):
+        async def config_value():
+            from flask import current_app
+
+            return current_app.config["HTTP_TIMEOUT"]
+
+        with app.app_context():
+            assert client_service.run(config_value()) == app.config["HTTP_TIMEOUT"]
+
+    def test_shutdown(self, app):
+        async def open_client():
+            get_client("ranker")
+            return asyncio.get_running_loop()
+
+        with app.app_context():
+            loop = client_service.run(open_client())
+            client = client_service._clients[loop]["ranker"]
+
+        client_service.shutdown()
+
+        assert client.closed
+        assert loop.is_closed()
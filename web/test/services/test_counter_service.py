@@ -0,0 +1,88 @@
+from app.models import System
+from app.services.counter_service import (
+    _build_updates,
+    _take_pending,
+    count_request,
+    flush_counters,
+    flush_counters_if_due,
+    pending_requests,
+)
+from app.services.system_service import get_least_served_system
+
+
+def get_system(db_session, name):
+    return db_session.query(System).filter_by(name=name).first()
+
+
+class TestRequestCounters:
+    def test_counts_are_written_in_batches(self, systems, db_session):
+        for _ in range(3):
+            count_request("ranker")
+        count_request("ranker", head=True)
+
+        assert pending_requests("ranker") == 3
+        assert pending_requests("ranker", head=True) == 1
+        assert get_system(db_session, "ranker").num_requests_no_head == 0
+
+        flush_counters()
+
+        system = get_system(db_session, "ranker")
+        assert system.num_requests_no_head == 3
+        assert system.num_requests == 1
+        assert pending_requests("ranker") == 0
+
+    def test_counts_are_added(self, systems, db_session):
+        system = get_system(db_session, "ranker")
+        system.num_requests_no_head = 10
+        db_session.commit()
+
+        count_request("ranker")
+        count_request("ranker_base")
+        flush_counters()
+
+        assert get_system(db_session, "ranker").num_requests_no_head == 11
+        assert get_system(db_session, "ranker_base").num_requests_no_head == 1
+
+    def test_updates_are_ordered_by_name(self, systems):
+        count_request("ranker_base")
+        count_request("ranker")
+        count_request("ranker_base", head=True)
+
+        updates = _build_updates(_take_pending())
+
+        # workers lock the rows in the same order
+        names = [update.whereclause.right.value for update in updates]
+        assert names == ["ranker", "ranker_base"]
+
+    def test_flush_if_due(self, app, systems, db_session, monkeypatch):
+        count_request("ranker")
+        flush_counters_if_due()
+        assert pending_requests("ranker") == 1
+
+        monkeypatch.setitem(app.config, "COUNTER_FLUSH_INTERVAL", 0)
+        flush_counters_if_due()
+        assert pending_requests("ranker") == 0
+        assert get_system(db_session, "ranker").num_requests_no_head == 1
+
+    def test_least_served_system_uses_pending_counts(
+        self, app, systems, db_session, monkeypatch
+    ):
+        db_session.add(
+            System(
+                name="ranker_2",
+                type="RANK",
+                system_type="LIVE",
+                num_requests=0,
+                num_requests_no_head=1,
+            )
+        )
+        db_session.commit()
+        monkeypatch.setitem(
+            app.config, "RANKING_CONTAINER_NAMES", ["ranker_base", "ranker", "ranker_2"]
+        )
+        assert get_least_served_system("Test Query", type="RANK") == "ranker"
+
+        # requests of this worker that are not in the database yet
+        count_request("ranker")
+        count_request("ranker")
+        assert get_least_served_system("Test Query", type="RANK") == "ranker_2"
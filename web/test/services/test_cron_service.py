@@ -0,0 +1,313 @@
+import json
+import threading
+from collections import Counter
+from unittest.mock import Mock
+
+import pytest
+from app.models import Feedback, Result, Session, Upload
+from app.services import cron_service
+from app.services.cron_service import (
+    ResultUpload,
+    delete_sessions,
+    get_http_session,
+    post_result,
+    post_sessions,
+    update_expired_sessions,
+)
+from app.services.outbox_service import retry_failed
+
+
+class FakeServer:
+    """STELLA server that answers the uploads and records the requests."""
+
+    def __init__(self, failing_sessions=()):
+        self.failing_sessions = set(failing_sessions)
+        self.system_id = 7
+        # number of failing requests by the end of their path
+        self.failures = Counter()
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        path = url.split("/stella/api/v1", 1)[1]
+        with self._lock:
+            self.requests.append((method, path, kwargs))
+            number = len(self.requests)
+            failing = next((end for end in self.failures if path.endswith(end) and self.failures[end] > 0), None)
+            if failing is not None:
+                self.failures[failing] -= 1
+        if failing is not None:
+            return self.response({}, status_code=503)
+        if path.endswith("/sessions"):
+            if kwargs["data"]["site_user"] in self.failing_sessions:
+                return self.response({}, status_code=500)
+            return self.response({"session_id": number})
+        if path.endswith("/feedbacks"):
+            return self.response({"feedback_id": number})
+        if path.startswith("/system/id/"):
+            return self.response({"system_id": self.system_id})
+        if path.endswith("/rankings") and kwargs["data"]["system_id"] != self.system_id:
+            return self.response({}, status_code=404)
+        return self.response({}, status_code=201)
+
+    def get(self, url, **kwargs):
+        # site identifier
+        return self.response({"id": 1})
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    @staticmethod
+    def response(body, status_code=200):
+        response = Mock(status_code=status_code, ok=status_code < 400, text=json.dumps(body))
+        response.json.return_value = body
+        if status_code >= 400:
+            response.raise_for_status.side_effect = cron_service.req.HTTPError(f"{status_code} Server Error")
+        return response
+
+    def paths(self, method="POST"):
+        return [path for m, path, _ in self.requests if m == method]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    fake = FakeServer()
+    monkeypatch.setattr(cron_service, "get_http_session", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def exited_sessions(app, sessions, feedback, results, db_session, monkeypatch):
+    """The ranking sessions have exited, every one with a feedback and its interleaved ranking."""
+    monkeypatch.setitem(app.config, "INTERLEAVE", True)
+    exited = []
+    for name in ("ranker_base", "ranker"):
+        session = sessions[name]
+        session.exit = True
+        session.site_user = f"user-{name}"
+        results[name].feedback_id = feedback[name].id
+        exited.append(session)
+    db_session.commit()
+    return exited
+
+
+def sent(db_session):
+    return {session.id for session in db_session.query(Session).filter_by(sent=True)}
+
+
+class TestPostSessions:
+    def test_sessions_are_posted(self, app, server, exited_sessions, db_session):
+        post_sessions(exited_sessions)
+
+        assert server.paths().count("/sites/1/sessions") == 2
+        assert sum(path.endswith("/feedbacks") for path in server.paths()) == 2
+        assert sum(path.endswith("/rankings") for path in server.paths()) == 2
+        assert sorted(server.paths("GET")) == ["/system/id/ranker", "/system/id/ranker_base"]
+        assert sent(db_session) == {session.id for session in exited_sessions}
+
+    def test_failed_session_is_not_sent(self, app, server, exited_sessions, db_session):
+        server.failing_sessions.add("user-ranker")
+
+        post_sessions(exited_sessions)
+
+        assert sent(db_session) == {exited_sessions[0].id}
+
+    def test_batch(self, app, server, exited_sessions, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "UPLOAD_MODE", "batch")
+        monkeypatch.setitem(app.config, "UPLOAD_BATCH_SIZE", 10)
+
+        post_sessions(exited_sessions)
+
+        assert server.paths() == ["/sites/1/sessions/batch"]
+        payload = server.requests[0][2]["json"]
+        assert [session["site_user"] for session in payload["sessions"]] == ["user-ranker_base", "user-ranker"]
+        rankings = [feedback["rankings"] for session in payload["sessions"] for feedback in session["feedbacks"]]
+        assert [[ranking["system"] for ranking in feedback] for feedback in rankings] == [["ranker_base"], ["ranker"]]
+        # no lookup of the server ids of the systems
+        assert server.paths("GET") == []
+        assert sent(db_session) == {session.id for session in exited_sessions}
+
+    def test_sent_sessions_are_deleted(self, app, server, exited_sessions, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "DELETE_SENT_SESSION", True)
+        session_ids = [session.id for session in exited_sessions]
+
+        post_sessions(exited_sessions)
+
+        assert db_session.query(Session).filter(Session.id.in_(session_ids)).count() == 0
+        assert db_session.query(Result).filter(Result.session_id.in_(session_ids)).count() == 0
+        assert db_session.query(Upload).count() == 0
+
+    def test_http_session_is_pooled(self, app):
+        assert get_http_session() is get_http_session()
+
+
+class TestServerSystemIds:
+    upload = ResultUpload("rankings", "ranker", {"q": "test"})
+
+    def test_ids_are_looked_up_once(self, app, server):
+        for feedback_id in range(3):
+            assert post_result(self.upload, feedback_id) == 201
+
+        assert server.paths("GET") == ["/system/id/ranker"]
+
+    def test_ids_are_looked_up_again_with_a_new_token(self, app, server, monkeypatch):
+        post_result(self.upload, 1)
+        monkeypatch.setitem(app.config, "STELLA_SERVER_TOKEN", "new token")
+        post_result(self.upload, 2)
+
+        assert server.paths("GET") == ["/system/id/ranker"] * 2
+
+    def test_outdated_id_is_looked_up_again(self, app, server):
+        post_result(self.upload, 1)
+        server.system_id = 8
+
+        assert post_result(self.upload, 2) == 201
+        assert server.paths("GET") == ["/system/id/ranker"] * 2
+        assert server.requests[-1][2]["data"]["system_id"] == 8
+
+
+def session_keys(server):
+    return {kwargs["headers"]["Idempotency-Key"] for _, path, kwargs in server.requests if path.endswith("/sessions")}
+
+
+class TestOutbox:
+    def test_failed_units_are_resumed(self, app, server, exited_sessions, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "UPLOAD_BACKOFF", 0)
+        server.failures["/feedbacks"] = 2
+
+        post_sessions(exited_sessions)
+        assert sent(db_session) == set()
+        assert db_session.query(Upload).filter_by(kind="session", status="sent").count() == 2
+
+        server.requests.clear()
+        post_sessions(exited_sessions)
+
+        # the sessions are not posted again
+        assert "/sites/1/sessions" not in server.paths()
+        assert sum(path.endswith("/feedbacks") for path in server.paths()) == 2
+        assert sum(path.endswith("/rankings") for path in server.paths()) == 2
+        assert sent(db_session) == {session.id for session in exited_sessions}
+
+    def test_retries_keep_their_idempotency_key(self, app, server, exited_sessions, monkeypatch):
+        monkeypatch.setitem(app.config, "UPLOAD_BACKOFF", 0)
+        server.failures["/sessions"] = 2
+
+        post_sessions(exited_sessions)
+        first_keys = session_keys(server)
+        server.requests.clear()
+        post_sessions(exited_sessions)
+        retried_keys = session_keys(server)
+
+        assert len(first_keys) == 2
+        assert retried_keys == first_keys
+
+    def test_failed_units_back_off(self, app, server, exited_sessions, db_session):
+        server.failures["/rankings"] = 2
+
+        post_sessions(exited_sessions)
+        server.requests.clear()
+        post_sessions(exited_sessions)
+
+        assert server.paths() == []
+        upload = db_session.query(Upload).filter_by(kind="ranking").first()
+        assert upload.attempts == 1
+        assert upload.next_attempt is not None
+
+    def test_outbox_is_not_updated_after_losing_the_leadership(self, app, server, exited_sessions, db_session):
+        lock = Mock(is_held=Mock(return_value=False))
+
+        post_sessions(exited_sessions, lock)
+
+        # the units are posted again by the next leader with the same idempotency keys
+        assert server.paths() != []
+        assert db_session.query(Upload).filter(Upload.status != "pending").count() == 0
+        assert sent(db_session) == set()
+
+    def test_units_are_given_up(self, app, server, exited_sessions, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "UPLOAD_MAX_ATTEMPTS", 1)
+        server.failures["/feedbacks"] = 2
+
+        post_sessions(exited_sessions)
+
+        # the rankings of the feedback cannot be posted anymore
+        assert db_session.query(Upload).filter_by(status="failed").count() == 4
+        # the sessions never reached the server, they are neither sent nor deleted
+        assert sent(db_session) == set()
+        assert all(db_session.get(Session, session.id) is not None for session in exited_sessions)
+
+        post_sessions(exited_sessions)
+        assert sent(db_session) == set()
+
+        assert retry_failed([session.id for session in exited_sessions]) == 4
+        db_session.commit()
+        post_sessions(exited_sessions)
+
+        assert db_session.query(Upload).filter_by(status="failed").count() == 0
+        assert sent(db_session) == {session.id for session in exited_sessions}
+
+
+def add_interleaved_rankings(db_session, session):
+    """Interleaved ranking of a session, referenced by its baseline and experimental ranking and an impression."""
+    ranking = Result(session_id=session.id, system_id=session.system_ranking, type="RANK", q="test")
+    db_session.add(ranking)
+    db_session.flush()
+    ranking.tdi = ranking.id
+    for team in ("BASE", "EXP"):
+        db_session.add(
+            Result(session_id=session.id, system_id=session.system_ranking, type=team, q="test", tdi=ranking.id)
+        )
+    db_session.add(
+        Result(session_id=session.id, system_id=session.system_ranking, type="RANK", q="test", tdi=ranking.id, ref=ranking.id)
+    )
+    db_session.commit()
+
+
+class TestDeleteSessions:
+    def test_sessions_are_deleted_in_chunks(self, app, sessions, feedback, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "DELETE_CHUNK_SIZE", 1)
+        deleted_ids = [sessions["ranker_base"].id, sessions["ranker"].id]
+        for session_id in deleted_ids:
+            add_interleaved_rankings(db_session, db_session.get(Session, session_id))
+
+        assert delete_sessions(deleted_ids) == 2
+
+        assert db_session.query(Session).filter(Session.id.in_(deleted_ids)).count() == 0
+        assert db_session.query(Feedback).filter(Feedback.session_id.in_(deleted_ids)).count() == 0
+        assert db_session.query(Result).filter(Result.session_id.in_(deleted_ids)).count() == 0
+        # other sessions are kept
+        assert db_session.get(Session, sessions["recommender"].id) is not None
+        assert db_session.query(Feedback).filter_by(session_id=sessions["recommender"].id).count() == 1
+
+    def test_sessions_without_feedback_are_killed(self, app, sessions, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "SESSION_EXPIRATION", -1)
+        monkeypatch.setitem(app.config, "SESSION_KILL", -1)
+        add_interleaved_rankings(db_session, sessions["ranker"])
+
+        update_expired_sessions()
+
+        assert db_session.query(Session).count() == 0
+        assert db_session.query(Result).count() == 0
+
+
+class TestExpiredSessions:
+    def test_sessions_with_feedback_exit(self, app, sessions, feedback, results, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "SESSION_EXPIRATION", -1)
+        monkeypatch.setitem(app.config, "SESSION_SCAN_PAGE_SIZE", 1)
+        results["ranker"].feedback_id = feedback["ranker"].id
+        results["recommender"].feedback_id = feedback["recommender"].id
+        db_session.commit()
+
+        update_expired_sessions()
+
+        exited = {session.id for session in db_session.query(Session).filter_by(exit=True)}
+        assert exited == {sessions["ranker"].id, sessions["recommender"].id}
+        # sessions without feedback are kept without SESSION_KILL
+        assert db_session.query(Session).count() == 4
+
+    def test_running_sessions_are_not_changed(self, app, sessions, feedback, results, db_session):
+        results["ranker"].feedback_id = feedback["ranker"].id
+        db_session.commit()
+
+        update_expired_sessions()
+
+        assert db_session.query(Session).filter_by(exit=True).count() == 0
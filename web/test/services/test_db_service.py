@@ -0,0 +1,82 @@
+import pytest
+from app.models import Result, System
+from app.services.counter_service import count_request, pending_requests
+from app.services.db_service import get_async_database_uri, get_async_engine
+from app.services.result_service import make_results, save_results
+from app.services.system_service import get_system_id
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class TestAsyncDatabaseUri:
+    @pytest.mark.parametrize(
+        "uri, expected",
+        [
+            ("sqlite:////tmp/data.sqlite", "sqlite+aiosqlite:////tmp/data.sqlite"),
+            (
+                "postgresql://user:pw@db:5432/stella",
+                "postgresql+asyncpg://user:pw@db:5432/stella",
+            ),
+            (
+                "postgresql+psycopg2://user:pw@db/stella",
+                "postgresql+asyncpg://user:pw@db/stella",
+            ),
+        ],
+    )
+    def test_async_driver(self, app, monkeypatch, uri, expected):
+        monkeypatch.setitem(app.config, "SQLALCHEMY_DATABASE_URI", uri)
+        assert get_async_database_uri() == expected
+
+    def test_explicit_uri(self, app, monkeypatch):
+        monkeypatch.setitem(app.config, "ASYNC_DATABASE_URI", "sqlite+aiosqlite://")
+        assert get_async_database_uri() == "sqlite+aiosqlite://"
+
+
+class TestAsyncDatabase:
+    @pytest.mark.asyncio
+    async def test_get_system_id(self, async_database):
+        with Session(async_database) as session:
+            expected = session.query(System.id).filter_by(name="ranker").scalar()
+
+        assert await get_system_id("ranker") == expected
+        assert await get_system_id("unknown") is None
+
+    @pytest.mark.asyncio
+    async def test_make_results(
+        self,
+        app,
+        async_database,
+        monkeypatch,
+        mock_request_base_system,
+        mock_request_system,
+        sessions,
+    ):
+        app.config["INTERLEAVE"] = True
+        monkeypatch.setitem(app.config, "COUNTER_FLUSH_INTERVAL", 0)
+
+        response = await make_results(
+            "ranker", "Test Query", 10, 0, sessions["ranker"].id
+        )
+
+        rid = response["header"]["rid"]
+        with Session(async_database) as session:
+            rankings = session.query(Result).filter_by(tdi=rid).all()
+            assert {ranking.type for ranking in rankings} == {"BASE", "EXP", "RANK"}
+            system = session.query(System).filter_by(name="ranker").first()
+            assert system.num_requests_no_head == 1
+
+    @pytest.mark.asyncio
+    async def test_commit_failure_keeps_counters(self, app, async_database, monkeypatch, sessions):
+        monkeypatch.setitem(app.config, "COUNTER_FLUSH_INTERVAL", 0)
+        count_request("ranker")
+        ranking = Result(id=1000, session_id=sessions["ranker"].id, q="failed commit", page=0)
+
+        def fail_commit(conn):
+            raise RuntimeError("connection lost")
+
+        event.listen(get_async_engine().sync_engine, "commit", fail_commit)
+
+        with pytest.raises(RuntimeError):
+            await save_results(ranking)
+
+        assert pending_requests("ranker") == 1
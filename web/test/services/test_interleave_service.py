@@ -1,6 +1,13 @@
+import random
 from unittest.mock import patch
 
-from app.services.interleave_service import interleave_rankings, team_draft_interleave
+from app.models import Result, db
+from app.services.interleave_service import (
+    add_missing_results,
+    interleave_rankings,
+    select_items,
+    team_draft_interleave,
+)
 
 from ..create_test_data import create_results
 
@@ -268,3 +275,49 @@ class TestInterleaving:
             assert (
                 count <= upper_bound
             ), f"Failed: {pattern} occurred {count} times (Expected ~250)."
+
+
+class TestSelectionStorage:
+    def test_select_items(self):
+        docids = [f"doc{i}" for i in range(8)]
+        for _ in range(200):
+            base = random.sample(docids, random.randint(0, 6))
+            exp = random.sample(docids, random.randint(0, 6))
+            rpp = random.randint(1, 10)
+            item_dict = team_draft_interleave(base, exp, rpp=rpp)
+            if len(item_dict) < rpp:
+                item_dict = add_missing_results(base, item_dict, "BASE", rpp)
+                item_dict = add_missing_results(exp, item_dict, "EXP", rpp)
+
+            teams = [item["type"] for item in item_dict.values()]
+            assert select_items(base, exp, teams) == item_dict
+
+    def test_team_runs_out_of_docids(self):
+        assert select_items(["doc1"], ["doc1"], ["BASE", "EXP"]) is None
+
+    def test_interleaved_ranking_is_rebuilt(self, app, sessions, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "INTERLEAVED_STORAGE", "selection")
+        result = create_results(sessions)
+        results_base, results_exp = result["ranker_base"], result["ranker"]
+        results_base.type, results_exp.type = "BASE", "EXP"
+        results_base.items = {
+            1: {"docid": "doc1", "type": "BASE"},
+            2: {"docid": "doc2", "type": "BASE"},
+            3: {"docid": "doc3", "type": "BASE"},
+        }
+        results_exp.items = {
+            1: {"docid": "doc2", "type": "EXP"},
+            2: {"docid": "doc12", "type": "EXP"},
+        }
+        db.session.add_all([results_base, results_exp])
+
+        interleaved = interleave_rankings(results_exp, results_base, "ranking", rpp=5)
+        expected = {str(k): v for k, v in interleaved.items.items()}
+        db.session.commit()
+        db.session.expire_all()
+
+        ranking = db.session.get(Result, interleaved.id)
+        assert ranking._items is None
+        assert len(ranking.selection) == 3
+        assert ranking.items == expected
+        assert ranking.serialize["items"] == expected
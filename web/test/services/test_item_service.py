@@ -0,0 +1,166 @@
+import pytest
+from app.models import Document, Result, db
+from app.services.item_service import (
+    can_pack,
+    decode_items,
+    encode_items,
+    intern_docids,
+    lookup_docids,
+    reset_docid_cache,
+)
+from app.services.result_service import make_results
+from app.services.writer_service import flush_results
+from sqlalchemy.orm import Session
+
+ITEMS = {
+    "1": {"docid": "doc1", "type": "EXP"},
+    "2": {"docid": "doc2", "type": "BASE"},
+    "3": {"docid": "doc1", "type": "BASE"},
+}
+
+
+@pytest.fixture
+def compact_storage(app, monkeypatch):
+    monkeypatch.setitem(app.config, "ITEM_STORAGE", "compact")
+
+
+class TestEncoding:
+    def test_roundtrip(self, app, db_session):
+        ids = intern_docids(["doc1", "doc2"])
+
+        data = encode_items(ITEMS, ids)
+
+        # count, one id per item and the team bits
+        assert len(data) == 2 + 3 * 4 + 1
+        assert decode_items(data) == ITEMS
+
+    def test_can_pack(self):
+        assert can_pack(ITEMS)
+        assert can_pack({1: {"docid": "doc1", "type": "EXP"}})
+        assert not can_pack({})
+        assert not can_pack(None)
+        assert not can_pack({"2": {"docid": "doc1", "type": "EXP"}})
+        assert not can_pack({"1": {"docid": "doc1", "type": "RANK"}})
+        assert not can_pack({"1": {"docid": 1, "type": "EXP"}})
+        assert not can_pack({"1": {"docid": "doc1", "type": "EXP", "score": 1}})
+
+
+class TestInterning:
+    def test_docids_are_interned_once(self, app, db_session):
+        ids = intern_docids(["doc1", "doc2"])
+        db_session.commit()
+
+        assert intern_docids(["doc2", "doc1", "doc3"]).items() >= ids.items()
+        assert db_session.query(Document).count() == 3
+
+    def test_rolled_back_docids_are_not_cached(self, app, db_session):
+        intern_docids(["doc1"])
+        db_session.rollback()
+        assert db_session.query(Document).count() == 0
+
+        ids = intern_docids(["doc1"])
+
+        assert db_session.query(Document).filter_by(docid="doc1").one().id == ids["doc1"]
+
+    def test_docids_of_rolled_back_savepoint(self, app, db_session):
+        with pytest.raises(RuntimeError):
+            with db_session.begin_nested():
+                intern_docids(["doc1"])
+                raise RuntimeError("insert failed")
+
+        ids = intern_docids(["doc1"])
+        db_session.commit()
+
+        assert db_session.query(Document).filter_by(docid="doc1").one().id == ids["doc1"]
+        assert intern_docids(["doc1"]) == ids
+
+    def test_docids_are_looked_up_without_cache(self, app, db_session):
+        ids = intern_docids(["doc1"])
+        db_session.commit()
+        reset_docid_cache()
+
+        assert lookup_docids([ids["doc1"]]) == {ids["doc1"]: "doc1"}
+
+
+class TestCompactStorage:
+    @pytest.mark.asyncio
+    async def test_make_results(
+        self,
+        app,
+        compact_storage,
+        mock_request_base_system,
+        mock_request_system,
+        sessions,
+        db_session,
+    ):
+        app.config["INTERLEAVE"] = True
+
+        response = await make_results(
+            "ranker", "Test Query", 10, 0, sessions["ranker"].id
+        )
+        rid = response["header"]["rid"]
+        items = {str(position): item for position, item in response["body"].items()}
+        db_session.expire_all()
+        reset_docid_cache()
+
+        rankings = db_session.query(Result).filter_by(tdi=rid).all()
+        assert all(ranking.ranked is not None for ranking in rankings)
+        assert all(ranking._items is None for ranking in rankings)
+        assert db_session.get(Result, rid).items == items
+
+    def test_items_that_cannot_be_packed(self, app, compact_storage, sessions, db_session):
+        items = {"1": {"docid": "doc1", "type": "EXP", "score": 1.5}}
+        ranking = Result(session_id=sessions["ranker"].id, q="Test Query", page=0, items=items)
+        db.session.add(ranking)
+        db.session.commit()
+
+        assert ranking.ranked is None
+        assert ranking.items == items
+
+    @pytest.mark.asyncio
+    async def test_async_database(
+        self,
+        app,
+        compact_storage,
+        async_database,
+        mock_request_base_system,
+        mock_request_system,
+        sessions,
+    ):
+        app.config["INTERLEAVE"] = True
+
+        response = await make_results(
+            "ranker", "Test Query", 10, 0, sessions["ranker"].id
+        )
+
+        rid = response["header"]["rid"]
+        with Session(async_database) as session:
+            rankings = session.query(Result).filter_by(tdi=rid).all()
+            assert all(ranking.ranked is not None for ranking in rankings)
+            assert session.query(Document).count() > 0
+
+    @pytest.mark.asyncio
+    async def test_background_writer(
+        self,
+        app,
+        compact_storage,
+        mock_request_base_system,
+        mock_request_system,
+        sessions,
+        db_session,
+        monkeypatch,
+    ):
+        monkeypatch.setitem(app.config, "ASYNC_RESULT_LOGGING", True)
+        monkeypatch.setitem(app.config, "RESULT_FLUSH_INTERVAL", 60)
+        app.config["INTERLEAVE"] = True
+
+        response = await make_results(
+            "ranker", "Test Query", 10, 0, sessions["ranker"].id
+        )
+        rid = response["header"]["rid"]
+        items = {str(position): item for position, item in response["body"].items()}
+        assert flush_results() == 3
+
+        rankings = db_session.query(Result).filter_by(tdi=rid).all()
+        assert all(ranking.ranked is not None for ranking in rankings)
+        assert db_session.get(Result, rid).items == items
@@ -0,0 +1,53 @@
+import copy
+
+import pytest
+from app.services.jsonpath_service import CompiledPath, FallbackPath, compile_path
+from jsonpath_ng import parse
+
+RESPONSE = {
+    "took": 3,
+    "hits": {
+        "total": {"value": 2},
+        "hits": [{"_id": "doc1", "id": "doc1"}, {"_id": "doc2", "id": "doc2"}],
+    },
+}
+
+
+class TestCompilePath:
+    @pytest.mark.parametrize(
+        "expression",
+        ["$.hits.hits", "hits.hits", '$["hits"].hits', "$.hits.hits[1]", "$.hits.total.value"],
+    )
+    def test_simple_paths_are_compiled(self, expression):
+        path = compile_path(expression)
+
+        assert isinstance(path, CompiledPath)
+        assert path.get(RESPONSE) == parse(expression).find(RESPONSE)[0].value
+
+    @pytest.mark.parametrize(
+        "expression", ["$.hits.hits[*]", "$..id", "$.hits.hits[-1]", "$.hits.*", "$.hits.hits[0:1]"]
+    )
+    def test_complex_paths_fall_back(self, expression):
+        path = compile_path(expression)
+
+        assert isinstance(path, FallbackPath)
+        assert path.get(RESPONSE) == parse(expression).find(RESPONSE)[0].value
+
+    def test_parsed_path(self):
+        path = compile_path(parse("$.hits.hits"))
+
+        assert isinstance(path, CompiledPath)
+        assert str(path) == "$.hits.hits"
+
+    @pytest.mark.parametrize("expression", ["$.hits.missing", "$.hits.hits[5]", "$.took.hits"])
+    def test_missing_path(self, expression):
+        with pytest.raises(LookupError):
+            compile_path(expression).get(RESPONSE)
+
+    @pytest.mark.parametrize(
+        "expression", ["$.hits.hits", "$.hits.hits[0]", "$.hits.missing"]
+    )
+    def test_set_like_update(self, expression):
+        expected = parse(expression).update(copy.deepcopy(RESPONSE), ["new"])
+
+        assert compile_path(expression).set(copy.deepcopy(RESPONSE), ["new"]) == expected
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+from app.models import Lease
+from app.services import cron_service
+from app.services.cron_service import run_sync_worker
+from app.services.leader_service import LeaderLock
+from sqlalchemy import create_engine
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """Database shared by the competing processes, outside of the rolled back test transaction."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'leader.sqlite'}")
+    Lease.__table__.create(engine)
+    yield engine
+    engine.dispose()
+
+
+class TestLeaderLock:
+    def test_only_one_leader(self, app, engine):
+        first = LeaderLock("sync-worker", engine)
+        second = LeaderLock("sync-worker", engine)
+
+        assert first.acquire()
+        assert not second.acquire()
+        # the leader renews its lease
+        assert first.acquire()
+        assert not second.acquire()
+
+    def test_other_jobs_have_their_own_leader(self, app, engine):
+        assert LeaderLock("sync-worker", engine).acquire()
+        assert LeaderLock("other", engine).acquire()
+
+    def test_released_leadership_is_taken_over(self, app, engine):
+        first = LeaderLock("sync-worker", engine)
+        second = LeaderLock("sync-worker", engine)
+        first.acquire()
+
+        first.release()
+
+        assert second.acquire()
+        assert not first.acquire()
+
+    def test_expired_lease_is_taken_over(self, app, engine):
+        # the leader crashed and did not renew its lease
+        crashed = LeaderLock("sync-worker", engine, lease_ttl=-1)
+        crashed.acquire()
+
+        assert LeaderLock("sync-worker", engine).acquire()
+        assert not crashed.acquire()
+
+
+    def test_leadership_is_renewed_while_the_job_runs(self, app, engine):
+        leader = LeaderLock("sync-worker", engine, lease_ttl=0.3)
+        leader.acquire()
+
+        with leader.renewing():
+            # the job takes longer than the lease
+            time.sleep(0.6)
+            assert leader.is_held()
+            assert not LeaderLock("sync-worker", engine).acquire()
+
+    def test_expired_lease_is_not_held(self, app, engine):
+        leader = LeaderLock("sync-worker", engine, lease_ttl=0.1)
+        assert not leader.is_held()
+        leader.acquire()
+        assert leader.is_held()
+
+        time.sleep(0.2)
+
+        assert not leader.is_held()
+
+
+class TestSyncWorker:
+    def test_only_the_leader_syncs(self, app, engine, monkeypatch):
+        monkeypatch.setitem(app.config, "INTERVAL_DB_CHECK", 0)
+        leader = LeaderLock("sync-worker", engine)
+        leader.acquire()
+        follower = LeaderLock("sync-worker", engine)
+        monkeypatch.setattr(cron_service, "get_leader_lock", lambda: follower)
+
+        attempts = []
+        acquire = follower.acquire
+
+        def acquire_once_the_leader_is_gone():
+            acquired = acquire()
+            attempts.append(acquired)
+            if not acquired:
+                leader.release()
+            return acquired
+
+        monkeypatch.setattr(follower, "acquire", acquire_once_the_leader_is_gone)
+        stop = threading.Event()
+        syncs = []
+
+        def sync_sessions(lock):
+            syncs.append(lock.is_held())
+            stop.set()
+
+        monkeypatch.setattr(cron_service, "sync_sessions", sync_sessions)
+
+        run_sync_worker(stop)
+
+        assert attempts == [False, True]
+        assert syncs == [True]
+        # the leadership is released when the worker stops
+        assert LeaderLock("sync-worker", engine).acquire()
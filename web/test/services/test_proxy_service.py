@@ -1,6 +1,7 @@
 import aiohttp
 import pytest
 from app.models import Result, System
+from app.services.counter_service import flush_counters
 from app.services.proxy_service import (
     forward_request,
     make_results,
@@ -49,6 +50,7 @@ class TestForwardRequest:
             system_role="EXP",
         )
 
+        flush_counters()  # request counters are written in batches
         system = db_session.query(System).filter_by(name=container_name).first()
         assert system.num_requests_no_head == 1
 
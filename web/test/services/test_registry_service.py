@@ -0,0 +1,240 @@
+import pytest
+from datetime import datetime
+
+from app.models import System, SystemsConfig
+from app.services.breaker_service import get_breaker
+from app.services.cache_service import is_cacheable
+from app.services.client_service import get_pool_settings
+from app.services.registry_service import (
+    compile_registry,
+    get_registry,
+    get_system,
+    get_system_name,
+    hash_systems_config,
+    reset_system_registry,
+    sync_registry,
+    sync_registry_if_due,
+)
+
+SHARED_CONFIG = {
+    "ranker_base": {"type": "ranker", "base": True},
+    "ranker": {"type": "ranker", "url": "http://ranker.example:8000"},
+    "ranker_2": {"type": "ranker"},
+}
+
+
+class TestCompileRegistry:
+    def test_compile(self, app):
+        registry = compile_registry(
+            {
+                "ranker_base": {"type": "ranker", "base": True},
+                "ranker": {
+                    "type": "ranker",
+                    "docid": "id",
+                    "hits_path": "$.hits.hits",
+                    "url": "http://ranker.example:8000",
+                },
+            },
+            {"ranker": 2},
+        )
+
+        base, ranker = registry["ranker_base"], registry["ranker"]
+        assert base.base_url == "http://ranker_base:5000"
+        assert base.docid == "docid"
+        assert base.hits_path is None
+        assert base.system_id is None
+        assert ranker.base_url == "http://ranker.example:8000"
+        assert ranker.docid == "id"
+        assert ranker.hits_path.get({"hits": {"hits": [1]}}) == [1]
+        assert registry.names == {2: "ranker"}
+
+    def test_request_settings(self, app):
+        registry = compile_registry(
+            {
+                "ranker_base": {"type": "ranker", "base": True},
+                "ranker": {"type": "ranker", "timeout": 0.5, "breaker_failures": 1, "cache": False},
+                "ranker_2": {"type": "ranker", "cache_ttl": 10},
+            },
+            {},
+        )
+
+        base, ranker, ranker_2 = registry["ranker_base"], registry["ranker"], registry["ranker_2"]
+        assert base.pool["timeout"] == app.config["HTTP_TIMEOUT"]
+        assert base.breaker["failures"] == app.config["CIRCUIT_BREAKER_FAILURES"]
+        assert base.cache_ttl == app.config["RESULT_CACHE_TTL"]
+        assert ranker.pool["timeout"] == 0.5
+        assert ranker.pool["limit"] == app.config["HTTP_POOL_LIMIT"]
+        assert ranker.breaker["failures"] == 1
+        assert ranker.cache_ttl == 0
+        assert ranker_2.cache_ttl == 10
+
+    def test_registry_is_immutable(self, app):
+        registry = compile_registry({"ranker": {"type": "ranker"}}, {})
+
+        with pytest.raises(AttributeError):
+            registry["ranker"].base_url = "http://other:5000"
+        with pytest.raises(AttributeError):
+            registry.systems = {}
+        with pytest.raises(TypeError):
+            registry.systems["other"] = registry["ranker"]
+        with pytest.raises(AttributeError):
+            registry["ranker"].__dict__
+
+
+class TestSystemRegistry:
+    def test_database_ids(self, app, systems, db_session):
+        system = db_session.query(System).filter_by(name="ranker").first()
+
+        assert get_system("ranker").system_id == system.id
+        assert get_system_name(system.id) == "ranker"
+        with pytest.raises(KeyError):
+            get_system("unknown")
+
+    def test_set_systems_config_swaps_registry(self, app, client, systems, db_session):
+        registry = get_registry()
+
+        response = client.post(
+            "/set_systems_config",
+            json={
+                "ranker_base": {"type": "ranker", "base": True},
+                "ranker": {"type": "ranker", "url": "http://ranker.example:8000"},
+            },
+        )
+
+        assert response.status_code == 200
+        assert get_registry() is not registry
+        assert get_system("ranker").base_url == "http://ranker.example:8000"
+        assert "recommender" not in get_registry()
+        # the old snapshot is unchanged for requests that still use it
+        assert registry["ranker"].base_url == "http://ranker:5000"
+
+    def test_swapped_registry_changes_request_settings(self, app, client, systems, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "SYSTEMS_CONFIG", app.config["SYSTEMS_CONFIG"])
+        breaker = get_breaker("ranker")
+        assert is_cacheable("ranker")
+
+        response = client.post(
+            "/set_systems_config",
+            json={
+                "ranker_base": {"type": "ranker", "base": True},
+                "ranker": {"type": "ranker", "breaker_failures": 1, "cache": False, "timeout": 0.5},
+            },
+        )
+
+        assert response.status_code == 200
+        assert get_breaker("ranker") is breaker
+        assert breaker.failure_threshold == 1
+        assert not is_cacheable("ranker")
+        assert get_pool_settings("ranker")["timeout"] == 0.5
+
+    def test_invalid_config_keeps_registry(self, app, client, systems, db_session):
+        registry = get_registry()
+
+        response = client.post(
+            "/set_systems_config",
+            json={
+                "ranker_base": {"type": "ranker", "base": True},
+                "ranker": {"type": "ranker", "base": True},
+            },
+        )
+
+        assert response.status_code == 400
+        assert get_registry() is registry
+
+
+class TestRegistrySync:
+    def publish(self, db_session, config, startup_hash):
+        db_session.add(SystemsConfig(config=config, startup_hash=startup_hash, created=datetime(2024, 1, 1)))
+        db_session.commit()
+
+    def test_published_config_is_used_by_other_workers(self, app, client, systems, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "SYSTEMS_CONFIG", app.config["SYSTEMS_CONFIG"])
+        response = client.post("/set_systems_config", json=SHARED_CONFIG)
+        assert response.status_code == 200
+        assert db_session.query(SystemsConfig).count() == 1
+
+        # another worker still has the config it was started with
+        reset_system_registry()
+        monkeypatch.setitem(app.config, "SYSTEMS_CONFIG", {"ranker": {"type": "ranker"}})
+        monkeypatch.setitem(app.config, "RANKING_CONTAINER_NAMES", ["ranker"])
+
+        assert sync_registry()
+        assert get_system("ranker").base_url == "http://ranker.example:8000"
+        assert sorted(app.config["RANKING_CONTAINER_NAMES"]) == ["ranker", "ranker_2", "ranker_base"]
+        assert not sync_registry()
+
+    def test_publishing_worker_does_not_reload(self, app, client, systems, db_session):
+        client.post("/set_systems_config", json=SHARED_CONFIG)
+        registry = get_registry()
+
+        assert not sync_registry()
+        assert get_registry() is registry
+
+    def test_sync_before_request(self, app, client, systems, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "REGISTRY_SYNC_INTERVAL", 0)
+        monkeypatch.setitem(app.config, "SYSTEMS_CONFIG", app.config["SYSTEMS_CONFIG"])
+        assert "ranker_2" not in get_registry()
+        self.publish(db_session, SHARED_CONFIG, app.config["SYSTEMS_CONFIG_HASH"])
+
+        client.get("/cache_stats")
+
+        assert "ranker_2" in get_registry()
+
+    def test_sync_interval(self, app, systems, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "REGISTRY_SYNC_INTERVAL", 60)
+        monkeypatch.setitem(app.config, "SYSTEMS_CONFIG", app.config["SYSTEMS_CONFIG"])
+        assert not sync_registry_if_due()
+        self.publish(db_session, SHARED_CONFIG, app.config["SYSTEMS_CONFIG_HASH"])
+
+        # the next check is not due yet
+        assert not sync_registry_if_due()
+        assert "ranker_2" not in get_registry()
+
+    def test_invalid_config_is_skipped(self, app, systems, db_session):
+        registry = get_registry()
+        self.publish(
+            db_session,
+            {
+                "ranker_base": {"type": "ranker", "base": True},
+                "ranker": {"type": "ranker", "base": True},
+            },
+            app.config["SYSTEMS_CONFIG_HASH"],
+        )
+
+        assert not sync_registry()
+        assert get_registry() is registry
+
+    def test_stored_config_wins_over_same_startup_config(self, app, systems, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "SYSTEMS_CONFIG", app.config["SYSTEMS_CONFIG"])
+        self.publish(db_session, SHARED_CONFIG, app.config["SYSTEMS_CONFIG_HASH"])
+
+        assert sync_registry()
+        assert "ranker_2" in get_registry()
+        assert db_session.query(SystemsConfig).count() == 1
+
+    def test_startup_config_of_redeploy_wins(self, app, systems, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "SYSTEMS_CONFIG", app.config["SYSTEMS_CONFIG"])
+        startup_config = app.config["SYSTEMS_CONFIG"]
+        self.publish(db_session, SHARED_CONFIG, hash_systems_config({"ranker": {"type": "ranker"}}))
+
+        assert not sync_registry()
+        assert "ranker_2" not in get_registry()
+        assert app.config["SYSTEMS_CONFIG"] == startup_config
+
+        # the startup config is the new version for the other workers
+        latest = db_session.query(SystemsConfig).order_by(SystemsConfig.id.desc()).first()
+        assert db_session.query(SystemsConfig).count() == 2
+        assert latest.config == startup_config
+        assert latest.startup_hash == app.config["SYSTEMS_CONFIG_HASH"]
+        assert not sync_registry()
+
+    def test_newer_version_wins_after_startup(self, app, systems, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "SYSTEMS_CONFIG", app.config["SYSTEMS_CONFIG"])
+        self.publish(db_session, {"ranker_base": {"type": "ranker", "base": True}}, "old deployment")
+        assert not sync_registry()
+
+        # published by /set_systems_config of another worker of this deployment
+        self.publish(db_session, SHARED_CONFIG, app.config["SYSTEMS_CONFIG_HASH"])
+
+        assert sync_registry()
+        assert "ranker_2" in get_registry()
@@ -1,18 +1,25 @@
+import asyncio
 import json
 import os
 import time
+from unittest.mock import Mock
 
 import aiohttp
 import pytest
 from app.models import Result, System
+from app.services.counter_service import count_request, flush_counters, pending_requests
 from app.services.interleave_service import interleave_rankings
 from app.services.result_service import (
     build_response,
+    commit_results,
     extract_hits,
+    gather_within_budget,
     get_cached_response,
+    make_results,
     query_system,
     request_results_from_container,
 )
+from sqlalchemy import event
 
 from ..create_test_data import (
     STELLA_RETURN_PARAMETER,
@@ -191,6 +198,7 @@ class TestQuerySystem:
             system_role="BASE",
         )
 
+        flush_counters()  # request counters are written in batches
         system = db_session.query(System).filter_by(name=container_name).first()
         assert system.num_requests_no_head == 1
 
@@ -223,6 +231,7 @@ class TestQuerySystem:
             system_type="recommendation",
         )
 
+        flush_counters()  # request counters are written in batches
         system = db_session.query(System).filter_by(name=container_name).first()
         assert system.num_requests_no_head == 1
 
@@ -249,6 +258,7 @@ class TestQuerySystem:
             container_name, query, rpp, page, sessions["ranker"].id, system_role="EXP"
         )
 
+        flush_counters()  # request counters are written in batches
         system = db_session.query(System).filter_by(name=container_name).first()
         assert system.num_requests_no_head == 1
 
@@ -279,6 +289,7 @@ class TestQuerySystem:
             system_type="recommendation",
         )
 
+        flush_counters()  # request counters are written in batches
         system = db_session.query(System).filter_by(name=container_name).first()
         assert system.num_requests_no_head == 1
 
@@ -599,6 +610,75 @@ class TestBuildResponse:
             ]
 
 
+class TestMakeResults:
+    @pytest.mark.asyncio
+    async def test_make_results_single_commit(
+        self, app, mock_request_base_system, mock_request_system, sessions, db_session
+    ):
+        """The baseline, experimental and interleaved rankings are written in one transaction."""
+        app.config["INTERLEAVE"] = True
+        commits = []
+        event.listen(db_session, "after_commit", commits.append)
+
+        response = await make_results(
+            "ranker", "Test Query", 10, 0, sessions["ranker"].id
+        )
+
+        assert len(commits) == 1
+        rid = response["header"]["rid"]
+        rankings = db_session.query(Result).filter_by(tdi=rid).all()
+        assert {ranking.type for ranking in rankings} == {"BASE", "EXP", "RANK"}
+
+    @pytest.mark.asyncio
+    async def test_make_results_not_interleaved(
+        self, app, mock_request_system, sessions, db_session
+    ):
+        app.config["INTERLEAVE"] = False
+        commits = []
+        event.listen(db_session, "after_commit", commits.append)
+
+        response = await make_results(
+            "ranker", "Test Query", 10, 0, sessions["ranker"].id
+        )
+
+        assert len(commits) == 1
+        ranking = db_session.get(Result, response["_stella"]["rid"])
+        assert ranking.custom_response is not None
+
+    @pytest.mark.asyncio
+    async def test_make_results_counter_failure(
+        self, app, mock_request_system, sessions, db_session, monkeypatch
+    ):
+        """A failing counter update does not fail the request, the ranking is written and the counts are kept."""
+        app.config["INTERLEAVE"] = False
+        monkeypatch.setitem(app.config, "COUNTER_FLUSH_INTERVAL", 0)
+
+        def fail_counter_update(conn, cursor, statement, *args):
+            if statement.startswith("UPDATE systems"):
+                raise RuntimeError("deadlock detected")
+
+        event.listen(db_session.get_bind(), "before_cursor_execute", fail_counter_update)
+
+        response = await make_results(
+            "ranker", "Test Query", 10, 0, sessions["ranker"].id
+        )
+
+        assert db_session.get(Result, response["_stella"]["rid"]) is not None
+        assert pending_requests("ranker") == 1
+
+    def test_commit_failure_keeps_counters(self, app, sessions, db_session, monkeypatch):
+        """The counts flushed in the transaction of a failed commit are flushed again later."""
+        monkeypatch.setitem(app.config, "COUNTER_FLUSH_INTERVAL", 0)
+        count_request("ranker")
+        count_request("ranker")
+        monkeypatch.setattr(db_session, "commit", Mock(side_effect=RuntimeError("connection lost")))
+
+        with pytest.raises(RuntimeError):
+            commit_results(Result(session_id=sessions["ranker"].id, q="failed commit", page=0))
+
+        assert pending_requests("ranker") == 2
+
+
 class TestCachedResponse:
     def test_get_cached_response_no_result(self, db_session):
         cached_result = get_cached_response(
@@ -646,3 +726,74 @@ class TestCachedResponse:
 
         assert cached_result["hits"]["hits"][0]["id"] == "10014322236"
         assert cached_result["hits"]["total"] == 199073
+
+    def test_get_cached_response_impression(self, db_session, sessions, results, app):
+        """Reloads add an impression referencing the cached ranking instead of a copy of its items."""
+        app.config["SESSION_EXPIRATION"] = 10  # 10 seconds for testing
+
+        session_id = sessions["ranker_base"].id
+        original = (
+            db_session.query(Result)
+            .filter_by(q="test", page=0, session_id=session_id)
+            .first()
+        )
+        for _ in range(2):
+            cached_result = get_cached_response(
+                query="test", page=0, session_id=session_id
+            )
+            assert cached_result["body"] == original.items
+
+        impressions = db_session.query(Result).filter_by(ref=original.id).all()
+        assert len(impressions) == 2
+        for impression in impressions:
+            assert impression.items is None
+            assert impression.custom_response is None
+            assert impression.serialize["items"] == original.items
+
+
+class TestGatherWithinBudget:
+    @staticmethod
+    async def answer(value, delay=0):
+        await asyncio.sleep(delay)
+        return value
+
+    @pytest.mark.asyncio
+    async def test_no_budget(self):
+        baseline, experimental = await gather_within_budget(
+            self.answer("base", 0.05), self.answer("exp", 0.1), budget=None
+        )
+        assert (baseline, experimental) == ("base", "exp")
+
+    @pytest.mark.asyncio
+    async def test_within_budget(self):
+        baseline, experimental = await gather_within_budget(
+            self.answer("base"), self.answer("exp"), budget=1
+        )
+        assert (baseline, experimental) == ("base", "exp")
+
+    @pytest.mark.asyncio
+    async def test_experimental_exceeds_budget(self):
+        cancelled = asyncio.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        start = time.time()
+        baseline, experimental = await gather_within_budget(
+            self.answer("base"), slow(), budget=0.05
+        )
+
+        assert (baseline, experimental) == ("base", None)
+        assert cancelled.is_set()
+        assert time.time() - start < 1
+
+    @pytest.mark.asyncio
+    async def test_no_system_within_budget(self):
+        baseline, experimental = await gather_within_budget(
+            self.answer("base", 0.5), self.answer("exp", 0.1), budget=0.05
+        )
+        assert (baseline, experimental) == (None, "exp")
@@ -1,5 +1,14 @@
+from unittest.mock import patch
+
 from app.models import Session, Result
-from app.services.session_service import create_new_session
+from app.services.cron_service import delete_sessions
+from sqlalchemy import delete
+from app.services.session_service import (
+    create_new_session,
+    forget_session,
+    get_session_cache,
+    has_session,
+)
 
 
 def test_create_new_session_ranker(client, systems, db_session):
@@ -21,3 +30,56 @@ def test_create_new_session_recommender(client, systems, db_session):
 
     assert session_id == session.id
     assert session.system_recommendation == 3
+
+
+class TestSessionCache:
+    def test_new_session_is_cached(self, app, systems, db_session):
+        session_id = create_new_session(
+            container_name="ranker_base", sid=None, type="ranker"
+        )
+
+        assert get_session_cache().get(session_id) is True
+        with patch.object(db_session, "query") as query:
+            assert has_session(session_id)
+        query.assert_not_called()
+
+    def test_existing_session_is_cached(self, app, sessions, db_session):
+        session_id = sessions["ranker"].id
+
+        assert has_session(session_id)
+        assert get_session_cache().get(session_id) is True
+
+    def test_unknown_session_is_not_cached(self, app, db_session):
+        assert not has_session("unknown")
+        assert not has_session(None)
+        assert len(get_session_cache()) == 0
+
+    def test_forget_session(self, app, sessions, db_session):
+        session_id = sessions["ranker"].id
+        assert has_session(session_id)
+        db_session.delete(sessions["ranker"])
+        db_session.commit()
+
+        forget_session(session_id)
+
+        assert not has_session(session_id)
+
+    def test_deleted_sessions(self, app, sessions, db_session):
+        session_id = sessions["ranker"].id
+        assert has_session(session_id)
+
+        delete_sessions([session_id])
+
+        assert not has_session(session_id)
+
+    def test_session_deleted_by_another_process(self, app, sessions, db_session):
+        session_id = sessions["ranker"].id
+        assert has_session(session_id)
+
+        # the cache of this worker is not told
+        db_session.execute(delete(Session).where(Session.id == session_id))
+        db_session.commit()
+
+        assert not has_session(session_id, cached=False)
+        assert get_session_cache().get(session_id) is None
+        assert not has_session(session_id)
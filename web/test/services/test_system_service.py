@@ -0,0 +1,58 @@
+from app.models import System
+from app.services.breaker_service import get_breaker
+from app.services.system_service import get_least_served_system
+
+
+class TestGetLeastServedSystem:
+    def test_least_served_system(self, systems):
+        assert get_least_served_system("Test Query", type="RANK") == "ranker"
+        assert get_least_served_system("test_item", type="REC") == "recommender"
+
+    def test_skip_open_circuit(self, app, systems, db_session, monkeypatch):
+        second_ranker = System(
+            name="ranker_2",
+            type="RANK",
+            system_type="LIVE",
+            num_requests=0,
+            num_requests_no_head=1,
+        )
+        db_session.add(second_ranker)
+        db_session.commit()
+        monkeypatch.setitem(
+            app.config, "RANKING_CONTAINER_NAMES", ["ranker_base", "ranker", "ranker_2"]
+        )
+        monkeypatch.setitem(app.config["SYSTEMS_CONFIG"], "ranker_2", {"type": "ranker"})
+        assert get_least_served_system("Test Query", type="RANK") == "ranker"
+
+        breaker = get_breaker("ranker")
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        assert get_least_served_system("Test Query", type="RANK") == "ranker_2"
+
+    def test_skip_open_circuit_head_query(self, app, systems, db_session, monkeypatch):
+        db_session.add(
+            System(
+                name="ranker_2",
+                type="RANK",
+                system_type="LIVE",
+                num_requests=1,
+                num_requests_no_head=0,
+            )
+        )
+        db_session.commit()
+        monkeypatch.setitem(app.config, "HEAD_QUERIES", ["head query"])
+        assert get_least_served_system("head query", type="RANK") == "ranker"
+
+        breaker = get_breaker("ranker")
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        assert get_least_served_system("head query", type="RANK") == "ranker_2"
+
+    def test_all_circuits_open(self, systems):
+        breaker = get_breaker("ranker")
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        assert get_least_served_system("Test Query", type="RANK") == "ranker"
@@ -0,0 +1,147 @@
+import pytest
+from app.models import Document, Result
+from app.services.item_service import intern_docids
+from app.services.result_service import get_cached_response, make_results
+from app.services.writer_service import (
+    IdAllocator,
+    check_id_allocation,
+    flush_results,
+    get_pending_result,
+    get_result_writer,
+)
+
+
+@pytest.fixture
+def async_logging(app, monkeypatch):
+    monkeypatch.setitem(app.config, "ASYNC_RESULT_LOGGING", True)
+    # the tests flush the queue themselves
+    monkeypatch.setitem(app.config, "RESULT_FLUSH_INTERVAL", 60)
+
+
+class TestIdAllocator:
+    def test_ids_are_unique(self, results, db_session):
+        max_id = max(result.id for result in results.values())
+        allocator = IdAllocator(block_size=3)
+
+        ids = [allocator.allocate() for _ in range(7)]
+
+        assert len(set(ids)) == 7
+        assert min(ids) > max_id
+
+
+class TestResultWriter:
+    @pytest.mark.asyncio
+    async def test_rankings_are_written_in_the_background(
+        self,
+        app,
+        async_logging,
+        mock_request_base_system,
+        mock_request_system,
+        sessions,
+        db_session,
+    ):
+        app.config["INTERLEAVE"] = True
+
+        response = await make_results(
+            "ranker", "Test Query", 10, 0, sessions["ranker"].id
+        )
+        rid = response["header"]["rid"]
+        assert db_session.query(Result).filter_by(tdi=rid).count() == 0
+        assert get_pending_result(rid).type == "RANK"
+
+        assert flush_results() == 3
+
+        rankings = db_session.query(Result).filter_by(tdi=rid).all()
+        assert {ranking.type for ranking in rankings} == {"BASE", "EXP", "RANK"}
+        assert get_pending_result(rid) is None
+
+    @pytest.mark.asyncio
+    async def test_cached_response_of_pending_rankings(
+        self, app, async_logging, mock_request_system, sessions, db_session
+    ):
+        app.config["INTERLEAVE"] = False
+        session_id = sessions["ranker"].id
+
+        response = await make_results("ranker", "Test Query", 10, 0, session_id)
+        cached = get_cached_response("Test Query", 0, session_id)
+
+        assert cached["hits"] == response["hits"]
+        assert flush_results() == 2
+        assert (
+            db_session.query(Result)
+            .filter_by(q="Test Query", session_id=session_id)
+            .count()
+            == 2
+        )
+
+    def test_full_queue_is_written_by_the_request(
+        self, app, async_logging, monkeypatch, results, sessions, db_session
+    ):
+        monkeypatch.setitem(app.config, "RESULT_QUEUE_SIZE", 1)
+        monkeypatch.setitem(app.config, "RESULT_QUEUE_TIMEOUT", 0.01)
+        writer = get_result_writer()
+        rankings = [
+            Result(id=1000 + i, session_id=sessions["ranker"].id, q="full", page=0)
+            for i in range(2)
+        ]
+
+        writer.submit([rankings[0]])
+        writer.submit([rankings[1]])
+
+        assert [r.id for r in db_session.query(Result).filter_by(q="full")] == [1001]
+        assert flush_results() == 1
+        assert db_session.query(Result).filter_by(q="full").count() == 2
+
+    def test_bad_ranking_does_not_block_the_batch(
+        self, app, async_logging, results, sessions, db_session
+    ):
+        writer = get_result_writer()
+        taken_id = next(iter(results.values())).id
+        good = Result(id=1000, session_id=sessions["ranker"].id, q="bad batch", page=0)
+        bad = Result(id=taken_id, session_id=sessions["ranker"].id, q="bad batch", page=0)
+
+        writer.submit([good, bad])
+        assert flush_results() == 2
+
+        assert [r.id for r in db_session.query(Result).filter_by(q="bad batch")] == [1000]
+        assert get_pending_result(1000) is None
+        assert get_pending_result(taken_id) is bad
+
+        # the bad ranking is dropped after RESULT_MAX_ATTEMPTS failed writes
+        assert flush_results() == 1
+        assert flush_results() == 1
+        assert get_pending_result(taken_id) is None
+        assert flush_results() == 0
+
+    def test_docids_of_a_bad_ranking_are_not_reused(
+        self, app, async_logging, monkeypatch, results, sessions, db_session
+    ):
+        """The docids interned for a ranking that fails in its savepoint are rolled back with it."""
+        monkeypatch.setitem(app.config, "ITEM_STORAGE", "compact")
+        writer = get_result_writer()
+        items = {"1": {"docid": "docX", "type": "EXP"}}
+        taken_id = next(iter(results.values())).id
+        bad = Result(id=taken_id, session_id=sessions["ranker"].id, q="bad items", page=0, items=dict(items))
+        good = Result(id=1000, session_id=sessions["ranker"].id, q="bad items", page=0, items=dict(items))
+
+        writer.submit([bad, good])
+        flush_results()
+
+        db_session.expire_all()
+        assert db_session.get(Result, 1000).items == items
+        assert intern_docids(["docX"])["docX"] == db_session.query(Document).filter_by(docid="docX").one().id
+
+
+class TestCheckIdAllocation:
+    def test_single_worker_on_sqlite(self, app, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "ASYNC_DATABASE", True)
+        check_id_allocation(1)
+
+    def test_several_workers_on_sqlite(self, app, db_session, monkeypatch):
+        monkeypatch.setitem(app.config, "ASYNC_DATABASE", True)
+        with pytest.raises(RuntimeError):
+            check_id_allocation(4)
+
+    def test_ids_of_the_database(self, app, db_session):
+        # without ASYNC_RESULT_LOGGING and ASYNC_DATABASE the database assigns the ids
+        check_id_allocation(4)
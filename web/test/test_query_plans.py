@@ -0,0 +1,23 @@
+import pytest
+from benchmark.queries import explain, get_hot_queries, populate
+from sqlalchemy import text
+
+HOT_QUERIES = get_hot_queries()
+
+
+@pytest.fixture
+def synthetic_data(db_session):
+    connection = db_session.connection()
+    populate(connection, num_sessions=500)
+    connection.execute(text("ANALYZE"))
+    return connection
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_query_uses_index(synthetic_data, name):
+    """The hot queries must not turn into full table scans. See `benchmark/queries.py` for plans and latencies on large databases."""
+    query = HOT_QUERIES[name]
+    plan = explain(synthetic_data, query.build())
+
+    assert query.index in plan
+    assert "SCAN" not in plan